@@ -0,0 +1,892 @@
+#!/usr/bin/env python3
+"""
+DICOM Converter Benchmarks
+Measures the performance of individual conversion steps on the bundled sample data.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from pathlib import Path
+
+import cv2
+import numpy as np
+import PIL
+import pydicom
+from PIL import Image
+
+import create_sample_dicom
+import dicom_converter
+
+
+def time_call(func, *args, repeat=5, **kwargs):
+    """Return the best wall time in seconds over `repeat` calls of func."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def normalize_frame_loop(stack, window_center, window_width, slope, intercept, invert):
+    """Per-frame normalization as done by the converter before normalize_pixel_stack."""
+    if slope is not None and intercept is not None:
+        stack = stack * float(slope) + float(intercept)
+    frames = []
+    for frame in stack:
+        normalized_frame = dicom_converter.normalize_pixel_array(frame, window_center, window_width)
+        if invert:
+            normalized_frame = 255 - normalized_frame
+        frames.append(normalized_frame)
+    return frames
+
+
+def benchmark_normalize(dicom_path, num_frames, repeat):
+    """Compare per-frame loop normalization with the batched stack path."""
+    ds = pydicom.dcmread(dicom_path)
+    pixel_array = ds.pixel_array
+    if pixel_array.ndim == 2:
+        pixel_array = pixel_array[np.newaxis]
+
+    # Scale the sample up to the requested number of frames
+    stack = np.resize(pixel_array, (num_frames,) + pixel_array.shape[1:])
+
+    window_center, window_width = dicom_converter.get_window(ds)
+    rescale = hasattr(ds, 'RescaleSlope') and hasattr(ds, 'RescaleIntercept')
+    slope = ds.RescaleSlope if rescale else None
+    intercept = ds.RescaleIntercept if rescale else None
+    invert = getattr(ds, 'PhotometricInterpretation', None) == "MONOCHROME1"
+
+    print(f"Input: {dicom_path} scaled to {stack.shape} {stack.dtype}")
+    for label, (wc, ww) in [('window', (window_center, window_width)), ('auto-scale', (None, None))]:
+        if label == 'window' and wc is None:
+            continue
+        loop_time = time_call(normalize_frame_loop, stack, wc, ww, slope, intercept, invert, repeat=repeat)
+        stack_time = time_call(dicom_converter.normalize_pixel_stack, stack, wc, ww,
+                               slope, intercept, invert, repeat=repeat)
+        print(f"  {label:<10}  loop: {loop_time * 1000:8.1f} ms   "
+              f"stack: {stack_time * 1000:8.1f} ms   speedup: {loop_time / stack_time:5.1f}x")
+
+
+def gif_small(frames, output_path, duration):
+    """PIL's optimized save, as done by --gif-profile small."""
+    frames_pil = [Image.fromarray(frame, mode='L') for frame in frames]
+    frames_pil[0].save(output_path, save_all=True, append_images=frames_pil[1:],
+                       duration=duration, loop=0, optimize=True, disposal=2)
+
+
+def gif_fast(frames, output_path, duration, delta=False):
+    """Shared-palette stream encoding, as done by --gif-profile fast."""
+    with dicom_converter.GifStreamWriter(output_path, duration, delta=delta) as gif:
+        for frame in frames:
+            gif.write(frame)
+
+
+def moving_object_frames(num_frames, rows=256, cols=256):
+    """Frames with a static textured background and a small moving bright square."""
+    rng = np.random.default_rng(0)
+    background = rng.normal(100, 20, (rows, cols)).clip(0, 255).astype(np.uint8)
+    frames = np.repeat(background[np.newaxis], num_frames, axis=0)
+    for i in range(num_frames):
+        x = (i * 2) % (cols - 40)
+        frames[i, rows // 2 - 20:rows // 2 + 20, x:x + 40] = 200 + i % 50
+    return frames
+
+
+def benchmark_gif(dicom_path, num_frames, repeat):
+    """Compare time and size of the GIF profiles on a real cine and on a static-background cine."""
+    ds = pydicom.dcmread(dicom_path)
+    stack = np.resize(ds.pixel_array, (num_frames,) + ds.pixel_array.shape[-2:])
+    window_center, window_width = dicom_converter.get_window(ds)
+    cine = dicom_converter.normalize_pixel_stack(stack, window_center, window_width)
+
+    profiles = [
+        ('small', gif_small, {}),
+        ('fast', gif_fast, {}),
+        ('fast+delta', gif_fast, {'delta': True}),
+    ]
+    with tempfile.TemporaryDirectory() as work_dir:
+        output_path = Path(work_dir) / 'bench.gif'
+        for label, frames in [(f"{dicom_path.name} x{num_frames}", cine),
+                              (f"moving object x{num_frames}", moving_object_frames(num_frames))]:
+            print(f"Input: {label} {frames.shape}")
+            for profile, func, kwargs in profiles:
+                elapsed = time_call(func, frames, output_path, 100, repeat=repeat, **kwargs)
+                size_kb = output_path.stat().st_size / 1024
+                print(f"  {profile:<11} time: {elapsed * 1000:8.1f} ms   size: {size_kb:9.0f} KB")
+
+
+def pil_png_16bit(pixels, output_path, compress_level):
+    """Previous 16-bit PNG path: Pillow I;16 image with adaptive row filters."""
+    Image.fromarray(pixels).save(output_path, compress_level=compress_level)
+
+
+def direct_png_16bit(pixels, output_path, compress_level):
+    """Current 16-bit PNG path: unfiltered rows compressed with zlib."""
+    dicom_converter.save_output(output_path, dicom_converter.encode_grayscale_png(pixels, compress_level))
+
+
+def tiff_16bit(pixels, output_path):
+    """Uncompressed 16-bit TIFF written by Pillow."""
+    Image.fromarray(pixels).save(output_path)
+
+
+def benchmark_png(size, repeat):
+    """Compare 16-bit image encoders and compression levels on a synthetic slice."""
+    pixels = create_sample_dicom.synthetic_frames(size, size, bits=16)[0].astype(np.uint16)
+    print(f"Input: synthetic {size}x{size} 16-bit slice ({pixels.nbytes / 1024:.0f} KB raw)")
+    with tempfile.TemporaryDirectory() as work_dir:
+        cases = [(f"pil level {level}", pil_png_16bit, 'png', (level,)) for level in (0, 1, 6, 9)]
+        cases += [(f"direct level {level}", direct_png_16bit, 'png', (level,)) for level in (0, 1, 6, 9)]
+        cases.append(('tiff uncompressed', tiff_16bit, 'tif', ()))
+        for label, func, suffix, extra in cases:
+            output_path = Path(work_dir) / f"bench.{suffix}"
+            elapsed = time_call(func, pixels, output_path, *extra, repeat=repeat)
+            size_kb = output_path.stat().st_size / 1024
+            print(f"  {label:<18} time: {elapsed * 1000:7.1f} ms   size: {size_kb:7.0f} KB")
+
+
+def encode_video(stack, output_base, encoder_name, background, normalize_options):
+    """Normalize a stack in batches and encode it, inline or in the background encoder thread."""
+    height, width = stack.shape[1:3]
+    encoder = dicom_converter.VIDEO_ENCODERS[encoder_name](output_base, 10, width, height)
+    if background:
+        encoder = dicom_converter.BackgroundEncoder(encoder)
+    try:
+        for start in range(0, len(stack), dicom_converter.ENCODE_BATCH_FRAMES):
+            batch = dicom_converter.normalize_pixel_stack(
+                stack[start:start + dicom_converter.ENCODE_BATCH_FRAMES], **normalize_options)
+            for frame in batch:
+                encoder.write(frame)
+    finally:
+        encoder.close()
+    return dicom_converter.output_size(encoder.path)
+
+
+def benchmark_video(dicom_path, num_frames, repeat):
+    """Compare the video encoder backends, inline and in a background thread."""
+    ds = pydicom.dcmread(dicom_path)
+    stack = np.resize(ds.pixel_array, (num_frames,) + ds.pixel_array.shape[-2:])
+    window_center, window_width = dicom_converter.get_window(ds)
+    normalize_options = {'window_center': window_center, 'window_width': window_width}
+
+    print(f"Input: {dicom_path} scaled to {stack.shape} {stack.dtype}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for encoder_name in dicom_converter.VIDEO_ENCODERS:
+            if encoder_name == 'ffmpeg' and shutil.which('ffmpeg') is None:
+                print(f"  {encoder_name:<7} skipped: ffmpeg not found on PATH")
+                continue
+            output_base = Path(work_dir) / encoder_name
+            inline_time = time_call(encode_video, stack, output_base, encoder_name, False,
+                                    normalize_options, repeat=repeat)
+            background_time = time_call(encode_video, stack, output_base, encoder_name, True,
+                                        normalize_options, repeat=repeat)
+            size_kb = encode_video(stack, output_base, encoder_name, True, normalize_options) / 1024
+            print(f"  {encoder_name:<7} inline: {inline_time * 1000:8.1f} ms   background: "
+                  f"{background_time * 1000:8.1f} ms   output: {size_kb:8.0f} KB")
+
+
+@contextmanager
+def simulated_read_latency(seconds):
+    """Delay every pydicom.dcmread call, to mimic a network filesystem on a local disk."""
+    original = pydicom.dcmread
+
+    def dcmread(*args, **kwargs):
+        time.sleep(seconds)
+        return original(*args, **kwargs)
+
+    pydicom.dcmread = dcmread
+    try:
+        yield
+    finally:
+        pydicom.dcmread = original
+
+
+def benchmark_pipeline(num_files, size, latency_ms, readers, writers):
+    """Compare file-by-file conversion with convert_pipelined on a synthetic corpus."""
+    options = {'metadata_records': None}
+    with tempfile.TemporaryDirectory() as work_dir:
+        dicom_files = create_sample_dicom.create_synthetic_corpus(
+            Path(work_dir) / 'corpus', num_files, rows=size, cols=size, bits=16, transfer_syntax='explicit'
+        )
+        output_dir = Path(work_dir) / 'output'
+        output_dir.mkdir()
+        print(f"Input: {num_files} files {size}x{size} 16-bit, simulated read latency {latency_ms} ms")
+
+        with simulated_read_latency(latency_ms / 1000), open(os.devnull, 'w') as devnull, \
+                redirect_stdout(devnull):
+            start = time.perf_counter()
+            for dicom_file in dicom_files:
+                dicom_converter.convert_dicom_to_image(dicom_file, output_dir, **options)
+            serial_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in dicom_converter.convert_pipelined(dicom_files, output_dir, options, readers, writers):
+                pass
+            pipeline_time = time.perf_counter() - start
+
+    print(f"  serial:   {num_files / serial_time:7.1f} files/s")
+    print(f"  pipeline: {num_files / pipeline_time:7.1f} files/s   ({readers} readers, {writers} writers, "
+          f"speedup: {serial_time / pipeline_time:4.1f}x)")
+
+
+def benchmark_partial(num_frames, size, syntaxes, repeat):
+    """Full pixel_array decode vs decoding a frame range with select_pixels, per transfer syntax."""
+    selections = [('1 frame', [num_frames // 2]), ('10 frames', list(range(10))), ('all frames', None)]
+    with tempfile.TemporaryDirectory() as work_dir:
+        for syntax in syntaxes:
+            if not syntax_available(syntax):
+                print(f"{syntax}: skipped, no encoder installed")
+                continue
+            dicom_path = Path(work_dir) / f"{syntax}.dcm"
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                create_sample_dicom.create_synthetic_dicom(dicom_path, rows=size, cols=size, num_frames=num_frames,
+                                                           transfer_syntax=syntax, verbose=False)
+            header = dicom_converter.read_dicom_header(dicom_path)
+            full = time_call(lambda: pydicom.dcmread(dicom_path).pixel_array, repeat=repeat)
+            print(f"{syntax} ({num_frames} frames of {size}x{size}): full decode {full * 1000:.0f} ms")
+            for label, frames in selections:
+                elapsed = time_call(dicom_converter.select_pixels, dicom_path, header, frames, repeat=repeat)
+                print(f"  {label:<11} {elapsed * 1000:8.1f} ms   ({full / elapsed:5.1f}x faster than full decode)")
+
+
+def benchmark_decode(num_frames, size, syntaxes, worker_counts, repeat):
+    """Serial ds.pixel_array decoding vs decode_pixels on threads and processes, per transfer syntax."""
+    from pydicom.pixels import pixel_array
+    print(f"CPU cores: {os.cpu_count()}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for syntax in syntaxes:
+            if not syntax_available(syntax):
+                print(f"{syntax}: skipped, no encoder installed")
+                continue
+            dicom_path = Path(work_dir) / f"{syntax}.dcm"
+            create_sample_dicom.create_synthetic_dicom(dicom_path, rows=size, cols=size, num_frames=num_frames,
+                                                       transfer_syntax=syntax, verbose=False)
+            ds = pydicom.dcmread(dicom_path)
+            # What ds.pixel_array runs, without its cache of the decoded array
+            serial = time_call(pixel_array, ds, repeat=repeat)
+            print(f"{syntax} ({num_frames} frames of {size}x{size}): serial {serial * 1000:.0f} ms")
+            for backend, workers in itertools.product(dicom_converter.DECODE_BACKENDS, worker_counts):
+                elapsed = time_call(dicom_converter.decode_pixels, ds, workers, backend, repeat=repeat)
+                print(f"  {workers} {backend + 's' if backend == 'thread' else backend + 'es':<10} "
+                      f"{elapsed * 1000:8.0f} ms   (speedup: {serial / elapsed:4.2f}x)")
+
+
+def run_memmap_case(dicom_path, output_dir, options):
+    """Convert one file in this (fresh) process; return the wall time and peak RSS."""
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        start = time.perf_counter()
+        dicom_converter.convert_dicom_to_image(dicom_path, output_dir, **options)
+        elapsed = time.perf_counter() - start
+    return elapsed, peak_rss_mb()
+
+
+def benchmark_memmap(frame_counts, size):
+    """Peak RSS and time of converting uncompressed multi-frame files with and without --memmap."""
+    cases = [('read', {}), ('memmap', {'use_memmap': True}),
+             ('stream', {'stream_frames': True}), ('stream + memmap', {'stream_frames': True, 'use_memmap': True}),
+             ('read, 1 frame', {'frames': [0]}), ('memmap, 1 frame', {'use_memmap': True, 'frames': [0]})]
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as work_dir:
+        for num_frames in frame_counts:
+            dicom_path = Path(work_dir) / f'native_{num_frames}.dcm'
+            # Generated in a child process, so the pixel array does not inflate the peak RSS
+            # that the case processes inherit from this one
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                executor.submit(create_sample_dicom.create_synthetic_dicom, dicom_path, rows=size, cols=size,
+                                num_frames=num_frames, transfer_syntax='explicit', verbose=False).result()
+            size_mb = dicom_path.stat().st_size / (1024 * 1024)
+            print(f"{num_frames} frames of {size}x{size} 16-bit ({size_mb:.0f} MB), GIF only:")
+            for label, case_options in cases:
+                options = {'metadata_records': None, 'export_mp4': False, **case_options}
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    elapsed, rss = executor.submit(run_memmap_case, str(dicom_path), work_dir, options).result()
+                print(f"  {label:<16} {elapsed * 1000:8.0f} ms   peak RSS: {rss:7.0f} MB")
+
+
+def peak_allocation(func, *args, **kwargs):
+    """Return the peak traced memory in bytes allocated during one call of func."""
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def window_float(ds, pixel_array):
+    """Float64 rescale and windowing as done by the converter before the LUT engine."""
+    window_center, window_width = dicom_converter.get_window(ds)
+    if hasattr(ds, 'RescaleSlope') and hasattr(ds, 'RescaleIntercept'):
+        pixel_array = pixel_array * float(ds.RescaleSlope) + float(ds.RescaleIntercept)
+    normalized = dicom_converter.normalize_pixel_array(pixel_array, window_center, window_width)
+    if getattr(ds, 'PhotometricInterpretation', None) == "MONOCHROME1":
+        normalized = 255 - normalized
+    return normalized
+
+
+def window_lut(ds, pixel_array):
+    """Rescale and windowing through the cached lookup table."""
+    return dicom_converter.apply_window_lut(pixel_array, dicom_converter.window_lut_for(ds, pixel_array))
+
+
+def benchmark_window(dicom_path, repeat):
+    """Compare float64 windowing with the LUT windowing engine on a single frame."""
+    ds = pydicom.dcmread(dicom_path)
+    pixel_array = ds.pixel_array
+    if pixel_array.ndim > 2:
+        pixel_array = pixel_array[0]
+
+    print(f"Input: {dicom_path} {pixel_array.shape} {pixel_array.dtype} ({pixel_array.nbytes / 1024:.0f} KB)")
+    window_lut(ds, pixel_array)  # warm the LUT cache, as for the rest of a series
+    for label, func in [('float64', window_float), ('lut', window_lut)]:
+        elapsed = time_call(func, ds, pixel_array, repeat=repeat)
+        peak = peak_allocation(func, ds, pixel_array)
+        print(f"  {label:<8}  time: {elapsed * 1000:7.2f} ms   peak allocated: {peak / 1024:8.0f} KB")
+
+
+def read_full_metadata(dicom_path, output_dir):
+    """Full read followed by the metadata dump, as done by convert_dicom_to_image."""
+    ds = pydicom.dcmread(dicom_path)
+    dicom_converter.extract_metadata(ds, Path(output_dir) / 'full.txt')
+
+
+def read_header_metadata(dicom_path, output_dir):
+    """Header-only read followed by the metadata dump, as done by --metadata-only."""
+    ds = dicom_converter.read_dicom_header(dicom_path)
+    dicom_converter.extract_metadata(ds, Path(output_dir) / 'header.txt')
+
+
+def benchmark_metadata(frame_counts, repeat):
+    """Compare full reads with header-only reads on synthetic multi-frame files."""
+    with tempfile.TemporaryDirectory() as work_dir:
+        for num_frames in frame_counts:
+            dicom_path = Path(work_dir) / f'CINE_{num_frames}.dcm'
+            create_sample_dicom.create_sample_multiframe(dicom_path, num_frames=num_frames)
+            size_mb = dicom_path.stat().st_size / (1024 * 1024)
+
+            full_time = time_call(read_full_metadata, dicom_path, work_dir, repeat=repeat)
+            header_time = time_call(read_header_metadata, dicom_path, work_dir, repeat=repeat)
+            print(f"  {num_frames:>6} frames ({size_mb:7.1f} MB)   full read: {full_time * 1000:8.2f} ms   "
+                  f"header only: {header_time * 1000:6.2f} ms   speedup: {full_time / header_time:6.1f}x")
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def syntax_available(transfer_syntax):
+    """Return True if pydicom can encode the given create_sample_dicom transfer syntax."""
+    if transfer_syntax in ('implicit', 'explicit'):
+        return True
+    from pydicom.pixels import get_encoder
+    uid = create_sample_dicom.TRANSFER_SYNTAXES[transfer_syntax]
+    return get_encoder(uid).is_available
+
+
+def run_suite_case(dicom_files, fps):
+    """
+    Measure one corpus; meant to run in a fresh process so the peak RSS belongs to this case.
+
+    Each file is converted by convert_dicom_to_image with a FileProfile, so the stage
+    times are those of the converter itself.
+
+    Returns:
+        Dictionary with the summed stage times, end-to-end throughput and peak RSS
+    """
+    input_bytes = sum(os.path.getsize(path) for path in dicom_files)
+    timings = dict.fromkeys(dicom_converter.PROFILE_STAGES, 0.0)
+
+    with tempfile.TemporaryDirectory() as work_dir, open(os.devnull, 'w') as devnull, \
+            redirect_stdout(devnull):
+        succeeded = 0
+        start = time.perf_counter()
+        for path in dicom_files:
+            profile = dicom_converter.FileProfile(path)
+            succeeded += dicom_converter.convert_dicom_to_image(path, work_dir, fps=fps, profile=profile)
+            for stage, totals in profile.stages.items():
+                timings[stage] = timings.get(stage, 0.0) + totals['wall_s']
+        elapsed = time.perf_counter() - start
+
+    return {
+        'succeeded': succeeded,
+        'input_mb': input_bytes / (1024 * 1024),
+        'stages_s': timings,
+        'convert_s': elapsed,
+        'files_per_s': len(dicom_files) / elapsed,
+        'mb_per_s': input_bytes / (1024 * 1024) / elapsed,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def benchmark_suite(sizes, bits_list, frame_counts, syntaxes, num_files, fps, output_path=None):
+    """
+    Generate synthetic corpora for every parameter combination and measure each one.
+
+    Every case is measured in its own spawned process so that the reported peak RSS
+    is not inflated by earlier, larger cases. Results are printed as a table and,
+    if output_path is given, written as JSON for comparison between versions.
+    """
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'pydicom': pydicom.__version__,
+            'pillow': PIL.__version__,
+            'opencv': cv2.__version__,
+        },
+        'parameters': {
+            'sizes': sizes, 'bits': bits_list, 'frames': frame_counts,
+            'syntaxes': syntaxes, 'files': num_files, 'fps': fps,
+        },
+        'cases': [],
+    }
+
+    unavailable = [syntax for syntax in syntaxes if not syntax_available(syntax)]
+    results['skipped_syntaxes'] = unavailable
+    for syntax in unavailable:
+        print(f"  Skipping {syntax}: no pydicom encoder plugin installed")
+
+    print(f"  {'case':<32} {'files/s':>9} {'MB/s':>9} {'RSS MB':>8}   slowest stages")
+    context = multiprocessing.get_context('spawn')
+    for size, bits, num_frames, syntax in itertools.product(sizes, bits_list, frame_counts, syntaxes):
+        if syntax in unavailable:
+            continue
+        case = {'size': size, 'bits': bits, 'frames': num_frames, 'syntax': syntax, 'files': num_files}
+        label = f"{size}x{size} {bits}-bit {num_frames}f {syntax}"
+
+        with tempfile.TemporaryDirectory() as corpus_dir:
+            dicom_files = [str(path) for path in create_sample_dicom.create_synthetic_corpus(
+                corpus_dir, num_files, rows=size, cols=size, bits=bits,
+                num_frames=num_frames, transfer_syntax=syntax
+            )]
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                case.update(executor.submit(run_suite_case, dicom_files, fps).result())
+
+        results['cases'].append(case)
+        slowest = sorted(case['stages_s'].items(), key=lambda item: item[1], reverse=True)[:3]
+        print(f"  {label:<32} {case['files_per_s']:9.1f} {case['mb_per_s']:9.1f} {case['peak_rss_mb']:8.0f}   "
+              + ", ".join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in slowest if seconds))
+
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to: {output_path}")
+    return results
+
+
+HEAVY_MODULES = ['numpy', 'pydicom', 'PIL.Image', 'cv2']
+
+# Runs the converter CLI in a fresh interpreter and reports the heavy modules it loaded
+STARTUP_SCRIPT = """
+import runpy, sys
+script, modules = sys.argv[1], sys.argv[2].split(',')
+sys.argv = [script] + sys.argv[3:]
+try:
+    runpy.run_path(script, run_name='__main__')
+finally:
+    print(','.join(m for m in modules if m in sys.modules), file=sys.stderr)
+"""
+
+
+def startup_run(cli_args):
+    """Run dicom_converter.py once in a new process; return (wall seconds, heavy modules imported)."""
+    command = [sys.executable, '-c', STARTUP_SCRIPT, dicom_converter.__file__, ','.join(HEAVY_MODULES)] + cli_args
+    start = time.perf_counter()
+    completed = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    loaded = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else ''
+    return elapsed, [m for m in loaded.split(',') if m]
+
+
+def benchmark_startup(repeat, output_path=None):
+    """
+    Measure end-to-end latency of short CLI runs, including interpreter startup
+    and imports, and which heavy modules each run imports.
+    """
+    cases = [
+        ('python -c pass', None),
+        ('--help', ['--help']),
+        ('metadata only, 1 file', ['dicom_data/SAMPLE_CT.dcm', '--metadata-only']),
+        ('1 PNG (CT)', ['dicom_data/SAMPLE_CT.dcm']),
+        ('1 GIF + MP4 (cine)', ['dicom_data/SAMPLE_CINE.dcm']),
+    ]
+    results = {'environment': {'python': platform.python_version(), 'cpu_count': os.cpu_count()},
+               'repeat': repeat, 'cases': []}
+    print(f"  {'case':<24} {'best':>9} {'median':>9}   heavy modules imported")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for label, cli_args in cases:
+            times = []
+            loaded = []
+            for _ in range(repeat):
+                if cli_args is None:
+                    start = time.perf_counter()
+                    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+                    times.append(time.perf_counter() - start)
+                else:
+                    elapsed, loaded = startup_run(cli_args + (['-o', work_dir] if cli_args != ['--help'] else []))
+                    times.append(elapsed)
+            times.sort()
+            results['cases'].append({'case': label, 'best_s': times[0], 'median_s': times[len(times) // 2],
+                                     'modules': loaded})
+            print(f"  {label:<24} {times[0] * 1000:7.0f} ms {times[len(times) // 2] * 1000:7.0f} ms   "
+                  f"{', '.join(loaded) if cli_args is not None else '-'}")
+
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to: {output_path}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DICOM converter steps')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    normalize_parser = subparsers.add_parser(
+        'normalize', help='Per-frame loop vs batched stack normalization'
+    )
+    normalize_parser.add_argument(
+        'dicom_path',
+        nargs='?',
+        default='dicom_data/SAMPLE_CINE.dcm',
+        help='Multi-frame DICOM file to scale up (default: dicom_data/SAMPLE_CINE.dcm)'
+    )
+    normalize_parser.add_argument(
+        '--frames',
+        type=int,
+        default=500,
+        help='Number of frames to benchmark (default: 500)'
+    )
+    normalize_parser.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help='Repetitions per measurement, best time is reported (default: 5)'
+    )
+
+    window_parser = subparsers.add_parser(
+        'window', help='Float64 windowing vs the LUT windowing engine'
+    )
+    window_parser.add_argument(
+        'dicom_path',
+        nargs='?',
+        default='dicom_data/SAMPLE_CT.dcm',
+        help='DICOM file to window (default: dicom_data/SAMPLE_CT.dcm)'
+    )
+    window_parser.add_argument(
+        '--repeat',
+        type=int,
+        default=20,
+        help='Repetitions per measurement, best time is reported (default: 20)'
+    )
+
+    metadata_parser = subparsers.add_parser(
+        'metadata', help='Full read vs header-only read for the metadata dump'
+    )
+    metadata_parser.add_argument(
+        '--frames',
+        type=int,
+        nargs='+',
+        default=[15, 500, 2000],
+        help='Frame counts of the synthetic multi-frame files (default: 15 500 2000)'
+    )
+    metadata_parser.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help='Repetitions per measurement, best time is reported (default: 5)'
+    )
+
+    png_parser = subparsers.add_parser(
+        'png', help='16-bit image encoding: Pillow PNG vs direct PNG encoder vs uncompressed TIFF'
+    )
+    png_parser.add_argument(
+        '--size',
+        type=int,
+        default=512,
+        help='Image rows and columns (default: 512)'
+    )
+    png_parser.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help='Repetitions per measurement, best time is reported (default: 5)'
+    )
+
+    gif_parser = subparsers.add_parser(
+        'gif', help='GIF profiles: PIL optimize vs shared palette vs changed rectangles'
+    )
+    gif_parser.add_argument(
+        'dicom_path',
+        nargs='?',
+        default='dicom_data/SAMPLE_CINE.dcm',
+        help='Multi-frame DICOM file to scale up (default: dicom_data/SAMPLE_CINE.dcm)'
+    )
+    gif_parser.add_argument(
+        '--frames',
+        type=int,
+        default=200,
+        help='Number of frames to encode (default: 200)'
+    )
+    gif_parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='Repetitions per measurement, best time is reported (default: 3)'
+    )
+
+    video_parser = subparsers.add_parser(
+        'video', help='Video encoder backends, inline vs background thread'
+    )
+    video_parser.add_argument(
+        'dicom_path',
+        nargs='?',
+        default='dicom_data/SAMPLE_CINE.dcm',
+        help='Multi-frame DICOM file to scale up (default: dicom_data/SAMPLE_CINE.dcm)'
+    )
+    video_parser.add_argument(
+        '--frames',
+        type=int,
+        default=300,
+        help='Number of frames to encode (default: 300)'
+    )
+    video_parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='Repetitions per measurement, best time is reported (default: 3)'
+    )
+
+    pipeline_parser = subparsers.add_parser(
+        'pipeline', help='File-by-file conversion vs the read/convert/write pipeline'
+    )
+    pipeline_parser.add_argument(
+        '--files',
+        type=int,
+        default=100,
+        help='Number of synthetic files (default: 100)'
+    )
+    pipeline_parser.add_argument(
+        '--size',
+        type=int,
+        default=512,
+        help='Image size in pixels (default: 512)'
+    )
+    pipeline_parser.add_argument(
+        '--latency-ms',
+        type=float,
+        default=0,
+        help='Simulated storage latency added to every file read (default: 0)'
+    )
+    pipeline_parser.add_argument(
+        '--readers',
+        type=int,
+        default=2,
+        help='Reader threads (default: 2)'
+    )
+    pipeline_parser.add_argument(
+        '--writers',
+        type=int,
+        default=2,
+        help='Writer threads (default: 2)'
+    )
+
+    suite_parser = subparsers.add_parser(
+        'suite', help='Per-stage timing and throughput on generated synthetic corpora'
+    )
+    suite_parser.add_argument(
+        '--sizes',
+        type=int,
+        nargs='+',
+        default=[256, 512],
+        help='Square image sizes in pixels (default: 256 512)'
+    )
+    suite_parser.add_argument(
+        '--bits',
+        type=int,
+        nargs='+',
+        choices=[8, 16],
+        default=[8, 16],
+        help='Bit depths (default: 8 16)'
+    )
+    suite_parser.add_argument(
+        '--frames',
+        type=int,
+        nargs='+',
+        default=[1, 20],
+        help='Frames per file (default: 1 20)'
+    )
+    suite_parser.add_argument(
+        '--syntaxes',
+        nargs='+',
+        choices=list(create_sample_dicom.TRANSFER_SYNTAXES),
+        default=['explicit', 'rle', 'jpeg2000'],
+        help='Transfer syntaxes; compressed ones are skipped if no encoder is installed '
+             '(default: explicit rle jpeg2000)'
+    )
+    suite_parser.add_argument(
+        '--files',
+        type=int,
+        default=10,
+        help='Files per corpus (default: 10)'
+    )
+    suite_parser.add_argument(
+        '--fps',
+        type=int,
+        default=10,
+        help='Frames per second for GIF/MP4 encoding (default: 10)'
+    )
+    suite_parser.add_argument(
+        '--output',
+        help='Write the results as JSON to this file'
+    )
+
+    partial_parser = subparsers.add_parser(
+        'partial', help='Full decode vs decoding only selected frames (--frames)'
+    )
+    partial_parser.add_argument(
+        '--frames',
+        type=int,
+        default=200,
+        help='Frames per synthetic file (default: 200)'
+    )
+    partial_parser.add_argument(
+        '--size',
+        type=int,
+        default=256,
+        help='Image rows and columns (default: 256)'
+    )
+    partial_parser.add_argument(
+        '--syntaxes',
+        nargs='+',
+        choices=list(create_sample_dicom.TRANSFER_SYNTAXES),
+        default=['explicit', 'rle', 'jpeg2000'],
+        help='Transfer syntaxes to compare (default: explicit rle jpeg2000)'
+    )
+    partial_parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='Repetitions per measurement, best time is reported (default: 3)'
+    )
+
+    decode_parser = subparsers.add_parser(
+        'decode', help='Serial vs threaded and multi-process frame decoding (--decode-workers)'
+    )
+    decode_parser.add_argument(
+        '--frames',
+        type=int,
+        default=100,
+        help='Frames per synthetic file (default: 100)'
+    )
+    decode_parser.add_argument(
+        '--size',
+        type=int,
+        default=512,
+        help='Image rows and columns (default: 512)'
+    )
+    decode_parser.add_argument(
+        '--syntaxes',
+        nargs='+',
+        choices=list(create_sample_dicom.TRANSFER_SYNTAXES),
+        default=['rle', 'jpeg2000', 'jpegls'],
+        help='Transfer syntaxes to compare (default: rle jpeg2000 jpegls)'
+    )
+    decode_parser.add_argument(
+        '--workers',
+        type=int,
+        nargs='+',
+        default=[2, 4],
+        help='Thread and process counts to compare (default: 2 4)'
+    )
+    decode_parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='Repetitions per measurement, best time is reported (default: 3)'
+    )
+
+    memmap_parser = subparsers.add_parser(
+        'memmap', help='Peak RSS and time with and without memory-mapped pixel data (--memmap)'
+    )
+    memmap_parser.add_argument(
+        '--frames',
+        type=int,
+        nargs='+',
+        default=[100, 400],
+        help='Frame counts of the synthetic files (default: 100 400)'
+    )
+    memmap_parser.add_argument(
+        '--size',
+        type=int,
+        default=512,
+        help='Image rows and columns (default: 512)'
+    )
+
+    startup_parser = subparsers.add_parser(
+        'startup', help='CLI latency of --help, metadata-only and single-file runs, with imported modules'
+    )
+    startup_parser.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help='Runs per case, best and median are reported (default: 5)'
+    )
+    startup_parser.add_argument(
+        '--output',
+        help='Write the results as JSON to this file'
+    )
+
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("DICOM Converter Benchmark")
+    print("=" * 80)
+
+    if args.benchmark == 'normalize':
+        benchmark_normalize(Path(args.dicom_path), args.frames, args.repeat)
+    elif args.benchmark == 'window':
+        benchmark_window(Path(args.dicom_path), args.repeat)
+    elif args.benchmark == 'metadata':
+        benchmark_metadata(args.frames, args.repeat)
+    elif args.benchmark == 'png':
+        benchmark_png(args.size, args.repeat)
+    elif args.benchmark == 'gif':
+        benchmark_gif(Path(args.dicom_path), args.frames, args.repeat)
+    elif args.benchmark == 'video':
+        benchmark_video(Path(args.dicom_path), args.frames, args.repeat)
+    elif args.benchmark == 'pipeline':
+        benchmark_pipeline(args.files, args.size, args.latency_ms, args.readers, args.writers)
+    elif args.benchmark == 'partial':
+        benchmark_partial(args.frames, args.size, args.syntaxes, args.repeat)
+    elif args.benchmark == 'decode':
+        benchmark_decode(args.frames, args.size, args.syntaxes, args.workers, args.repeat)
+    elif args.benchmark == 'memmap':
+        benchmark_memmap(args.frames, args.size)
+    elif args.benchmark == 'startup':
+        benchmark_startup(args.repeat, args.output)
+    elif args.benchmark == 'suite':
+        benchmark_suite(args.sizes, args.bits, args.frames, args.syntaxes, args.files, args.fps, args.output)
+
+
+if __name__ == '__main__':
+    main()
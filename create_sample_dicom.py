@@ -273,6 +273,145 @@ def create_sample_multiframe(output_path, num_frames=10):
     print(f"  ✓ Created: {output_path.name} ({rows}x{cols}x{num_frames} frames)")
 
 
+# Transfer syntaxes supported by create_synthetic_dicom
+TRANSFER_SYNTAXES = {
+    'implicit': '1.2.840.10008.1.2',         # Implicit VR Little Endian
+    'explicit': '1.2.840.10008.1.2.1',       # Explicit VR Little Endian
+    'rle': '1.2.840.10008.1.2.5',            # RLE Lossless
+    'jpeg2000': '1.2.840.10008.1.2.4.90',    # JPEG 2000 Lossless
+    'jpegls': '1.2.840.10008.1.2.4.80',      # JPEG-LS Lossless
+}
+
+
+def synthetic_frames(rows, cols, bits=16, num_frames=1, signed=False, seed=0):
+    """
+    Create a (frames, rows, cols) phantom with values spanning the given bit depth.
+
+    Each frame shows concentric circles whose radius pulses over the sequence,
+    plus a little noise, so the data compresses like real images rather than
+    like constant or random arrays.
+    """
+    rng = np.random.default_rng(seed)
+    dtype = {8: np.uint8, 16: np.uint16}[bits]
+    if signed:
+        dtype = {8: np.int8, 16: np.int16}[bits]
+    max_value = 2 ** (bits - 1) - 1 if signed else 2 ** bits - 1
+
+    y, x = np.ogrid[:rows, :cols]
+    distance = np.sqrt((x - cols / 2) ** 2 + (y - rows / 2) ** 2) / (min(rows, cols) / 2)
+
+    frames = np.empty((num_frames, rows, cols), dtype=dtype)
+    for frame_idx in range(num_frames):
+        scale = 1.0 + 0.15 * np.sin(2 * np.pi * frame_idx / max(num_frames, 1))
+        frame = np.where(distance <= 0.8 * scale, 0.6, 0.0) + np.where(distance <= 0.5 * scale, 0.3, 0.0)
+        frame = frame * max_value + rng.normal(0, max_value * 0.01, (rows, cols))
+        frames[frame_idx] = np.clip(frame, 0, max_value).astype(dtype)
+    return frames
+
+
+def create_synthetic_dicom(output_path, rows=512, cols=512, bits=16, num_frames=1,
+                           transfer_syntax='implicit', signed=False, seed=0, verbose=True):
+    """
+    Create a parameterized synthetic DICOM file for benchmarks.
+
+    Args:
+        output_path: Path of the file to write
+        rows, cols: Image size
+        bits: Bits allocated/stored, 8 or 16
+        num_frames: Number of frames (multi-frame if > 1)
+        transfer_syntax: Key of TRANSFER_SYNTAXES; compressed syntaxes need the
+            matching pydicom encoder plugin (RLE is built in, JPEG 2000 uses
+            pylibjpeg-openjpeg, JPEG-LS needs pyjpegls)
+        signed: If True, use signed pixel representation
+        seed: Seed for the noise
+    """
+    if verbose:
+        print(f"Creating synthetic image: {output_path}")
+
+    frames = synthetic_frames(rows, cols, bits, num_frames, signed, seed)
+    pixel_array = frames if num_frames > 1 else frames[0]
+
+    file_meta = Dataset()
+    file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.7'  # Secondary Capture
+    file_meta.MediaStorageSOPInstanceUID = pydicom.uid.generate_uid()
+    file_meta.TransferSyntaxUID = TRANSFER_SYNTAXES['implicit']
+    file_meta.ImplementationClassUID = '1.2.3.4.5.6.7.8.9.0'
+
+    ds = FileDataset(output_path, {}, file_meta=file_meta, preamble=b"\0" * 128)
+
+    # Patient and study information
+    ds.PatientName = "Synthetic^Patient"
+    ds.PatientID = "SYNTH001"
+    ds.PatientSex = "O"
+    ds.StudyDate = datetime.now().strftime('%Y%m%d')
+    ds.StudyTime = datetime.now().strftime('%H%M%S')
+    ds.StudyDescription = "Synthetic Benchmark Study"
+    ds.StudyInstanceUID = '1.2.3.4.5.6.7.8.9.10.41'
+    ds.SeriesDescription = "Synthetic Benchmark Series"
+    ds.SeriesInstanceUID = '1.2.3.4.5.6.7.8.9.10.41.42'
+    ds.SeriesNumber = 4
+    ds.Modality = "OT"
+
+    # Image information
+    ds.InstanceNumber = 1
+    ds.ImageType = ["DERIVED", "SECONDARY"]
+    ds.SOPClassUID = file_meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    if num_frames > 1:
+        ds.NumberOfFrames = num_frames
+
+    # Technical parameters
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.Rows = rows
+    ds.Columns = cols
+    ds.BitsAllocated = bits
+    ds.BitsStored = bits
+    ds.HighBit = bits - 1
+    ds.PixelRepresentation = 1 if signed else 0
+
+    # Window covering the phantom, and a CT-like rescale for 16-bit data
+    max_value = 2 ** (bits - 1) - 1 if signed else 2 ** bits - 1
+    ds.WindowCenter = max_value // 2
+    ds.WindowWidth = max_value
+    if bits == 16:
+        ds.RescaleIntercept = -1024
+        ds.RescaleSlope = 1
+
+    ds.Manufacturer = "Sample DICOM Generator"
+    ds.ManufacturerModelName = "Synthetic Benchmark v1.0"
+
+    syntax = TRANSFER_SYNTAXES[transfer_syntax]
+    if transfer_syntax == 'explicit':
+        file_meta.TransferSyntaxUID = syntax
+    if transfer_syntax in ('implicit', 'explicit'):
+        ds.PixelData = pixel_array.tobytes()
+    else:
+        ds.compress(syntax, pixel_array)
+
+    ds.save_as(output_path, enforce_file_format=True)
+    if verbose:
+        print(f"  ✓ Created: {Path(output_path).name} ({rows}x{cols}x{num_frames} frames, "
+              f"{bits}-bit, {transfer_syntax})")
+
+
+def create_synthetic_corpus(output_dir, num_files=10, **params):
+    """
+    Create num_files synthetic DICOM files with the parameters of create_synthetic_dicom.
+
+    Returns:
+        List of created file paths
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(num_files):
+        path = output_dir / f"SYNTH_{i:05d}.dcm"
+        create_synthetic_dicom(path, seed=i, verbose=False, **params)
+        paths.append(path)
+    return paths
+
+
 def main():
     """Generate all sample DICOM files"""
     print("=" * 80)
@@ -6,234 +6,3651 @@ Converts DICOM medical imaging files to PNG/GIF/MP4 and extracts metadata to tex
 
 import os
 import sys
+import io
+import csv
+import json
+import zlib
+import struct
+import hashlib
+import time
+import queue
+import shutil
+import functools
+import itertools
+import threading
+import subprocess
+import signal
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager, nullcontext, redirect_stdout, redirect_stderr
 from pathlib import Path
-import pydicom
-from pydicom.errors import InvalidDicomError
-import numpy as np
-from PIL import Image
+import importlib
 import argparse
-import cv2
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access.
+
+    The imaging and codec modules take most of the startup time, and each output
+    only needs some of them (OpenCV only for MP4 video, nothing for --help). On first
+    use the stand-in replaces itself with the real module in this module's globals,
+    so later accesses go straight to the module.
+    """
+
+    def __init__(self, module_name, alias):
+        self._module_name = module_name
+        self._alias = alias
+
+    def __getattr__(self, name):
+        module = importlib.import_module(self._module_name)
+        globals()[self._alias] = module
+        return getattr(module, name)
+
+
+np = LazyModule('numpy', 'np')
+pydicom = LazyModule('pydicom', 'pydicom')
+Image = LazyModule('PIL.Image', 'Image')
+GifImagePlugin = LazyModule('PIL.GifImagePlugin', 'GifImagePlugin')
+cv2 = LazyModule('cv2', 'cv2')
 
 
 def normalize_pixel_array(pixel_array, window_center=None, window_width=None):
     """
-    Normalize pixel array to 0-255 range for image display.
-    Applies windowing if window center and width are provided.
+    Normalize pixel array to 0-255 range for image display.
+    Applies windowing if window center and width are provided.
+    """
+    if window_center is not None and window_width is not None:
+        # Apply window/level adjustment
+        lower = window_center - window_width / 2
+        upper = window_center + window_width / 2
+        pixel_array = np.clip(pixel_array, lower, upper)
+        pixel_array = ((pixel_array - lower) / (upper - lower) * 255.0).astype(np.uint8)
+    else:
+        # Auto-scale to full range
+        pixel_array = pixel_array.astype(np.float64)
+        pixel_min = pixel_array.min()
+        pixel_max = pixel_array.max()
+
+        if pixel_max > pixel_min:
+            pixel_array = ((pixel_array - pixel_min) / (pixel_max - pixel_min) * 255.0)
+
+        pixel_array = pixel_array.astype(np.uint8)
+
+    return pixel_array
+
+
+@functools.lru_cache(maxsize=32)
+def build_window_lut(dtype, slope=None, intercept=None, window_center=None, window_width=None,
+                     voi_lut=None, value_range=None, invert=False, out_bits=8):
+    """
+    Build a lookup table mapping every stored value of an 8/16-bit integer dtype
+    to its display value, so a whole image can be windowed with a single gather.
+
+    Tables are cached by their parameters, so all images of a series share one table.
+    The mapping matches rescaling followed by normalize_pixel_array:
+
+    - a window (window_center/window_width) takes precedence,
+    - otherwise a VOI LUT, given as (LUTDescriptor, LUTData) tuples, is applied,
+    - otherwise values are auto-scaled over value_range, the (min, max) of the
+      rescaled image.
+
+    Args:
+        dtype: Stored pixel dtype as a string, e.g. '<i2' (at most 2 bytes)
+        slope, intercept: RescaleSlope/RescaleIntercept, or None if not present
+        invert: If True, invert the output (MONOCHROME1)
+        out_bits: 8 for a uint8 table, 16 for a uint16 table
+
+    Returns:
+        Read-only array indexed by the stored values viewed as unsigned integers
+    """
+    dtype = np.dtype(dtype)
+    index_dtype = np.dtype(f'u{dtype.itemsize}')
+    values = np.arange(2 ** (8 * dtype.itemsize), dtype=index_dtype).view(dtype)
+    out_max = 2 ** out_bits - 1
+    out_dtype = np.uint8 if out_bits == 8 else np.uint16
+
+    if slope is not None and intercept is not None:
+        values = values * float(slope) + float(intercept)
+
+    if window_center is not None and window_width is not None:
+        if out_bits == 8:
+            lut = normalize_pixel_array(values, window_center, window_width)
+        else:
+            lower = window_center - window_width / 2
+            upper = window_center + window_width / 2
+            lut = ((np.clip(values, lower, upper) - lower) / (upper - lower) * float(out_max)).astype(out_dtype)
+    elif voi_lut is not None:
+        (entries, first_mapped, bits), data = voi_lut
+        entries = entries or 65536
+        indices = np.clip(np.asarray(values, dtype=np.float64) - first_mapped, 0, entries - 1).astype(np.intp)
+        mapped = np.asarray(data, dtype=np.float64)[np.minimum(indices, len(data) - 1)]
+        lut = (mapped / float(2 ** bits - 1) * float(out_max)).astype(out_dtype)
+    else:
+        pixel_min, pixel_max = value_range
+        # Values outside the image range never occur; clip them to keep the cast defined
+        values = np.clip(values.astype(np.float64), pixel_min, pixel_max)
+        if pixel_max > pixel_min:
+            values = (values - pixel_min) / (pixel_max - pixel_min) * float(out_max)
+        lut = values.astype(out_dtype)
+
+    if invert:
+        lut = out_max - lut
+
+    lut.flags.writeable = False
+    return lut
+
+
+def get_voi_lut(ds):
+    """
+    Return the first VOI LUT of the dataset as a hashable (descriptor, data) tuple,
+    or None if the dataset has no VOI LUT Sequence.
+    """
+    sequence = getattr(ds, 'VOILUTSequence', None)
+    if not sequence:
+        return None
+
+    item = sequence[0]
+    entries, first_mapped, bits = (int(v) for v in item.LUTDescriptor)
+    data = item.LUTData
+    if isinstance(data, bytes):
+        data = np.frombuffer(data, dtype='<u2' if bits > 8 else np.uint8)
+    elif not isinstance(data, (list, pydicom.multival.MultiValue)):
+        data = [data]
+    return (entries, first_mapped, bits), tuple(int(v) for v in data)
+
+
+def supports_window_lut(pixel_array):
+    """True if pixel_array can be windowed with build_window_lut (8/16-bit integers)."""
+    return pixel_array.dtype.kind in 'iu' and pixel_array.dtype.itemsize <= 2
+
+
+def apply_window_lut(pixel_array, lut):
+    """Map stored values through a table from build_window_lut (one output allocation)."""
+    return lut[pixel_array.view(f'u{pixel_array.dtype.itemsize}')]
+
+
+def window_lut_for(ds, pixel_array, out_bits=8, use_window=True):
+    """
+    Return the cached display LUT for pixel_array using the rescale, window, VOI LUT
+    and photometric interpretation of ds.
+
+    Args:
+        use_window: If False, ignore window and VOI LUT settings and auto-scale
+            over the full rescaled range of the image
+    """
+    rescale = hasattr(ds, 'RescaleSlope') and hasattr(ds, 'RescaleIntercept')
+    slope = float(ds.RescaleSlope) if rescale else None
+    intercept = float(ds.RescaleIntercept) if rescale else None
+    window_center, window_width = get_window(ds) if use_window else (None, None)
+    voi_lut = get_voi_lut(ds) if use_window and window_center is None else None
+
+    value_range = None
+    if (window_center is None or window_width is None) and voi_lut is None:
+        pixel_min = float(pixel_array.min())
+        pixel_max = float(pixel_array.max())
+        if rescale:
+            pixel_min, pixel_max = sorted((pixel_min * slope + intercept, pixel_max * slope + intercept))
+        value_range = (pixel_min, pixel_max)
+
+    return build_window_lut(
+        pixel_array.dtype.str, slope, intercept, window_center, window_width,
+        voi_lut=voi_lut, value_range=value_range,
+        invert=getattr(ds, 'PhotometricInterpretation', None) == "MONOCHROME1",
+        out_bits=out_bits
+    )
+
+
+def autoscale_stack_lut(stack, slope=None, intercept=None):
+    """
+    Auto-scale an integer (frames, rows, cols) stack to uint8 through per-frame lookup tables.
+
+    The tables of all frames are laid out in one flat array, each covering the stored
+    values from the frame's minimum to its maximum (all 256 values for 8-bit input),
+    and hold exactly what
+    normalize_pixel_array gives for the rescaled frame. Each frame is then mapped with
+    a single gather.
+
+    Args:
+        stack: Stored integer pixel values, frames along the first axis
+        slope, intercept: RescaleSlope/RescaleIntercept, or None if not present
+
+    Returns:
+        uint8 array shaped like stack, or None if the tables would have more than one
+        entry per two pixels, where the float path is cheaper
+    """
+    rescale = slope is not None and intercept is not None
+    frame_axes = tuple(range(1, stack.ndim))
+    stored_min = stack.min(axis=frame_axes).astype(np.int64)
+    stored_max = stack.max(axis=frame_axes).astype(np.int64)
+    # 8-bit frames index a table over all 256 byte values directly with their stored
+    # bytes; wider frames index a table over [min, max] with the offset stored value.
+    direct = stack.dtype.itemsize == 1
+    sizes = np.full(len(stack), 256) if direct else stored_max - stored_min + 1
+    total = int(sizes.sum())
+    if total > stack.size // 2:
+        return None
+
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    frame_of = np.repeat(np.arange(len(stack)), sizes)
+    if direct:
+        stored = np.tile(np.arange(256, dtype=np.uint8).view(stack.dtype).astype(np.int64), len(stack))
+        # Bytes outside the frame's range never occur; clip them to keep the cast defined
+        stored = np.clip(stored, stored_min[frame_of], stored_max[frame_of])
+    else:
+        stored = np.arange(total, dtype=np.int64) - offsets[frame_of] + stored_min[frame_of]
+    values = stored.astype(np.float64)
+    pixel_min = stored_min.astype(np.float64)
+    pixel_max = stored_max.astype(np.float64)
+    if rescale:
+        values *= float(slope)
+        values += float(intercept)
+        pixel_min = pixel_min * float(slope) + float(intercept)
+        pixel_max = pixel_max * float(slope) + float(intercept)
+        if float(slope) < 0:
+            pixel_min, pixel_max = pixel_max, pixel_min
+    varying = pixel_max > pixel_min
+
+    values -= pixel_min[frame_of]
+    values /= np.where(varying, pixel_max - pixel_min, 1.0)[frame_of]
+    values *= 255.0
+    lut = values.astype(np.uint8)
+    # Constant frames are left unscaled, as in normalize_pixel_array
+    constant = ~varying[frame_of]
+    lut[constant] = pixel_min[frame_of[constant]].astype(np.uint8)
+
+    output = np.empty(stack.shape, dtype=np.uint8)
+    if direct:
+        for i, frame in enumerate(stack):
+            np.take(lut[offsets[i]:offsets[i] + 256], frame.view(np.uint8), out=output[i])
+        return output
+
+    # One frame of indices at a time keeps the working buffer in cache
+    shift = offsets - stored_min
+    index = np.empty(stack.shape[1:], dtype=np.intp)
+    for i, frame in enumerate(stack):
+        np.add(frame, shift[i], out=index, dtype=np.intp, casting='unsafe')
+        np.take(lut, index, out=output[i])
+    return output
+
+
+def normalize_pixel_stack(stack, window_center=None, window_width=None,
+                          slope=None, intercept=None, invert=False, voi_lut=None,
+                          chunk_bytes=4 * 1024 * 1024):
+    """
+    Normalize a whole (frames, rows, cols) stack to uint8 in one pass.
+
+    Produces the same result as calling normalize_pixel_array on each rescaled frame,
+    followed by MONOCHROME1 inversion if requested, but without the per-frame Python loop.
+    With a window or VOI LUT and integer input the mapping is taken from the cached
+    build_window_lut tables and applied with a single gather. Auto-scaled integer input
+    is mapped through one table per frame, covering only the stored range of that frame
+    (see autoscale_stack_lut). Otherwise the stack is processed with in-place float
+    operations in chunks of about chunk_bytes, with auto-scaling broadcast per frame.
+
+    Args:
+        stack: Stored pixel values, frames along the first axis
+        window_center, window_width: Display window in rescaled units, or None for auto-scale
+        slope, intercept: RescaleSlope/RescaleIntercept, or None if not present
+        invert: If True, invert the output (MONOCHROME1)
+        voi_lut: VOI LUT from get_voi_lut, used when no window is given (integer input only)
+        chunk_bytes: Size of the float64 working buffer for the non-LUT paths
+    """
+    rescale = slope is not None and intercept is not None
+    windowed = window_center is not None and window_width is not None
+
+    if (windowed or voi_lut is not None) and supports_window_lut(stack):
+        lut = build_window_lut(
+            stack.dtype.str,
+            float(slope) if rescale else None,
+            float(intercept) if rescale else None,
+            window_center if windowed else None,
+            window_width if windowed else None,
+            voi_lut=None if windowed else voi_lut,
+            invert=invert
+        )
+        return apply_window_lut(stack, lut)
+
+    if not windowed and stack.dtype.kind in 'iu' and stack.dtype.itemsize <= 4 and len(stack):
+        output = autoscale_stack_lut(stack, slope, intercept)
+        if output is not None:
+            if invert:
+                np.subtract(255, output, out=output)
+            return output
+
+    frame_axes = tuple(range(1, stack.ndim))
+    if windowed:
+        lower = window_center - window_width / 2
+        upper = window_center + window_width / 2
+    else:
+        # Per-frame range of the rescaled values. Rescaling is monotonic, so it is
+        # enough to rescale the extremes of the stored values.
+        pixel_min = stack.min(axis=frame_axes).astype(np.float64)
+        pixel_max = stack.max(axis=frame_axes).astype(np.float64)
+        if rescale:
+            pixel_min = pixel_min * float(slope) + float(intercept)
+            pixel_max = pixel_max * float(slope) + float(intercept)
+            if float(slope) < 0:
+                pixel_min, pixel_max = pixel_max, pixel_min
+        varying = pixel_max > pixel_min
+
+    output = np.empty(stack.shape, dtype=np.uint8)
+    frame_bytes = 8 * max(1, stack[0].size)
+    chunk_frames = max(1, chunk_bytes // frame_bytes)
+    buffer = np.empty((min(chunk_frames, len(stack)),) + stack.shape[1:], dtype=np.float64)
+
+    for start in range(0, len(stack), chunk_frames):
+        stop = min(start + chunk_frames, len(stack))
+        work = buffer[:stop - start]
+        work[...] = stack[start:stop]
+        if rescale:
+            work *= float(slope)
+            work += float(intercept)
+
+        if windowed:
+            np.clip(work, lower, upper, out=work)
+            work -= lower
+            work /= (upper - lower)
+            work *= 255.0
+        else:
+            chunk_min = pixel_min[start:stop].reshape((-1,) + (1,) * len(frame_axes))
+            chunk_range = np.where(varying[start:stop], pixel_max[start:stop] - pixel_min[start:stop], 1.0)
+            work -= chunk_min
+            work /= chunk_range.reshape(chunk_min.shape)
+            work *= 255.0
+
+        output[start:stop] = work
+
+    if not windowed and not varying.all():
+        # Constant frames are left unscaled, as in normalize_pixel_array
+        constant = ~varying
+        output[constant] = pixel_min[constant].astype(np.uint8).reshape((-1,) + (1,) * len(frame_axes))
+
+    if invert:
+        np.subtract(255, output, out=output)
+    return output
+
+
+def get_window(ds):
+    """
+    Return (window_center, window_width) from the dataset as floats, or None if absent.
+    Only the first value is used when multiple windows are defined.
+    """
+    window_center = getattr(ds, 'WindowCenter', None)
+    window_width = getattr(ds, 'WindowWidth', None)
+
+    if isinstance(window_center, (list, pydicom.multival.MultiValue)):
+        window_center = float(window_center[0])
+    elif window_center is not None:
+        window_center = float(window_center)
+
+    if isinstance(window_width, (list, pydicom.multival.MultiValue)):
+        window_width = float(window_width[0])
+    elif window_width is not None:
+        window_width = float(window_width)
+
+    return window_center, window_width
+
+
+def is_multiframe_stack(ds, shape):
+    """
+    Check whether decoded pixel data of this shape is converted as an animation: a
+    multi-frame file with more than one frame decoded. Single frames, including
+    color (rows, cols, 3) images, are converted to a still image.
+    """
+    return int(getattr(ds, 'NumberOfFrames', 1) or 1) > 1 and len(shape) > 2 and shape[0] > 1
+
+
+def stack_normalize_options(ds):
+    """Return the normalize_pixel_stack keyword arguments for the frames of ds."""
+    window_center, window_width = get_window(ds)
+    rescale = hasattr(ds, 'RescaleSlope') and hasattr(ds, 'RescaleIntercept')
+    return {
+        'window_center': window_center,
+        'window_width': window_width,
+        'slope': ds.RescaleSlope if rescale else None,
+        'intercept': ds.RescaleIntercept if rescale else None,
+        'invert': getattr(ds, 'PhotometricInterpretation', None) == "MONOCHROME1",
+        'voi_lut': get_voi_lut(ds),
+    }
+
+
+def single_frame_display(ds, pixel_array, preserve_precision=True):
+    """
+    Return the display image of a single frame.
+
+    With preserve_precision, unrescaled 16/32-bit integer data keeps its stored
+    range, scaled to uint16. Everything else is rescaled, windowed and normalized
+    to uint8 (rows, cols), or (rows, cols, 3) for color data.
+    """
+    rescale = hasattr(ds, 'RescaleSlope') and hasattr(ds, 'RescaleIntercept')
+    if (preserve_precision and not rescale
+            and pixel_array.dtype in [np.int16, np.uint16, np.int32, np.uint32]):
+        if supports_window_lut(pixel_array):
+            return apply_window_lut(pixel_array, window_lut_for(ds, pixel_array, out_bits=16, use_window=False))
+
+        # 32-bit data: scale to 0-65535 with integer math
+        pixel_min = int(pixel_array.min())
+        pixel_max = int(pixel_array.max())
+        if pixel_max > pixel_min:
+            pixel_16bit = pixel_array.astype(np.int64)
+            pixel_16bit -= pixel_min
+            pixel_16bit *= 65535
+            pixel_16bit //= pixel_max - pixel_min
+            pixel_16bit = pixel_16bit.astype(np.uint16)
+        else:
+            pixel_16bit = pixel_array.astype(np.uint16)
+
+        if hasattr(ds, 'PhotometricInterpretation') and ds.PhotometricInterpretation == "MONOCHROME1":
+            pixel_16bit = 65535 - pixel_16bit
+        return pixel_16bit
+
+    if supports_window_lut(pixel_array):
+        # Rescale, window and inversion in a single table lookup
+        return apply_window_lut(pixel_array, window_lut_for(ds, pixel_array))
+
+    # Apply rescale slope and intercept if present
+    if rescale:
+        pixel_array = pixel_array * float(ds.RescaleSlope) + float(ds.RescaleIntercept)
+
+    # Normalize pixel array
+    window_center, window_width = get_window(ds)
+    normalized_array = normalize_pixel_array(pixel_array, window_center, window_width)
+
+    # Handle photometric interpretation
+    if hasattr(ds, 'PhotometricInterpretation'):
+        if ds.PhotometricInterpretation == "MONOCHROME1":
+            # Invert for MONOCHROME1
+            normalized_array = 255 - normalized_array
+    return normalized_array
+
+
+class GifStreamWriter:
+    """
+    Write an animated grayscale GIF one frame at a time.
+
+    Unlike PIL's save(save_all=True), frames are encoded and written as they
+    arrive, so memory use does not grow with the number of frames. All frames
+    share the 256-level grayscale global palette written with the first frame,
+    so no frame is re-quantized or given a palette of its own.
+
+    With delta=True, each frame after the first only encodes the bounding
+    rectangle of the pixels that changed since the previous frame, drawn over
+    it (disposal 1). This is smaller for cines with a static background.
+
+    path may also be a binary file object, which is left open by close().
+    """
+
+    def __init__(self, path, duration, loop=0, delta=False):
+        self.path = path
+        self.duration = duration
+        self.loop = loop
+        self.delta = delta
+        self.frame_count = 0
+        self._previous = None
+        self._owns_fp = not hasattr(path, 'write')
+        self._fp = open(path, 'wb') if self._owns_fp else path
+
+    def write(self, frame):
+        """Append a 2D uint8 frame."""
+        offset = (0, 0)
+        if self.delta and self._previous is not None:
+            changed = frame != self._previous
+            rows = np.flatnonzero(changed.any(axis=1))
+            if rows.size:
+                cols = np.flatnonzero(changed.any(axis=0))
+                top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+            else:
+                # Identical frame: redraw a single pixel to keep the frame's duration
+                top, bottom, left, right = 0, 1, 0, 1
+            offset = (int(left), int(top))
+            img = Image.fromarray(np.ascontiguousarray(frame[top:bottom, left:right]), mode='L')
+        else:
+            img = Image.fromarray(frame, mode='L')
+
+        if self.frame_count == 0:
+            header, _ = GifImagePlugin.getheader(img, info={'loop': self.loop, 'optimize': False})
+            self._fp.write(b''.join(header))
+        disposal = 1 if self.delta else 2
+        self._fp.write(b''.join(GifImagePlugin.getdata(img, offset, duration=self.duration, disposal=disposal)))
+        if self.delta:
+            self._previous = frame.copy()
+        self.frame_count += 1
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.write(b';')  # GIF trailer
+            if self._owns_fp:
+                self._fp.close()
+            self._fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class OpenCVVideoEncoder:
+    """Write grayscale frames to an MP4 file with cv2.VideoWriter (default codec: mp4v)."""
+
+    label = 'MP4 video'
+
+    def __init__(self, output_base, fps, width, height, codec=None):
+        self.path = f"{output_base}.mp4"
+        self.codec = codec or 'mp4v'
+        self._writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.codec), fps,
+                                       (width, height), isColor=False)
+        if not self._writer.isOpened():
+            raise RuntimeError(f"OpenCV cannot write {self.codec} video to {self.path}")
+
+    def write(self, frame):
+        self._writer.write(frame)
+
+    def close(self):
+        self._writer.release()
+
+
+class FFmpegVideoEncoder:
+    """
+    Pipe grayscale frames as a raw gray8 stream into a local ffmpeg binary.
+
+    The default codec is H.264 (libx264, 'veryfast' preset), which is faster and
+    much smaller than OpenCV's mp4v. Odd frame sizes are padded to even ones,
+    as required by the yuv420p output.
+    """
+
+    label = 'MP4 video'
+
+    def __init__(self, output_base, fps, width, height, codec=None):
+        self.path = f"{output_base}.mp4"
+        self.codec = codec or 'libx264'
+        ffmpeg = shutil.which('ffmpeg')
+        if ffmpeg is None:
+            raise RuntimeError("ffmpeg was not found on PATH")
+        command = [
+            ffmpeg, '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'gray', '-s', f"{width}x{height}", '-r', str(fps), '-i', '-',
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-c:v', self.codec, '-pix_fmt', 'yuv420p',
+        ]
+        if self.codec in ('libx264', 'libx265'):
+            command += ['-preset', 'veryfast']
+        self._process = subprocess.Popen(command + [self.path], stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, frame):
+        self._process.stdin.write(np.ascontiguousarray(frame).data)
+
+    def close(self):
+        _, stderr = self._process.communicate()
+        if self._process.returncode:
+            raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='replace').strip()}")
+
+
+class ImageSequenceEncoder:
+    """Fallback without a video codec: write each frame as PNG into <output_base>_frames/."""
+
+    label = 'Image sequence'
+
+    def __init__(self, output_base, fps, width, height, codec=None):
+        self.path = Path(f"{output_base}_frames")
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._count = 0
+
+    def write(self, frame):
+        Image.fromarray(frame, mode='L').save(self.path / f"frame_{self._count:05d}.png")
+        self._count += 1
+
+    def close(self):
+        pass
+
+
+# Video encoder backends for multi-frame output, selected with --video-encoder
+VIDEO_ENCODERS = {
+    'opencv': OpenCVVideoEncoder,
+    'ffmpeg': FFmpegVideoEncoder,
+    'frames': ImageSequenceEncoder,
+}
+
+
+class BackgroundEncoder:
+    """
+    Run a video encoder in a background thread fed by a bounded queue.
+
+    write() only queues the frame, so the caller can normalize the next frames
+    while earlier ones are encoded; it blocks when max_queue frames are waiting,
+    which bounds memory. Frames must not be modified after they are queued.
+    An error in the encoder thread is raised by the next write() or by close().
+    """
+
+    def __init__(self, encoder, max_queue=32):
+        self.encoder = encoder
+        self.path = encoder.path
+        self.label = encoder.label
+        self.frame_count = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                break
+            if self._error is None:
+                try:
+                    self.encoder.write(frame)
+                except Exception as e:
+                    # Keep draining the queue so write() never blocks on a dead thread
+                    self._error = e
+
+    def write(self, frame):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(frame)
+        self.frame_count += 1
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self._error is not None:
+            # The encoder's own error explains a failure to close it as well
+            close_after_error(self.encoder)
+            raise self._error
+        self.encoder.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            close_after_error(self)
+
+
+def close_after_error(*writers):
+    """
+    Close GIF and video writers while an exception propagates, without replacing it:
+    errors raised by close() (e.g. a failed encoder thread or ffmpeg process) are
+    printed as warnings. None entries and writers that are already closed are skipped.
+    """
+    for writer in writers:
+        if writer is None:
+            continue
+        try:
+            writer.close()
+        except Exception as e:
+            print(f"  Warning: closing the {getattr(writer, 'label', 'GIF')} output failed: {e}")
+
+
+# Frames normalized per batch before they are handed to the GIF and video encoders
+ENCODE_BATCH_FRAMES = 16
+
+
+def open_video_encoder(name, output_base, fps, width, height, codec=None, max_queue=32):
+    """
+    Create the video encoder backend `name` (see VIDEO_ENCODERS), running in a background thread.
+
+    Args:
+        name: 'opencv', 'ffmpeg' or 'frames'
+        output_base: Output path without extension
+        fps: Frames per second
+        width, height: Frame size
+        codec: Backend codec (OpenCV fourcc or ffmpeg encoder name), None for the default
+        max_queue: Frames that may wait for the encoder before write() blocks
+    """
+    return BackgroundEncoder(VIDEO_ENCODERS[name](output_base, fps, width, height, codec), max_queue)
+
+
+def output_size(path):
+    """Size in bytes of an output file, or of all files in an output directory."""
+    path = Path(path)
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.iterdir() if f.is_file())
+    return path.stat().st_size
+
+
+def memmap_supported(ds):
+    """
+    Return True if the header of ds describes pixel data that memmap_pixels can map:
+    uncompressed little endian, 8/16/32 bits with BitsStored equal to BitsAllocated
+    (otherwise pydicom masks or sign-extends the values), and grayscale or RGB with
+    interleaved samples.
+    """
+    transfer_syntax = getattr(getattr(ds, 'file_meta', None), 'TransferSyntaxUID', None)
+    if (transfer_syntax is None or transfer_syntax.is_compressed or transfer_syntax.is_deflated
+            or not transfer_syntax.is_little_endian):
+        return False
+    bits = int(getattr(ds, 'BitsAllocated', 0) or 0)
+    if bits not in (8, 16, 32) or int(getattr(ds, 'BitsStored', bits) or bits) != bits:
+        return False
+    samples = int(getattr(ds, 'SamplesPerPixel', 1) or 1)
+    return samples == 1 or (ds.PhotometricInterpretation == 'RGB'
+                            and not int(getattr(ds, 'PlanarConfiguration', 0) or 0))
+
+
+def memmap_pixels(dicom_path):
+    """
+    Map the uncompressed pixel data of a file as a read-only numpy.memmap.
+
+    Only the header is parsed. The Pixel Data element is kept deferred, which gives
+    its file offset and length without reading it, and mapped with the dtype and
+    shape that ds.pixel_array would have. Frames are then read from the page cache
+    as they are used, instead of being copied into Python bytes and again into an
+    array.
+
+    Returns:
+        (header dataset without Pixel Data, memmap), or None if the pixel data cannot
+        be used as stored: compressed, deflated or big endian transfer syntaxes,
+        BitsAllocated other than 8/16/32, BitsStored below BitsAllocated (pydicom
+        masks or sign-extends those values), YBR or planar color data, or
+        truncated pixel data
+    """
+    ds = pydicom.dcmread(dicom_path, defer_size=1024)
+    elem = ds.get_item('PixelData', keep_deferred=True)
+    if elem is None or getattr(elem, 'value_tell', None) is None or elem.length == 0xFFFFFFFF:
+        return None
+    if not memmap_supported(ds) or not elem.is_little_endian:
+        return None
+
+    bits = int(ds.BitsAllocated)
+    samples = int(getattr(ds, 'SamplesPerPixel', 1) or 1)
+    num_frames = int(getattr(ds, 'NumberOfFrames', 1) or 1)
+    shape = ((num_frames,) if num_frames > 1 else ()) + (int(ds.Rows), int(ds.Columns)) \
+        + ((samples,) if samples > 1 else ())
+    dtype = np.dtype(f"<{'i' if int(getattr(ds, 'PixelRepresentation', 0) or 0) else 'u'}{bits // 8}")
+    size = int(np.prod(shape)) * dtype.itemsize
+    if elem.length < size or os.path.getsize(dicom_path) < elem.value_tell + size:
+        return None
+
+    del ds.PixelData
+    ds.pixel_data_stub = pixel_data_stub(elem.VR or 'OW', elem.length)
+    return ds, np.memmap(dicom_path, dtype=dtype, mode='r', offset=elem.value_tell, shape=shape)
+
+
+def iter_frames(dicom_path, ds, indices=None, use_memmap=False):
+    """
+    Yield the frames of a multi-frame DICOM file one at a time.
+
+    Each frame is decoded directly from the file, so only one frame is held in
+    memory.
+
+    Args:
+        indices: Optional 0-based frame numbers to yield, in this order. Only
+            these frames are read and decoded: the byte range of each frame for
+            native pixel data, or the fragments of each frame (located with the
+            offset table or by skipping fragment headers) for encapsulated pixel
+            data.
+        use_memmap: If True and dicom_path is a path to uncompressed pixel data,
+            yield views of its memmap (see memmap_pixels) instead of decoded copies
+    """
+    mapped = memmap_pixels(dicom_path) if use_memmap and isinstance(dicom_path, (str, os.PathLike)) else None
+    if mapped is not None:
+        pixel_array = mapped[1]
+        if pixel_array.ndim == 2 or (pixel_array.ndim == 3 and int(getattr(ds, 'NumberOfFrames', 1) or 1) == 1):
+            pixel_array = pixel_array[np.newaxis]
+        yield from (pixel_array if indices is None else (pixel_array[i] for i in indices))
+        return
+
+    from pydicom.pixels import iter_pixels
+    yield from iter_pixels(dicom_path, indices=indices)
+
+
+def parse_frame_ranges(text):
+    """
+    Parse a frame selection such as '0,5,100-150' (0-based, ranges inclusive)
+    into sorted, unique frame indices. Raises argparse.ArgumentTypeError if invalid,
+    including open-ended ranges such as '5-', whose end is not known before reading.
+    """
+    indices = set()
+    try:
+        for part in text.split(','):
+            start, dash, stop = part.strip().partition('-')
+            start = int(start)
+            stop = int(stop) if dash else start
+            if start < 0 or stop < start:
+                raise ValueError(part)
+            indices.update(range(start, stop + 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid frame selection {text!r}, expected e.g. 0,5,100-150 "
+                                         f"(ranges need both ends)")
+    return sorted(indices)
+
+
+def parse_crop(text):
+    """Parse a crop region 'X,Y,WIDTH,HEIGHT' in pixels. Raises argparse.ArgumentTypeError if invalid."""
+    try:
+        x, y, width, height = (int(v) for v in text.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid crop region {text!r}, expected X,Y,WIDTH,HEIGHT")
+    if x < 0 or y < 0 or width < 1 or height < 1:
+        raise argparse.ArgumentTypeError(f"invalid crop region {text!r}, expected X,Y,WIDTH,HEIGHT")
+    return x, y, width, height
+
+
+def selected_frames(ds, frames):
+    """
+    Return the frame indices of frames that exist in ds (all frames if frames is None).
+    Frame selections only apply to multi-frame files. Raises ValueError if none of
+    the selected frames exist.
+    """
+    num_frames = int(getattr(ds, 'NumberOfFrames', 1) or 1)
+    if frames is None or num_frames == 1:
+        return list(range(num_frames))
+    indices = [i for i in frames if i < num_frames]
+    if not indices:
+        raise ValueError(f"none of the selected frames exist, the file has {num_frames} frame(s)")
+    if len(indices) < len(frames):
+        print(f"  Warning: {len(frames) - len(indices)} selected frame(s) beyond frame {num_frames - 1} ignored")
+    return indices
+
+
+def check_crop(ds, crop):
+    """Raise ValueError if an (x, y, width, height) region starts outside the image of ds."""
+    x, y = crop[:2]
+    if x >= int(ds.Columns) or y >= int(ds.Rows):
+        raise ValueError(f"crop region starts outside the {ds.Columns}x{ds.Rows} image")
+
+
+def crop_frame(frame, crop):
+    """Return the (x, y, width, height) region of a frame as a view, clipped to the image."""
+    x, y, width, height = crop
+    return frame[y:y + height, x:x + width]
+
+
+def select_pixels(dicom_path, ds, frames=None, crop=None, use_memmap=False):
+    """
+    Decode only the selected frames and region of a file (see iter_frames).
+
+    The time to decode is proportional to the number of selected frames, not to
+    the size of the file. Cropping happens as each frame is decoded, so only the
+    region is kept.
+
+    Args:
+        dicom_path: Path, binary file object or Dataset of the DICOM file
+        ds: Header of the file (pixel data not needed)
+        frames: 0-based frame indices, or None for all frames
+        crop: (x, y, width, height) region, or None for the whole frame
+        use_memmap: If True, uncompressed pixel data is mapped (see memmap_pixels),
+            so only the cropped rows of the selected frames are read
+
+    Returns:
+        (frames, rows, cols) array for multi-frame files, even if one frame is
+        selected; the 2D image for single-frame files
+    """
+    indices = selected_frames(ds, frames)
+    if crop is not None:
+        check_crop(ds, crop)
+    output = None
+    for n, frame in enumerate(iter_frames(dicom_path, ds, indices, use_memmap)):
+        if crop is not None:
+            frame = crop_frame(frame, crop)
+        if output is None:
+            output = np.empty((len(indices),) + frame.shape, dtype=frame.dtype)
+        output[n] = frame
+    return output if int(getattr(ds, 'NumberOfFrames', 1) or 1) > 1 else output[0]
+
+
+def iter_frame_batches(frame_iter, batch_frames, crop=None):
+    """Group the frames of iter_frames into arrays of up to batch_frames frames, cropped if crop is set."""
+    batch = []
+    for frame in frame_iter:
+        batch.append(crop_frame(frame, crop) if crop is not None else frame)
+        if len(batch) == batch_frames:
+            yield np.stack(batch)
+            batch = []
+    if batch:
+        yield np.stack(batch)
+
+
+# Executors that decode_pixels can spread the frames of one file over
+DECODE_BACKENDS = ['thread', 'process']
+
+
+def _decode_frame(transfer_syntax, options, frame):
+    """
+    Decode the encoded bytes of one frame, with the options of a single-frame dataset.
+    The options are validated by decode_pixels for the whole pixel data; a single
+    frame can trip pydicom's check that compressed data is not the size of
+    uncompressed data.
+    """
+    from pydicom.encaps import encapsulate
+    from pydicom.pixels import get_decoder
+    return get_decoder(transfer_syntax).as_array(encapsulate([frame]), validate=False, **options)[0]
+
+
+def _decode_frames_into(out, transfer_syntax, options, frames, indices):
+    """Thread task of decode_pixels: decode frames into their slots of out."""
+    for i in indices:
+        out[i] = _decode_frame(transfer_syntax, options, frames[i])
+
+
+def _decode_frame_range(transfer_syntax, options, frames):
+    """Process task of decode_pixels: decode a run of frames, returned as one array."""
+    return np.stack([_decode_frame(transfer_syntax, options, frame) for frame in frames])
+
+
+def decode_pixels(ds, workers=1, backend='thread'):
+    """
+    Decode the pixel data of a fully read dataset, with the same result as ds.pixel_array.
+
+    With workers > 1, the encapsulated pixel data of compressed multi-frame files is
+    split into frames once, with the offset tables or by walking the fragment
+    headers, and the frames are decoded concurrently in runs that are written into
+    one preallocated array:
+    - thread: decodes the runs in this process. Threads only run in parallel while
+      the codec releases the GIL, which depends on how the pylibjpeg or pyjpegls
+      plugin was built.
+    - process: each run is sent to a worker process as encoded bytes. This works
+      with any codec, at the cost of starting the processes and copying the
+      decoded frames back.
+
+    Native pixel data, single frames and workers=1 use ds.pixel_array.
+
+    Args:
+        ds: Dataset read with its pixel data
+        workers: Number of threads or processes
+        backend: One of DECODE_BACKENDS
+    """
+    num_frames = int(getattr(ds, 'NumberOfFrames', 1) or 1)
+    transfer_syntax = ds.file_meta.TransferSyntaxUID
+    if workers <= 1 or num_frames < 2 or not transfer_syntax.is_compressed:
+        return ds.pixel_array
+
+    from pydicom.encaps import generate_frames
+    from pydicom.pixels import as_pixel_options, get_decoder
+    options = as_pixel_options(ds)
+    # The first frame is decoded from the dataset here, which validates the options
+    # and pixel data like ds.pixel_array and gives the dtype and shape of the output
+    first = get_decoder(transfer_syntax).as_array(ds, index=0, **options)[0]
+    frames = list(generate_frames(ds.PixelData, number_of_frames=num_frames,
+                                  extended_offsets=options.pop('extended_offsets', None)))
+    options['number_of_frames'] = 1
+    out = np.empty((num_frames,) + first.shape, dtype=first.dtype)
+    out[0] = first
+    runs = [run.tolist() for run in np.array_split(np.arange(1, num_frames), min(num_frames - 1, workers * 4))]
+    if backend == 'process':
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_decode_frame_range, transfer_syntax, options, frames[run[0]:run[-1] + 1])
+                       for run in runs]
+            for run, future in zip(runs, futures):
+                out[run[0]:run[-1] + 1] = future.result()
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(_decode_frames_into, out, transfer_syntax, options, frames, run)
+                           for run in runs]:
+                future.result()
+    return out
+
+
+# Conversion modes that --max-memory picks from, fastest first
+MEMORY_MODES = ['full', 'memmap', 'chunked', 'stream']
+
+# Memory of a converter process before it reads a file (interpreter, NumPy, pydicom,
+# Pillow, OpenCV); --max-memory reserves it once per worker
+WORKER_BASE_MEMORY = 100 * 1024 * 1024
+
+# Smallest share of --max-memory a worker gets for its files; fewer workers are
+# started rather than giving each one less
+MIN_WORKER_MEMORY = 64 * 1024 * 1024
+
+# Copies of the display frames held while PIL builds an optimized ('small') GIF
+GIF_SMALL_COPIES = 2.5
+
+
+def parse_memory_size(text):
+    """
+    Parse a memory size such as '512M', '4G' or '1.5GB' into bytes. K, M, G and T are
+    powers of 1024 and a plain number is in MB. Raises argparse.ArgumentTypeError if invalid.
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    value = text.strip().upper().rstrip('B').rstrip('I')
+    unit = units.get(value[-1:], None)
+    try:
+        size = float(value[:-1] if unit else value) * (unit or units['M'])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid memory size {text!r}, expected e.g. 512M or 4G")
+    if size <= 0:
+        raise argparse.ArgumentTypeError(f"invalid memory size {text!r}, expected e.g. 512M or 4G")
+    return int(size)
+
+
+def estimate_memory(ds, file_size, frames=None, crop=None, export_images=True, export_mp4=True,
+                    gif_profile='small', previews=False):
+    """
+    Estimate the peak memory of converting one file in each of MEMORY_MODES, from its
+    header only (Rows, Columns, NumberOfFrames, SamplesPerPixel and BitsAllocated).
+
+    The estimates add up the buffers that are alive at the same time:
+    - full: the encoded pixel data read with the file, the decoded array and the
+      display frames, with PIL's copies for an optimized GIF
+    - memmap: the display frames; mapped pixel data is page cache backed by the
+      file, which the kernel can drop at any time, so it is not counted
+    - chunked: the display frames and ENCODE_BATCH_FRAMES decoded frames
+    - stream: a few frames, the video encoder queue and the preview frames
+
+    Args:
+        ds: Header of the file
+        file_size: Size of the file in bytes
+        frames, crop, export_images, export_mp4, gif_profile: As for convert_dicom_to_image
+        previews: If True, thumbnails or pyramids are written as well
+
+    Returns:
+        Dict of mode -> estimated bytes. memmap is left out if the pixel data cannot
+        be mapped (see memmap_supported), chunked and stream for single frames.
+    """
+    num_frames = int(getattr(ds, 'NumberOfFrames', 1) or 1)
+    selected = num_frames if frames is None or num_frames == 1 else max(1, sum(1 for i in frames if i < num_frames))
+    rows, cols = int(ds.Rows), int(ds.Columns)
+    if crop is not None:
+        x, y, width, height = crop
+        rows, cols = max(0, min(height, rows - y)), max(0, min(width, cols - x))
+    samples = int(getattr(ds, 'SamplesPerPixel', 1) or 1)
+    pixel_frame = rows * cols * samples * max(1, int(ds.BitsAllocated) // 8)
+    encoded_frame = file_size // num_frames
+    # A full read holds the whole file; frame selections are decoded frame by frame
+    encoded = file_size if frames is None and crop is None else encoded_frame
+
+    if selected == 1:
+        # Display image and the encoder's filtered copy, at most 16 bits per sample
+        display = 4 * rows * cols * samples if export_images else 0
+        estimates = {'full': encoded + pixel_frame + display}
+        if memmap_supported(ds):
+            estimates['memmap'] = display
+        return estimates
+
+    display_frame = rows * cols * samples if export_images else 0
+    video_queue = min(selected, 32) * display_frame if export_mp4 else 0
+    display = int(selected * display_frame * (GIF_SMALL_COPIES if gif_profile == 'small' else 1)) + video_queue
+    estimates = {'full': encoded + selected * pixel_frame + display}
+    if memmap_supported(ds):
+        estimates['memmap'] = display + pixel_frame
+    estimates['chunked'] = display + 2 * ENCODE_BATCH_FRAMES * pixel_frame + encoded_frame
+    preview_frames = min(selected, CONTACT_SHEET_FRAMES) * display_frame if previews else 0
+    estimates['stream'] = pixel_frame + encoded_frame + 4 * display_frame + video_queue + preview_frames
+    return estimates
+
+
+def plan_memory(estimates, max_memory, use_memmap=False):
+    """
+    Pick the first of MEMORY_MODES in estimates (see estimate_memory) that fits in
+    max_memory bytes, or the leanest one if none fits. With use_memmap, files that
+    can be mapped are never read in full.
+
+    Returns:
+        (mode, True if its estimate fits in max_memory)
+    """
+    modes = [mode for mode in MEMORY_MODES if mode in estimates]
+    if use_memmap and 'memmap' in estimates:
+        modes.remove('full')
+    for mode in modes:
+        if estimates[mode] <= max_memory:
+            return mode, True
+    return min(modes, key=estimates.get), False
+
+
+def plan_workers(max_memory, workers):
+    """
+    Split a --max-memory budget between worker processes.
+
+    Every worker process costs WORKER_BASE_MEMORY before it reads a file and gets an
+    equal share of the rest for converting its files. Fewer workers are used if a share
+    would be smaller than MIN_WORKER_MEMORY. A single worker is the running process,
+    whose base memory is already spent, so it gets the whole budget.
+
+    Returns:
+        (number of workers, bytes per file)
+    """
+    while workers > 1 and (max_memory - workers * WORKER_BASE_MEMORY) // workers < MIN_WORKER_MEMORY:
+        workers -= 1
+    if workers == 1:
+        return 1, max_memory
+    return workers, (max_memory - workers * WORKER_BASE_MEMORY) // workers
+
+
+def convert_multiframe_streaming(dicom_path, ds, output_base, export_mp4=True, fps=10,
+                                 export_npy=False, export_images=True, profile=None, gif_delta=False,
+                                 video_encoder='opencv', video_codec=None, thumbnail_size=None, pyramid_levels=0,
+                                 contact_sheet=False, image_format='png', png_compression=None, frames=None,
+                                 crop=None, use_memmap=False):
+    """
+    Convert a multi-frame DICOM file to GIF/MP4 frame by frame.
+
+    Each frame is decoded, normalized and handed to the GIF and video writers before
+    the next one is read, keeping peak memory roughly constant in the number of frames.
+    The video is encoded in a background thread while the next frames are decoded.
+
+    Args:
+        dicom_path: Path to DICOM file
+        ds: Dataset read without pixel data (stop_before_pixels=True)
+        output_base: Output path without extension
+        export_mp4: If True, also export an MP4 video
+        fps: Frames per second for video output
+        export_npy: If True, also write the rescaled frames to a memory-mapped .npy
+        export_images: If False, skip the GIF and MP4 outputs
+        profile: Optional FileProfile; per-frame stages accumulate into it
+        gif_delta: If True, GIF frames only encode the rectangle that changed
+            since the previous frame (see GifStreamWriter)
+        video_encoder: Video backend, a key of VIDEO_ENCODERS
+        video_codec: Codec for the video backend, None for its default
+        thumbnail_size, pyramid_levels, contact_sheet: Preview outputs, see write_previews;
+            only the preview frames are kept in memory
+        image_format, png_compression: Format of the preview images
+        frames: Optional 0-based frame indices to convert; only these are decoded
+        crop: Optional (x, y, width, height) region to keep of each frame
+        use_memmap: If True, frames of uncompressed files are read through a memmap
+    """
+    profile = profile or FileProfile(dicom_path)
+    normalize_options = stack_normalize_options(ds)
+    indices = selected_frames(ds, frames) if frames is not None else None
+    if crop is not None:
+        check_crop(ds, crop)
+    total_frames = len(indices) if indices is not None else int(ds.NumberOfFrames)
+    previews = export_images and (thumbnail_size or pyramid_levels)
+    preview_indices = set(preview_frame_indices(total_frames, contact_sheet)) if previews else set()
+    preview_frames = []
+
+    output_gif = f"{output_base}.gif"
+    output_npy = f"{output_base}.npy"
+    gif = GifStreamWriter(output_gif, duration=int(1000 / fps), delta=gif_delta) if export_images else None
+    video = None
+    volume = None
+    volume_shape = None
+    frame_count = 0
+
+    frame_iter = iter_frames(dicom_path, ds, indices, use_memmap)
+    try:
+        for i in itertools.count():
+            with profile.stage('decode') as counters:
+                frame = next(frame_iter, None)
+                if frame is not None:
+                    if crop is not None:
+                        frame = crop_frame(frame, crop)
+                    counters['bytes_out'] = frame.nbytes
+            if frame is None:
+                break
+
+            if export_npy:
+                with profile.stage('npy', frame.nbytes):
+                    if volume is None:
+                        volume_shape = (total_frames,) + frame.shape
+                        volume = np.lib.format.open_memmap(output_npy, mode='w+', shape=volume_shape,
+                                                           dtype=rescaled_dtype(ds, frame.dtype))
+                    rescale_into(volume[i], frame, ds)
+            frame_count += 1
+
+            if not export_images:
+                continue
+
+            # Windowed integer frames reuse one cached LUT for the whole file
+            with profile.stage('normalize', frame.nbytes) as counters:
+                normalized_frame = normalize_pixel_stack(frame[np.newaxis], **normalize_options)[0]
+                counters['bytes_out'] = normalized_frame.nbytes
+
+            with profile.stage('encode_gif', normalized_frame.nbytes):
+                gif.write(normalized_frame)
+            if i in preview_indices:
+                preview_frames.append(normalized_frame)
+
+            if export_mp4:
+                with profile.stage('encode_mp4', normalized_frame.nbytes):
+                    if video is None:
+                        height, width = normalized_frame.shape
+                        video = open_video_encoder(video_encoder, output_base, fps, width, height, video_codec)
+                    video.write(normalized_frame)
+        if gif is not None:
+            gif.close()
+        if video is not None:
+            with profile.stage('encode_mp4'):
+                video.close()
+    except BaseException:
+        close_after_error(gif, video)
+        raise
+    finally:
+        if volume is not None:
+            volume.flush()
+            del volume
+
+    if gif is not None:
+        profile.add_bytes('encode_gif', bytes_out=os.path.getsize(output_gif))
+        print(f"  GIF animation saved to: {output_gif} ({frame_count} frames, streamed)")
+    if video is not None:
+        profile.add_bytes('encode_mp4', bytes_out=output_size(video.path))
+        print(f"  {video.label} saved to: {video.path} ({frame_count} frames, {fps} fps)")
+    if preview_frames:
+        previews = encode_previews(contact_sheet_image(preview_frames) if contact_sheet else preview_frames[0],
+                                   thumbnail_size, pyramid_levels, image_format, png_compression, profile)
+        write_previews(previews, output_base, image_format, profile=profile)
+    if export_npy:
+        write_npy_sidecar(output_npy, ds, volume_shape, dicom_path)
+        profile.add_bytes('npy', bytes_out=os.path.getsize(output_npy))
+        print(f"  Raw volume saved to: {output_npy} ({frame_count} frames, streamed)")
+
+
+def rescaled_dtype(ds, stored_dtype):
+    """
+    Return the dtype that holds the rescaled values of stored_dtype pixels of ds.
+
+    Without rescaling this is the stored dtype. Integer slope and intercept keep
+    integer data in the smallest of int16/int32 that fits the BitsStored range;
+    anything else becomes float32.
+    """
+    stored_dtype = np.dtype(stored_dtype)
+    if not (hasattr(ds, 'RescaleSlope') and hasattr(ds, 'RescaleIntercept')):
+        return stored_dtype
+
+    slope = float(ds.RescaleSlope)
+    intercept = float(ds.RescaleIntercept)
+    if stored_dtype.kind not in 'iu' or not slope.is_integer() or not intercept.is_integer():
+        return np.dtype(np.float32)
+
+    bits_stored = int(getattr(ds, 'BitsStored', 8 * stored_dtype.itemsize) or 8 * stored_dtype.itemsize)
+    if stored_dtype.kind == 'i':
+        stored_min, stored_max = -2 ** (bits_stored - 1), 2 ** (bits_stored - 1) - 1
+    else:
+        stored_min, stored_max = 0, 2 ** bits_stored - 1
+    low, high = sorted((stored_min * slope + intercept, stored_max * slope + intercept))
+    for dtype in (np.int16, np.int32):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.float32)
+
+
+def rescale_into(out, pixel_array, ds):
+    """Write the rescaled values of pixel_array into out in place, without temporaries."""
+    out[...] = pixel_array
+    if hasattr(ds, 'RescaleSlope') and hasattr(ds, 'RescaleIntercept'):
+        slope = float(ds.RescaleSlope)
+        intercept = float(ds.RescaleIntercept)
+        if out.dtype.kind in 'iu':
+            slope, intercept = int(slope), int(intercept)
+        if slope != 1:
+            out *= slope
+        if intercept != 0:
+            out += intercept
+
+
+def write_npy_sidecar(output_npy, ds, shape, dicom_path, slice_positions=None):
+    """
+    Write a JSON sidecar next to a raw .npy volume describing how to interpret it.
+    """
+    sidecar = {
+        'source': str(dicom_path),
+        'shape': list(shape),
+        'rescale_applied': hasattr(ds, 'RescaleSlope') and hasattr(ds, 'RescaleIntercept'),
+    }
+    for tag in ['RescaleSlope', 'RescaleIntercept', 'PixelSpacing', 'SliceThickness',
+                'PhotometricInterpretation', 'WindowCenter', 'WindowWidth', 'Modality']:
+        if hasattr(ds, tag):
+            sidecar[tag] = _metadata_value(getattr(ds, tag))
+    if slice_positions is not None:
+        sidecar['slice_positions'] = slice_positions
+
+    with open(Path(output_npy).with_suffix('.json'), 'w', encoding='utf-8') as f:
+        json.dump(sidecar, f, indent=2)
+
+
+def export_npy_volume(pixel_array, ds, output_base, dicom_path):
+    """
+    Write the rescaled pixel data of a file to a memory-mapped .npy with a JSON sidecar.
+    Single-frame images are stored as 2D arrays, multi-frame files as (frames, rows, cols).
+    """
+    output_npy = f"{output_base}.npy"
+    volume = np.lib.format.open_memmap(output_npy, mode='w+', shape=pixel_array.shape,
+                                       dtype=rescaled_dtype(ds, pixel_array.dtype))
+    rescale_into(volume, pixel_array, ds)
+    volume.flush()
+    del volume
+    write_npy_sidecar(output_npy, ds, pixel_array.shape, dicom_path)
+    print(f"  Raw volume saved to: {output_npy} ({'x'.join(str(n) for n in pixel_array.shape)}, "
+          f"{rescaled_dtype(ds, pixel_array.dtype)})")
+
+
+def save_output(path, data, output_writer=None, profile=None):
+    """
+    Write an encoded output file, directly or through an output writer (see OutputWriter).
+
+    Args:
+        path: Output file path
+        data: File contents, bytes or text (written as UTF-8)
+        output_writer: Optional OutputWriter that writes the file on a writer thread
+        profile: Optional FileProfile that a direct write is recorded in as the
+            'write' stage (an output writer records its own writes)
+
+    Returns:
+        Size of the file in bytes
+    """
+    if output_writer is not None:
+        return output_writer.write(path, data)
+    if profile is not None:
+        with profile.stage('write') as counters:
+            counters['bytes_out'] = counters['bytes_in'] = save_output(path, data)
+        return counters['bytes_out']
+    if isinstance(data, str):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(data)
+    else:
+        with open(path, 'wb') as f:
+            f.write(data)
+    return os.path.getsize(path)
+
+
+def encode_grayscale_png(pixel_array, compress_level=6):
+    """
+    Encode a 2D uint8 or uint16 array as a grayscale PNG directly from its buffer.
+
+    Rows are stored unfiltered and deflated with zlib in one call, skipping PIL's
+    per-row filter selection; for 16-bit images this is several times faster than
+    PIL at low compression levels and usually no larger at the default level.
+
+    Args:
+        pixel_array: 2D uint8 or uint16 array
+        compress_level: zlib level, 0 (store) to 9 (smallest)
+
+    Returns:
+        PNG file contents as bytes
+    """
+    height, width = pixel_array.shape
+    bit_depth = pixel_array.dtype.itemsize * 8
+    samples = np.ascontiguousarray(pixel_array, dtype='>u2' if bit_depth == 16 else np.uint8)
+
+    # Each row is prefixed with its filter type byte (0 = None)
+    raw = np.zeros((height, 1 + samples.nbytes // height), dtype=np.uint8)
+    raw[:, 1:] = samples.view(np.uint8).reshape(height, -1)
+
+    def chunk(chunk_type, data):
+        return (struct.pack('>I', len(data)) + chunk_type + data
+                + struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+    header = struct.pack('>IIBBBBB', width, height, bit_depth, 0, 0, 0, 0)  # grayscale, no interlace
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(raw.data, compress_level)) + chunk(b'IEND', b''))
+
+
+def encode_image(display, image_format='png', png_compression=None):
+    """
+    Encode a display image from single_frame_display as PNG or uncompressed TIFF.
+
+    Args:
+        display: uint8 grayscale/RGB or uint16 grayscale array
+        image_format: 'png' or 'tiff'
+        png_compression: zlib level 0-9 for PNG, None for the default (6)
+
+    Returns:
+        File contents as bytes
+    """
+    if image_format == 'png' and display.dtype == np.uint16:
+        return encode_grayscale_png(display, 6 if png_compression is None else png_compression)
+    params = {}
+    if image_format == 'png' and png_compression is not None:
+        params['compress_level'] = png_compression
+    buffer = io.BytesIO()
+    Image.fromarray(display).save(buffer, format='TIFF' if image_format == 'tiff' else 'PNG', **params)
+    return buffer.getvalue()
+
+
+def encode_gif(frames, fps=10, gif_profile='small', gif_delta=False):
+    """
+    Encode uint8 (frames, rows, cols) display frames as an animated GIF.
+
+    Args:
+        frames: Normalized frames, e.g. from normalize_pixel_stack
+        fps: Frames per second
+        gif_profile: 'small' optimizes the GIF with PIL for size; 'fast' writes all
+            frames with one shared grayscale palette (see GifStreamWriter)
+        gif_delta: With the 'fast' profile, only encode changed rectangles
+
+    Returns:
+        File contents as bytes
+    """
+    buffer = io.BytesIO()
+    if gif_profile == 'fast':
+        with GifStreamWriter(buffer, duration=int(1000 / fps), delta=gif_delta) as gif:
+            for frame in frames:
+                gif.write(frame)
+    else:
+        frames_pil = [Image.fromarray(frame, mode='L') for frame in frames]
+        frames_pil[0].save(
+            buffer,
+            format='GIF',
+            save_all=True,
+            append_images=frames_pil[1:],
+            duration=int(1000 / fps),  # Convert fps to duration in ms
+            loop=0,
+            optimize=True,  # Enable optimization to reduce file size
+            disposal=2  # Clear frame before next frame (reduces size for medical images)
+        )
+    return buffer.getvalue()
+
+
+CONTACT_SHEET_FRAMES = 16
+
+
+def downsample_area(image, factor):
+    """
+    Shrink an image by an integer factor, averaging each factor x factor block.
+
+    Edges that do not fill a whole block are padded with the last row/column, so the
+    result has ceil(rows / factor) x ceil(cols / factor) pixels and keeps the dtype.
+    """
+    if factor <= 1:
+        return image.copy()
+    height, width = image.shape[:2]
+    out_height, out_width = -(-height // factor), -(-width // factor)
+    pad = [(0, out_height * factor - height), (0, out_width * factor - width)] + [(0, 0)] * (image.ndim - 2)
+    if pad[0][1] or pad[1][1]:
+        image = np.pad(image, pad, mode='edge')
+    blocks = image.reshape((out_height, factor, out_width, factor) + image.shape[2:])
+    total = blocks.sum(axis=(1, 3), dtype=np.uint32 if image.dtype.itemsize == 1 else np.uint64)
+    count = factor * factor
+    return ((total + count // 2) // count).astype(image.dtype)
+
+
+def preview_frame_indices(num_frames, contact_sheet=False):
+    """Frames shown in the preview of a multi-frame file: the middle one, or up to
+    CONTACT_SHEET_FRAMES evenly spaced ones for a contact sheet."""
+    if not contact_sheet:
+        return [num_frames // 2]
+    count = min(CONTACT_SHEET_FRAMES, num_frames)
+    return sorted({int(round(i)) for i in np.linspace(0, num_frames - 1, count)})
+
+
+def contact_sheet_image(frames):
+    """Tile frames into a near-square mosaic, row by row."""
+    frames = np.asarray(frames)
+    count, height, width = frames.shape[:3]
+    cols = int(np.ceil(np.sqrt(count)))
+    rows = -(-count // cols)
+    sheet = np.zeros((rows * height, cols * width) + frames.shape[3:], dtype=frames.dtype)
+    for i, frame in enumerate(frames):
+        row, col = divmod(i, cols)
+        sheet[row * height:(row + 1) * height, col * width:(col + 1) * width] = frame
+    return sheet
+
+
+def preview_images(image, thumbnail_size=None, pyramid_levels=0):
+    """
+    Build the downsampled previews of a display image with area averaging.
+
+    Args:
+        image: Display image (single frame, keyframe or contact sheet)
+        thumbnail_size: Longest edge of the thumbnail in pixels, None for no thumbnail;
+            the image is shrunk by the smallest integer factor that fits
+        pyramid_levels: Number of pyramid levels; level k is 1/2**k of the full size
+            and is computed from level k - 1
+
+    Returns:
+        Dict mapping output name suffixes ('thumb', 'L1', 'L2', ...) to arrays
+    """
+    previews = {}
+    level = image
+    for k in range(1, pyramid_levels + 1):
+        level = downsample_area(level, 2)
+        previews[f"L{k}"] = level
+    if thumbnail_size:
+        previews['thumb'] = downsample_area(image, -(-max(image.shape[:2]) // thumbnail_size))
+    return previews
+
+
+def encode_previews(image, thumbnail_size=None, pyramid_levels=0, image_format='png', png_compression=None,
+                    profile=None):
+    """
+    Encode the thumbnail and pyramid levels of a display image (see preview_images)
+    with encode_image, recording them as the 'preview' stage of profile.
+
+    Returns:
+        Dict mapping output name suffixes ('thumb', 'L1', ...) to encoded bytes
+    """
+    profile = profile or FileProfile(None)
+    with profile.stage('preview', image.nbytes) as counters:
+        previews = {name: encode_image(preview, image_format, png_compression)
+                    for name, preview in preview_images(image, thumbnail_size, pyramid_levels).items()}
+        counters['bytes_out'] = sum(len(data) for data in previews.values())
+    return previews
+
+
+def write_previews(previews, output_base, image_format='png', output_writer=None, profile=None):
+    """
+    Write previews from encode_previews next to the main outputs, as <name>_thumb.png
+    and <name>_L1.png, <name>_L2.png, ... (or .tif).
+    """
+    suffix = 'tif' if image_format == 'tiff' else 'png'
+    for name, data in previews.items():
+        save_output(f"{output_base}_{name}.{suffix}", data, output_writer, profile)
+    print(f"  Previews saved to: {output_base}_*.{suffix} ({', '.join(previews)})")
+
+
+# Key patient, study and image information, in output order
+IMPORTANT_TAGS = [
+    'PatientName', 'PatientID', 'PatientBirthDate', 'PatientSex',
+    'StudyDate', 'StudyTime', 'StudyDescription', 'SeriesDescription',
+    'Modality', 'InstitutionName', 'Manufacturer', 'ManufacturerModelName',
+    'ImageComments', 'StudyComments', 'SeriesNumber', 'InstanceNumber',
+    'ImageType', 'PhotometricInterpretation', 'SamplesPerPixel',
+    'Rows', 'Columns', 'BitsAllocated', 'BitsStored',
+    'WindowCenter', 'WindowWidth', 'RescaleIntercept', 'RescaleSlope'
+]
+
+
+class _ValueLength:
+    """Value of a Pixel Data stand-in: only has the length of the value in the file."""
+
+    def __init__(self, length):
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+
+def pixel_data_stub(vr, length):
+    """
+    Return a stand-in Pixel Data element with the VR and value length of the element in
+    the file but no value. Headers read without pixel data keep it as ds.pixel_data_stub,
+    so the metadata text lists Pixel Data as after a full read (see extract_metadata).
+    """
+    return pydicom.DataElement(0x7FE00010, vr, _ValueLength(length), validation_mode=pydicom.config.IGNORE)
+
+
+def _read_pixel_data_stub(fp, ds):
+    """
+    Read the header of the Pixel Data element at the current position of fp (where
+    dcmread with stop_before_pixels leaves it) and return its pixel_data_stub, or None.
+    For encapsulated pixel data only the item headers are read to find its length.
+    """
+    implicit, little_endian = ds.original_encoding
+    endian = '<' if little_endian else '>'
+    header = fp.read(8)
+    if len(header) < 8 or struct.unpack(f'{endian}HH', header[:4]) != (0x7FE0, 0x0010):
+        return None
+    if implicit:
+        vr, length = 'OW', struct.unpack(f'{endian}L', header[4:])[0]
+    else:
+        vr = header[4:6].decode('ascii', errors='replace')
+        length = struct.unpack(f'{endian}L', fp.read(4))[0]
+    if length != 0xFFFFFFFF:
+        return pixel_data_stub(vr, length)
+
+    # Encapsulated: skip the items up to the sequence delimiter
+    start = fp.tell()
+    while True:
+        item = fp.read(8)
+        if len(item) < 8:
+            return None
+        group, element, item_length = struct.unpack(f'{endian}HHL', item)
+        if (group, element) == (0xFFFE, 0xE0DD):
+            return pixel_data_stub('OB', fp.tell() - 8 - start)
+        fp.seek(item_length, os.SEEK_CUR)
+
+
+def read_dicom_header(dicom_path):
+    """
+    Read a DICOM file without its pixel data.
+
+    Reading stops at the Pixel Data element, so the cost does not depend on the
+    number or size of frames. The element's VR and length are kept as
+    ds.pixel_data_stub (see pixel_data_stub).
+    """
+    with open(dicom_path, 'rb') as fp:
+        ds = pydicom.dcmread(fp, stop_before_pixels=True)
+        ds.pixel_data_stub = _read_pixel_data_stub(fp, ds)
+    return ds
+
+
+def export_metadata(dicom_path, output_dir, write_txt=True, metadata_records=None, record_all_tags=False,
+                    profile=None, ds=None, output_writer=None):
+    """
+    Write the metadata text file for a DICOM file without decoding its pixel data.
+
+    Args:
+        dicom_path: Path to DICOM file
+        output_dir: Directory to save the .txt file
+        write_txt: If False, skip the metadata text file
+        metadata_records: Optional list that the file's metadata record is appended to
+        record_all_tags: If True, the metadata record includes every element
+        profile: Optional FileProfile that the read and metadata stages are recorded in
+        ds: Optional header already read by the caller (see prefetch_dataset)
+        output_writer: Optional OutputWriter for the text file
+
+    Returns:
+        True if successful, False otherwise
+    """
+    profile = profile or FileProfile(dicom_path)
+    try:
+        if ds is None:
+            with profile.stage('read') as counters:
+                ds = read_dicom_header(dicom_path)
+                counters['bytes_in'] = os.path.getsize(dicom_path)
+        output_base = Path(output_dir) / Path(dicom_path).stem
+        _write_metadata(ds, dicom_path, output_base, write_txt, metadata_records, record_all_tags, profile,
+                        output_writer)
+        return True
+
+    except pydicom.errors.InvalidDicomError:
+        print(f"  Error: {dicom_path} is not a valid DICOM file")
+        return False
+    except Exception as e:
+        print(f"  Error processing {dicom_path}: {str(e)}")
+        return False
+
+
+def extract_metadata(ds, output_txt_path, output_writer=None):
+    """
+    Extract DICOM metadata and save to text file.
+
+    Returns:
+        Size of the text file in bytes
+    """
+    f = io.StringIO()
+    f.write("=" * 80 + "\n")
+    f.write("DICOM Metadata\n")
+    f.write("=" * 80 + "\n\n")
+
+    # Extract key patient and study information
+    f.write("Key Information:\n")
+    f.write("-" * 80 + "\n")
+    for tag in IMPORTANT_TAGS:
+        if hasattr(ds, tag):
+            value = getattr(ds, tag)
+            f.write(f"{tag}: {value}\n")
+
+    f.write("\n" + "=" * 80 + "\n")
+    f.write("Complete DICOM Header:\n")
+    f.write("=" * 80 + "\n\n")
+    stub = getattr(ds, 'pixel_data_stub', None)
+    if stub is not None and 'PixelData' not in ds:
+        # Header read without pixel data: list Pixel Data as a full read does
+        ds.add(stub)
+        try:
+            f.write(str(ds))
+        finally:
+            del ds[stub.tag]
+    else:
+        f.write(str(ds))
+    return save_output(output_txt_path, f.getvalue(), output_writer)
+
+
+def _metadata_value(value):
+    """Convert a DICOM element value to a JSON/CSV friendly value, or None if it has none."""
+    if isinstance(value, (list, pydicom.multival.MultiValue)):
+        return [_metadata_value(v) for v in value]
+    if isinstance(value, (bytes, pydicom.sequence.Sequence)):
+        return None
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float):
+        return float(value)
+    return str(value)
+
+
+def metadata_record(ds, dicom_path, all_tags=False):
+    """
+    Build a flat, machine-readable metadata record for a dataset.
+
+    Args:
+        ds: DICOM dataset (pixel data is not needed)
+        dicom_path: Source path, stored in the 'path' field (None if unknown)
+        all_tags: If True, include every top-level element (keyed by keyword,
+            or by tag for private elements) instead of only IMPORTANT_TAGS.
+            Sequences and binary values are left out.
+    """
+    record = {'path': str(dicom_path) if dicom_path is not None else None}
+    if all_tags:
+        for elem in ds:
+            if elem.VR == 'SQ' or elem.tag == 0x7FE00010:
+                continue
+            value = _metadata_value(elem.value)
+            if value is not None:
+                record[elem.keyword or str(elem.tag)] = value
+    else:
+        for tag in IMPORTANT_TAGS:
+            if hasattr(ds, tag):
+                record[tag] = _metadata_value(getattr(ds, tag))
+    return record
+
+
+class MetadataExportWriter:
+    """
+    Stream metadata records for many files into one JSON Lines or CSV file.
+
+    The format is taken from the file extension (.csv for CSV, anything else is
+    JSON Lines). CSV files have one column per entry of IMPORTANT_TAGS; multi-valued
+    elements are joined with a backslash, as in DICOM.
+    """
+
+    def __init__(self, path, all_tags=False):
+        self.path = Path(path)
+        self.format = 'csv' if self.path.suffix.lower() == '.csv' else 'jsonl'
+        if self.format == 'csv' and all_tags:
+            raise ValueError("CSV metadata export only supports the key tags, use .jsonl for all tags")
+        self.count = 0
+        self._fp = open(self.path, 'w', encoding='utf-8', newline='')
+        if self.format == 'csv':
+            self._csv = csv.DictWriter(self._fp, fieldnames=['path'] + IMPORTANT_TAGS, extrasaction='ignore')
+            self._csv.writeheader()
+
+    def write(self, record):
+        if self.format == 'csv':
+            self._csv.writerow({
+                key: '\\'.join(str(v) for v in value) if isinstance(value, list) else value
+                for key, value in record.items()
+            })
+        else:
+            self._fp.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        self.count += 1
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _write_metadata(ds, dicom_path, output_base, write_txt, metadata_records, record_all_tags, profile=None,
+                    output_writer=None):
+    """Write the metadata text file and/or collect the metadata record for one file."""
+    profile = profile or FileProfile(dicom_path)
+    with profile.stage('metadata') as counters:
+        if write_txt:
+            output_txt = f"{output_base}.txt"
+            counters['bytes_out'] = extract_metadata(ds, output_txt, output_writer)
+            print(f"  Metadata saved to: {output_txt}")
+        if metadata_records is not None:
+            metadata_records.append(metadata_record(ds, dicom_path, record_all_tags))
+
+
+# Conversion stages reported by --profile, in output order
+PROFILE_STAGES = ['read', 'decode', 'normalize', 'encode_png', 'encode_tiff', 'encode_gif', 'encode_mp4', 'preview',
+                  'npy', 'metadata', 'write']
+
+
+class FileProfile:
+    """
+    Wall time, CPU time and bytes in/out of each conversion stage for one file.
+
+    A stage costs two clock reads at each end, so conversions are always profiled;
+    --profile only decides whether the records are written out. CPU time is that of
+    the calling thread, so work done by other threads is not counted.
+    """
+
+    def __init__(self, dicom_path):
+        self.dicom_path = str(dicom_path)
+        self.stages = {}
+        self._start = time.perf_counter()
+
+    def _totals(self, name):
+        return self.stages.setdefault(name, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'bytes_in': 0, 'bytes_out': 0})
+
+    @contextmanager
+    def stage(self, name, bytes_in=0):
+        """
+        Time the enclosed block as stage `name`. The block can set 'bytes_in' and
+        'bytes_out' on the yielded dict. Repeated stages (e.g. per frame) accumulate.
+        """
+        counters = {'bytes_in': bytes_in, 'bytes_out': 0}
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield counters
+        finally:
+            totals = self._totals(name)
+            totals['calls'] += 1
+            totals['wall_s'] += time.perf_counter() - wall_start
+            totals['cpu_s'] += time.thread_time() - cpu_start
+            totals['bytes_in'] += counters['bytes_in']
+            totals['bytes_out'] += counters['bytes_out']
+
+    def add(self, name, wall_s, cpu_s, bytes_in=0, bytes_out=0, calls=1):
+        """Add a stage that was timed elsewhere, e.g. on a reader or writer thread."""
+        totals = self._totals(name)
+        totals['calls'] += calls
+        totals['wall_s'] += wall_s
+        totals['cpu_s'] += cpu_s
+        totals['bytes_in'] += bytes_in
+        totals['bytes_out'] += bytes_out
+
+    def add_bytes(self, name, bytes_in=0, bytes_out=0):
+        """Add bytes to a stage without timing anything, e.g. the final size of a streamed file."""
+        totals = self._totals(name)
+        totals['bytes_in'] += bytes_in
+        totals['bytes_out'] += bytes_out
+
+    def record(self, success):
+        """Return the profile as a JSON-serializable record."""
+        return {
+            'path': self.dicom_path,
+            'success': success,
+            'wall_s': time.perf_counter() - self._start,
+            'stages': self.stages,
+        }
+
+
+class ProfileTraceWriter:
+    """
+    Stream per-file profile records into a JSON Lines or CSV trace and aggregate them.
+
+    As for MetadataExportWriter, the format is taken from the file extension. CSV files
+    have one row per file with wall_s, cpu_s, bytes_in and bytes_out columns per stage.
+    On close, the aggregated summary (see summary()) is written next to the trace as
+    <name>.summary.json.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.summary_path = self.path.with_suffix('.summary.json')
+        self.format = 'csv' if self.path.suffix.lower() == '.csv' else 'jsonl'
+        self.count = 0
+        self.failed = 0
+        self.wall_s = 0.0
+        self.totals = {}
+        self._fp = open(self.path, 'w', encoding='utf-8', newline='')
+        if self.format == 'csv':
+            fieldnames = ['path', 'success', 'wall_s'] + [
+                f"{stage}_{field}" for stage in PROFILE_STAGES
+                for field in ('wall_s', 'cpu_s', 'bytes_in', 'bytes_out')
+            ]
+            self._csv = csv.DictWriter(self._fp, fieldnames=fieldnames, extrasaction='ignore')
+            self._csv.writeheader()
+
+    def write(self, record):
+        if self.format == 'csv':
+            row = {'path': record['path'], 'success': record['success'], 'wall_s': f"{record['wall_s']:.6f}"}
+            for stage, values in record['stages'].items():
+                row[f"{stage}_wall_s"] = f"{values['wall_s']:.6f}"
+                row[f"{stage}_cpu_s"] = f"{values['cpu_s']:.6f}"
+                row[f"{stage}_bytes_in"] = values['bytes_in']
+                row[f"{stage}_bytes_out"] = values['bytes_out']
+            self._csv.writerow(row)
+        else:
+            self._fp.write(json.dumps(record) + '\n')
+
+        self.count += 1
+        self.failed += not record['success']
+        self.wall_s += record['wall_s']
+        for stage, values in record['stages'].items():
+            totals = self.totals.setdefault(stage, dict.fromkeys(values, 0))
+            for key, value in values.items():
+                totals[key] += value
+
+    def summary(self):
+        """
+        Aggregate the records written so far.
+
+        Returns:
+            Dictionary with the file count, summed per-file wall time and, per stage,
+            the summed counters plus the stage's share of the wall time and its
+            input throughput in MB/s
+        """
+        stages = {}
+        for stage in sorted(self.totals, key=lambda s: PROFILE_STAGES.index(s) if s in PROFILE_STAGES else 99):
+            totals = dict(self.totals[stage])
+            totals['share'] = totals['wall_s'] / self.wall_s if self.wall_s else 0.0
+            totals['mb_in_per_s'] = totals['bytes_in'] / (1024 * 1024) / totals['wall_s'] if totals['wall_s'] else 0.0
+            stages[stage] = totals
+        return {'files': self.count, 'failed': self.failed, 'wall_s': self.wall_s, 'stages': stages}
+
+    def format_summary(self):
+        """Return the summary as a printable table."""
+        summary = self.summary()
+        lines = [f"Profile: {summary['files']} files, {summary['wall_s']:.2f} s total wall time",
+                 f"  {'stage':<11} {'calls':>7} {'wall s':>9} {'cpu s':>9} {'share':>7} "
+                 f"{'MB in':>9} {'MB out':>9} {'MB/s in':>9}"]
+        for stage, totals in summary['stages'].items():
+            lines.append(f"  {stage:<11} {totals['calls']:>7} {totals['wall_s']:9.3f} {totals['cpu_s']:9.3f} "
+                         f"{totals['share']:7.1%} {totals['bytes_in'] / (1024 * 1024):9.1f} "
+                         f"{totals['bytes_out'] / (1024 * 1024):9.1f} {totals['mb_in_per_s']:9.1f}")
+        return '\n'.join(lines)
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+            with open(self.summary_path, 'w', encoding='utf-8') as f:
+                json.dump(self.summary(), f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _decoded_batches(first_batch, batches, ds, stack_shape, output_base, dicom_path, export_npy, profile):
+    """
+    Yield the frame batches of a chunked conversion, profiling their decoding and,
+    with export_npy, rescaling each batch into the .npy volume (see export_npy_volume).
+    """
+    output_npy = f"{output_base}.npy"
+    volume = None
+    start = 0
+    batch = first_batch
+    try:
+        while batch is not None:
+            if export_npy:
+                with profile.stage('npy', batch.nbytes):
+                    if volume is None:
+                        volume = np.lib.format.open_memmap(output_npy, mode='w+', shape=stack_shape,
+                                                           dtype=rescaled_dtype(ds, batch.dtype))
+                    rescale_into(volume[start:start + len(batch)], batch, ds)
+            start += len(batch)
+            yield batch
+            with profile.stage('decode') as counters:
+                batch = next(batches, None)
+                counters['bytes_out'] = batch.nbytes if batch is not None else 0
+    finally:
+        if volume is not None:
+            volume.flush()
+            del volume
+
+    if export_npy:
+        write_npy_sidecar(output_npy, ds, stack_shape, dicom_path)
+        profile.add_bytes('npy', bytes_out=os.path.getsize(output_npy))
+        print(f"  Raw volume saved to: {output_npy} ({'x'.join(str(n) for n in stack_shape)}, "
+              f"{rescaled_dtype(ds, first_batch.dtype)})")
+
+
+def convert_dicom_to_image(dicom_path, output_dir, preserve_precision=True, export_mp4=True, fps=10,
+                           stream_frames=False, metadata_only=False, write_txt=True,
+                           metadata_records=None, record_all_tags=False,
+                           export_npy=False, export_images=True, profile=None,
+                           gif_profile='small', gif_delta=False, video_encoder='opencv', video_codec=None,
+                           ds=None, output_writer=None, png_compression=None, image_format='png',
+                           thumbnail_size=None, pyramid_levels=0, contact_sheet=False, frames=None, crop=None,
+                           use_memmap=False, max_memory=None, decode_workers=1, decode_backend='thread'):
+    """
+    Convert a DICOM file to PNG image(s), GIF animation, and/or MP4 video.
+
+    Args:
+        dicom_path: Path to DICOM file
+        output_dir: Directory to save output files
+        preserve_precision: If True, use 16-bit PNG for high precision data
+        export_mp4: If True, export multi-frame sequences as MP4 video
+        fps: Frames per second for video output
+        stream_frames: If True, convert multi-frame files one frame at a time
+            instead of decoding the whole pixel array up front
+        metadata_only: If True, only write metadata (see export_metadata)
+        write_txt: If False, skip the per-file metadata text file
+        metadata_records: Optional list that the file's metadata record
+            (see metadata_record) is appended to
+        record_all_tags: If True, metadata records include every element
+        export_npy: If True, also write the rescaled pixel data in its native dtype
+            to a memory-mapped .npy file with a JSON sidecar
+        export_images: If False, skip the PNG/GIF/MP4 outputs
+        profile: Optional FileProfile that the time and bytes of each stage
+            (see PROFILE_STAGES) are recorded in
+        gif_profile: 'small' optimizes the GIF with PIL for size; 'fast' writes
+            all frames with one shared grayscale palette (see GifStreamWriter)
+        gif_delta: With the 'fast' profile or stream_frames, only encode the
+            rectangle of each frame that changed since the previous one
+        video_encoder: Video backend for multi-frame files, a key of VIDEO_ENCODERS
+        video_codec: Codec for the video backend, None for its default
+        ds: Optional dataset already read by the caller (see prefetch_dataset);
+            a header read without pixel data is only used as the header
+        output_writer: Optional OutputWriter that writes the PNG, GIF and text
+            outputs on writer threads; videos and .npy files are always written
+            directly
+        png_compression: zlib level 0-9 for PNG images, None for the default (6)
+        image_format: 'png', or 'tiff' for uncompressed TIFF single-frame images
+        thumbnail_size: If set, also write a thumbnail whose longest edge is at most
+            this many pixels (see write_previews)
+        pyramid_levels: Number of 1/2, 1/4, ... downsampled images to write
+        contact_sheet: For multi-frame files, build the previews from a mosaic of up
+            to CONTACT_SHEET_FRAMES frames instead of the middle frame
+        frames: Optional 0-based frame indices to convert; only these frames are
+            read and decoded (see select_pixels)
+        crop: Optional (x, y, width, height) region to keep of each frame
+        use_memmap: If True, uncompressed pixel data is memory-mapped instead of
+            read and decoded (see memmap_pixels); other files are read as usual
+        max_memory: Optional memory budget in bytes for this file. The header is read
+            first and the file converted in the fastest of the full, memmap, chunked
+            and stream modes that fits (see estimate_memory and plan_memory).
+            Chunked mode decodes ENCODE_BATCH_FRAMES frames at a time and produces
+            the same outputs as a full read.
+        decode_workers, decode_backend: Threads or processes that decode the frames
+            of compressed multi-frame files in a full read (see decode_pixels)
+
+    Returns:
+        True if successful, False otherwise
+    """
+    profile = profile or FileProfile(dicom_path)
+    if metadata_only:
+        return export_metadata(dicom_path, output_dir, write_txt, metadata_records, record_all_tags, profile,
+                               ds, output_writer)
+
+    try:
+        # Get base filename without extension
+        base_name = Path(dicom_path).stem
+        output_base = Path(output_dir) / base_name
+
+        chunked = False
+        if max_memory is not None and not stream_frames:
+            # Pick the conversion mode from the header, before any pixel data is read
+            if ds is None:
+                with profile.stage('read'):
+                    ds = read_dicom_header(dicom_path)
+            estimates = estimate_memory(ds, os.path.getsize(dicom_path), frames, crop, export_images, export_mp4,
+                                        gif_profile, bool(thumbnail_size or pyramid_levels))
+            mode, fits = plan_memory(estimates, max_memory, use_memmap)
+            if not fits:
+                print(f"  Warning: about {estimates[mode] / 1024 ** 2:.0f} MB needed even in {mode} mode, "
+                      f"over the {max_memory / 1024 ** 2:.0f} MB budget")
+            elif mode != 'full' and not (mode == 'memmap' and use_memmap):
+                print(f"  Memory: {mode} mode, about {estimates[mode] / 1024 ** 2:.0f} MB "
+                      f"(a full read needs about {estimates['full'] / 1024 ** 2:.0f} MB, "
+                      f"over the {max_memory / 1024 ** 2:.0f} MB budget)")
+            stream_frames = mode == 'stream'
+            use_memmap = use_memmap or mode == 'memmap'
+            chunked = mode == 'chunked'
+
+        if stream_frames:
+            # Read the header only; frames are decoded later one at a time
+            if ds is None:
+                with profile.stage('read'):
+                    ds = read_dicom_header(dicom_path)
+            if int(getattr(ds, 'NumberOfFrames', 1) or 1) > 1:
+                profile.add_bytes('read', bytes_in=os.path.getsize(dicom_path))
+                _write_metadata(ds, dicom_path, output_base, write_txt, metadata_records, record_all_tags, profile,
+                                output_writer)
+                convert_multiframe_streaming(dicom_path, ds, output_base, export_mp4, fps,
+                                             export_npy, export_images, profile, gif_delta,
+                                             video_encoder, video_codec, thumbnail_size, pyramid_levels,
+                                             contact_sheet, image_format, png_compression, frames, crop,
+                                             use_memmap)
+                return True
+
+        partial = frames is not None or crop is not None
+        mapped = None
+
+        # Read DICOM file
+        if use_memmap and not partial:
+            # Map uncompressed pixel data instead of reading it (None if it is compressed)
+            with profile.stage('read'):
+                mapped = memmap_pixels(dicom_path)
+            if mapped is not None:
+                ds = mapped[0]
+            elif max_memory is not None:
+                # Planned as memmap, but the pixel data cannot be mapped as stored
+                chunked = True
+        if mapped is None and (partial or chunked):
+            # Only the header is needed, the frames are read by select_pixels or in batches
+            if ds is None:
+                with profile.stage('read'):
+                    ds = read_dicom_header(dicom_path)
+        elif mapped is None and (ds is None or 'PixelData' not in ds):
+            with profile.stage('read', os.path.getsize(dicom_path)):
+                ds = pydicom.dcmread(dicom_path)
+
+        # Extract metadata
+        _write_metadata(ds, dicom_path, output_base, write_txt, metadata_records, record_all_tags, profile,
+                        output_writer)
+
+        batches = None
+        if chunked and int(getattr(ds, 'NumberOfFrames', 1) or 1) > 1:
+            indices = selected_frames(ds, frames)
+            if len(indices) > 1:
+                # Frames are decoded in batches while they are normalized (and rescaled
+                # into the .npy volume), the decoded stack is never held as a whole
+                if crop is not None:
+                    check_crop(ds, crop)
+                batches = iter_frame_batches(iter_frames(dicom_path, ds, indices, use_memmap),
+                                             ENCODE_BATCH_FRAMES, crop)
+                pixel_array = None
+            else:
+                frames = indices
+
+        with profile.stage('decode') as counters:
+            if batches is not None:
+                first_batch = next(batches)
+                stack_shape = (len(indices),) + first_batch.shape[1:]
+                counters['bytes_out'] = first_batch.nbytes
+            elif partial or chunked:
+                pixel_array = select_pixels(dicom_path, ds, frames, crop, use_memmap)
+            elif mapped is not None:
+                pixel_array = mapped[1]
+            else:
+                # Check if DICOM has pixel data
+                if not hasattr(ds, 'pixel_array'):
+                    print(f"  Warning: No pixel data found in {dicom_path}")
+                    return False
+
+                # Get pixel array
+                pixel_array = decode_pixels(ds, decode_workers, decode_backend)
+                counters['bytes_in'] = len(ds.PixelData) if 'PixelData' in ds else 0
+            if pixel_array is not None:
+                counters['bytes_out'] = pixel_array.nbytes
+
+        if batches is not None:
+            batches = _decoded_batches(first_batch, batches, ds, stack_shape, output_base, dicom_path,
+                                       export_npy, profile)
+            if not export_images:
+                for _ in batches:
+                    pass
+                return True
+        else:
+            if export_npy:
+                with profile.stage('npy', pixel_array.nbytes) as counters:
+                    export_npy_volume(pixel_array, ds, output_base, dicom_path)
+                    counters['bytes_out'] = os.path.getsize(f"{output_base}.npy")
+            if not export_images:
+                return True
+            stack_shape = pixel_array.shape
+
+        # Normalize and encode in memory with the shared Converter core; the outputs
+        # are written below. Multi-frame stacks become a GIF and an MP4, to which each
+        # batch of frames is queued while the next one is normalized.
+        converter = Converter(preserve_precision=preserve_precision, fps=fps, gif_profile=gif_profile,
+                              gif_delta=gif_delta, image_format=image_format, png_compression=png_compression,
+                              video_encoder=video_encoder, thumbnail_size=thumbnail_size,
+                              pyramid_levels=pyramid_levels, contact_sheet=contact_sheet)
+        multiframe = is_multiframe_stack(ds, stack_shape)
+        outputs = ('gif',) if multiframe else ('image',)
+        if thumbnail_size or pyramid_levels:
+            outputs += ('previews',)
+        video = None
+        try:
+            if multiframe and export_mp4:
+                height, width = stack_shape[1:3]
+                video = open_video_encoder(video_encoder, output_base, fps, width, height, video_codec)
+            result = converter.render(ds, pixel_array if batches is None else batches, outputs, stack_shape, profile,
+                                      video)
+            if video is not None:
+                with profile.stage('encode_mp4'):
+                    video.close()
+        except BaseException:
+            close_after_error(video)
+            raise
+
+        if multiframe:
+            output_gif = f"{output_base}.gif"
+            save_output(output_gif, result.gif, output_writer, profile)
+            gif_mode = 'optimized' if gif_profile == 'small' else ('fast, changed rectangles' if gif_delta else 'fast')
+            print(f"  GIF animation saved to: {output_gif} ({len(result.display)} frames, {gif_mode})")
+            if video is not None:
+                profile.add_bytes('encode_mp4', bytes_out=output_size(video.path))
+                print(f"  {video.label} saved to: {video.path} ({len(result.display)} frames, {fps} fps)")
+        else:
+            output_image = f"{output_base}.{'tif' if image_format == 'tiff' else 'png'}"
+            save_output(output_image, result.image, output_writer, profile)
+            print(f"  Image saved to: {output_image}"
+                  f"{' (16-bit precision)' if result.display.dtype == np.uint16 else ''}")
+        if result.previews:
+            write_previews(result.previews, output_base, image_format, output_writer, profile)
+
+        return True
+
+    except pydicom.errors.InvalidDicomError:
+        print(f"  Error: {dicom_path} is not a valid DICOM file")
+        return False
+    except Exception as e:
+        print(f"  Error processing {dicom_path}: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+class ConversionResult:
+    """
+    In-memory outputs of Converter.convert; outputs that were not requested are None.
+
+    Attributes:
+        source: Path of the DICOM file, or None for bytes and file objects
+        metadata: Metadata record dict (see metadata_record)
+        pixels: Rescaled pixel data in its native dtype (see rescaled_dtype)
+        display: Display image from single_frame_display, or the uint8
+            (frames, rows, cols) stack of a multi-frame file
+        image: Encoded PNG/TIFF bytes of the display image (first frame of a
+            multi-frame file)
+        gif: Encoded animated GIF bytes, multi-frame files only
+        previews: Dict of encoded preview images by name ('thumb', 'L1', ...),
+            see preview_images
+    """
+
+    def __init__(self, source=None, metadata=None, pixels=None, display=None, image=None, gif=None,
+                 previews=None):
+        self.source = source
+        self.metadata = metadata
+        self.pixels = pixels
+        self.display = display
+        self.image = image
+        self.gif = gif
+        self.previews = previews
+
+
+class Converter:
+    """
+    Reusable conversion API for long-lived processes.
+
+    The configuration is fixed when the converter is created and takes the same
+    options as convert_dicom_to_image. The in-memory methods (read, metadata, pixels,
+    display, to_image, to_gif, convert) neither print nor write files, and accept a
+    path, the file contents as bytes, a binary file object or an already read
+    pydicom Dataset. A converter holds no mutable state, so one instance can be
+    shared by any number of threads; display LUTs are cached process-wide by
+    build_window_lut, so all calls for a series reuse the same table.
+
+    convert_file writes outputs to disk exactly like the command line, which is a
+    thin wrapper around it. Both share one in-memory core, render, which normalizes
+    decoded pixel data and encodes it: convert_dicom_to_image writes the image, GIF
+    and previews it returns, so files and in-memory results are identical.
+    """
+
+    OUTPUTS = ('metadata', 'pixels', 'display', 'image', 'gif', 'previews')
+
+    def __init__(self, preserve_precision=True, fps=10, gif_profile='small', gif_delta=False,
+                 image_format='png', png_compression=None, record_all_tags=False, video_encoder='opencv',
+                 **file_options):
+        if gif_profile not in ('small', 'fast'):
+            raise ValueError(f"Unknown GIF profile: {gif_profile}")
+        if image_format not in ('png', 'tiff'):
+            raise ValueError(f"Unknown image format: {image_format}")
+        if png_compression is not None and not 0 <= png_compression <= 9:
+            raise ValueError(f"PNG compression level must be 0-9, got {png_compression}")
+        if video_encoder not in VIDEO_ENCODERS:
+            raise ValueError(f"Unknown video encoder: {video_encoder}")
+        self.options = dict(file_options, preserve_precision=preserve_precision, fps=fps,
+                            gif_profile=gif_profile, gif_delta=gif_delta, image_format=image_format,
+                            png_compression=png_compression, record_all_tags=record_all_tags,
+                            video_encoder=video_encoder)
+
+    def read(self, source, pixels=True):
+        """Read a dataset from a path, bytes or binary file object (Datasets are returned as is)."""
+        if isinstance(source, pydicom.Dataset):
+            return source
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        return pydicom.dcmread(source, stop_before_pixels=not pixels)
+
+    def metadata(self, source):
+        """Return the metadata record of a file (see metadata_record) without decoding pixels."""
+        ds = self.read(source, pixels=False)
+        return metadata_record(ds, self._source_path(source), self.options['record_all_tags'])
+
+    def pixels(self, source):
+        """Return the rescaled pixel data in its native dtype, as written by --npy."""
+        return self._pixels(*self._read_pixels(source))
+
+    def display(self, source):
+        """Return the display image (single frame) or uint8 display stack (multi-frame)."""
+        return self.render(*self._read_pixels(source), outputs=()).display
+
+    def to_image(self, source):
+        """Return the PNG (or TIFF) bytes of a single-frame file, or of the first frame of a multi-frame file."""
+        return self.convert(source, outputs=('image',)).image
+
+    def to_gif(self, source):
+        """Return the animated GIF bytes of a multi-frame file."""
+        result = self.convert(source, outputs=('gif',))
+        if result.gif is None:
+            raise ValueError("GIF output needs a multi-frame file")
+        return result.gif
+
+    def convert(self, source, outputs=('metadata', 'display', 'image', 'gif')):
+        """
+        Read and decode a file once and return the requested in-memory outputs.
+
+        Args:
+            source: Path, bytes, binary file object or pydicom Dataset
+            outputs: Names from Converter.OUTPUTS; 'gif' is ignored for single-frame files
+                and 'previews' defaults to a 128 px thumbnail unless thumbnail_size or
+                pyramid_levels is configured
+
+        Returns:
+            ConversionResult
+        """
+        unknown = set(outputs) - set(self.OUTPUTS)
+        if unknown:
+            raise ValueError(f"Unknown outputs: {', '.join(sorted(unknown))}")
+
+        result = ConversionResult(self._source_path(source))
+        if not set(outputs) - {'metadata'}:
+            result.metadata = self.metadata(source)
+            return result
+
+        ds, pixel_array = self._read_pixels(source)
+        if 'metadata' in outputs:
+            result.metadata = metadata_record(ds, result.source, self.options['record_all_tags'])
+        if 'pixels' in outputs:
+            result.pixels = self._pixels(ds, pixel_array)
+        if not set(outputs) & {'display', 'image', 'gif', 'previews'}:
+            return result
+
+        rendered = self.render(ds, pixel_array, [output for output in outputs if output != 'display'])
+        if 'display' in outputs:
+            result.display = rendered.display
+        result.image, result.gif, result.previews = rendered.image, rendered.gif, rendered.previews
+        return result
+
+    def render(self, ds, pixels, outputs=('image', 'gif', 'previews'), stack_shape=None, profile=None, video=None):
+        """
+        Normalize decoded pixel data for display and encode the requested outputs in
+        memory; the core of convert and of convert_dicom_to_image, which writes the
+        results to files.
+
+        Multi-frame stacks are normalized in batches of ENCODE_BATCH_FRAMES frames;
+        each batch is written to the video encoder and a 'fast' GIF as soon as it is
+        normalized.
+
+        Args:
+            ds: Dataset or header of the pixel data
+            pixels: Decoded pixel array (as from ds.pixel_array), or an iterable of
+                (frames, rows, cols) batches of a stack with stack_shape
+            outputs: Any of 'image' (the first frame of a multi-frame stack), 'gif'
+                (ignored for single frames) and 'previews' (a 128 px thumbnail unless
+                thumbnail_size or pyramid_levels is configured); the display image is
+                always returned
+            stack_shape: Shape of the whole stack when pixels is an iterable of batches
+            profile: Optional FileProfile that the normalize, encode and preview
+                stages are recorded in
+            video: Optional video encoder (see open_video_encoder) that the display
+                frames of a multi-frame stack are written to; the caller closes it
+
+        Returns:
+            ConversionResult with display, and image, gif and previews if requested
+        """
+        profile = profile or FileProfile(None)
+        options = self.options
+        if stack_shape is None:
+            stack_shape = pixels.shape
+        result = ConversionResult()
+        multiframe = is_multiframe_stack(ds, stack_shape)
+        if multiframe:
+            batches = pixels
+            if isinstance(pixels, np.ndarray):
+                batches = (pixels[start:start + ENCODE_BATCH_FRAMES]
+                           for start in range(0, len(pixels), ENCODE_BATCH_FRAMES))
+            normalize_options = stack_normalize_options(ds)
+            display = np.empty(stack_shape, dtype=np.uint8)
+            gif_buffer = io.BytesIO()
+            gif = None
+            if 'gif' in outputs and options['gif_profile'] == 'fast':
+                # One shared palette, no per-frame optimization
+                gif = GifStreamWriter(gif_buffer, duration=int(1000 / options['fps']), delta=options['gif_delta'])
+
+            start = 0
+            for stored in batches:
+                batch = display[start:start + len(stored)]
+                start += len(stored)
+                with profile.stage('normalize', stored.nbytes) as counters:
+                    batch[...] = normalize_pixel_stack(stored, **normalize_options)
+                    counters['bytes_out'] = batch.nbytes
+                if video is not None:
+                    with profile.stage('encode_mp4', batch.nbytes):
+                        for frame in batch:
+                            video.write(frame)
+                if gif is not None:
+                    with profile.stage('encode_gif', batch.nbytes):
+                        for frame in batch:
+                            gif.write(frame)
+
+            if gif is not None:
+                gif.close()
+                result.gif = gif_buffer.getvalue()
+            elif 'gif' in outputs:
+                # Animated GIF optimized by PIL
+                with profile.stage('encode_gif', display.nbytes):
+                    result.gif = encode_gif(display, options['fps'])
+            if result.gif is not None:
+                profile.add_bytes('encode_gif', bytes_out=len(result.gif))
+            image = display[0]
+        else:
+            # Single frame: unrescaled 16/32-bit integer data is shown as 16-bit,
+            # everything else as 8-bit
+            pixel_array = pixels[0] if int(getattr(ds, 'NumberOfFrames', 1) or 1) > 1 else pixels
+            with profile.stage('normalize', pixel_array.nbytes) as counters:
+                display = single_frame_display(ds, pixel_array, options['preserve_precision'])
+                counters['bytes_out'] = display.nbytes
+            image = display
+        result.display = display
+
+        if 'image' in outputs:
+            with profile.stage(f"encode_{options['image_format']}", image.nbytes) as counters:
+                result.image = encode_image(image, options['image_format'], options['png_compression'])
+                counters['bytes_out'] = len(result.image)
+        if 'previews' in outputs:
+            thumbnail_size = options.get('thumbnail_size')
+            pyramid_levels = options.get('pyramid_levels', 0)
+            if not (thumbnail_size or pyramid_levels):
+                thumbnail_size = 128
+            if multiframe:
+                contact_sheet = options.get('contact_sheet', False)
+                frames = display[preview_frame_indices(len(display), contact_sheet)]
+                image = contact_sheet_image(frames) if contact_sheet else frames[0]
+            result.previews = encode_previews(image, thumbnail_size, pyramid_levels, options['image_format'],
+                                              options['png_compression'], profile)
+        return result
+
+    def convert_file(self, dicom_path, output_dir, **kwargs):
+        """
+        Convert a file to output files with convert_dicom_to_image (prints progress).
+
+        Keyword arguments (e.g. profile, ds, output_writer, metadata_records) are
+        passed through and override the converter's options for this call.
+        """
+        return convert_dicom_to_image(dicom_path, output_dir, **dict(self.options, **kwargs))
+
+    def _read_pixels(self, source):
+        """Read a file and decode its pixel data, or only the configured frames and crop region."""
+        frames, crop = self.options.get('frames'), self.options.get('crop')
+        use_memmap = self.options.get('use_memmap', False) and isinstance(source, (str, os.PathLike))
+        if frames is None and crop is None:
+            mapped = memmap_pixels(source) if use_memmap else None
+            if mapped is not None:
+                return mapped
+            ds = self.read(source)
+            if 'PixelData' not in ds:
+                raise ValueError("No pixel data found")
+            return ds, decode_pixels(ds, self.options.get('decode_workers', 1),
+                                     self.options.get('decode_backend', 'thread'))
+
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        ds = self.read(source, pixels=False)
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return ds, select_pixels(source, ds, frames, crop, use_memmap)
+
+    @staticmethod
+    def _source_path(source):
+        return str(source) if isinstance(source, (str, os.PathLike)) else None
+
+    @staticmethod
+    def _pixels(ds, pixel_array):
+        pixels = np.empty(pixel_array.shape, dtype=rescaled_dtype(ds, pixel_array.dtype))
+        rescale_into(pixels, pixel_array, ds)
+        return pixels
+
+
+MANIFEST_NAME = '.dicom_converter_manifest.json'
+DEDUP_INDEX_NAME = '.dicom_converter_dedup.json'
+
+
+def write_json_atomic(path, data, **kwargs):
+    """Write data as JSON to a temporary file next to path, then replace path with it."""
+    tmp_path = Path(path).with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, **kwargs)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(output_dir):
+    """
+    Load the incremental conversion manifest of an output directory.
+
+    Returns:
+        Dict mapping absolute source paths to their manifest entries
+        (empty if there is no manifest yet)
+    """
+    manifest_path = Path(output_dir) / MANIFEST_NAME
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f).get('files', {})
+
+
+def save_manifest(output_dir, entries):
+    """Atomically write the incremental conversion manifest of an output directory."""
+    write_json_atomic(Path(output_dir) / MANIFEST_NAME, {'version': 1, 'files': entries}, indent=1, sort_keys=True)
+
+
+def file_content_hash(path):
+    """Return the SHA-256 hex digest of a file, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Options that do not change the outputs, so changing them does not reconvert files.
+# The memory options only choose how pixel data is read and decoded (the stream mode
+# encodes the same GIF frames differently).
+UNRECORDED_OPTIONS = ('metadata_records', 'decode_workers', 'decode_backend', 'use_memmap', 'max_memory')
+
+
+def manifest_options(options):
+    """The conversion options that are recorded in the manifest, as they read back from JSON."""
+    return json.loads(json.dumps({key: value for key, value in options.items() if key not in UNRECORDED_OPTIONS}))
+
+
+def get_output_dir(output_dir, dicom_file, input_root=None):
+    """
+    Return the output directory for a file.
+
+    With an input_root, the file's sub-directory below input_root is mirrored under
+    output_dir, so files with the same name in different folders do not collide.
+    """
+    if input_root is None:
+        return Path(output_dir)
+    return Path(output_dir) / Path(dicom_file).parent.relative_to(input_root)
+
+
+# Suffixes of the outputs written for a file, appended to its output path without
+# extension; pyramid levels add _L1, _L2, ... (see output_paths)
+OUTPUT_SUFFIXES = ('.png', '.tif', '.gif', '.mp4', '.txt', '.npy', '.json', '_thumb.png', '_thumb.tif', '_frames')
+PREVIEW_LEVEL_SUFFIXES = ('.png', '.tif')
+
+
+def output_paths(output_base):
+    """
+    Return the existing outputs of a file, from its output path without extension.
+
+    Only the names the converter writes are matched, so the outputs of another source
+    whose name starts with the same stem and a dot (a.x.dcm next to a.dcm) are not.
+    """
+    base = str(output_base)
+    paths = [Path(base + suffix) for suffix in OUTPUT_SUFFIXES if os.path.exists(base + suffix)]
+    level = 1
+    while True:
+        levels = [Path(f"{base}_L{level}{suffix}") for suffix in PREVIEW_LEVEL_SUFFIXES]
+        levels = [path for path in levels if path.exists()]
+        if not levels:
+            break
+        paths += levels
+        level += 1
+    return sorted(paths)
+
+
+def check_manifest(dicom_file, entry, options, output_dir, use_hash=False):
+    """
+    Compare a source file against its manifest entry.
+
+    A file is unchanged if its size and mtime match, or, with use_hash, if its content
+    hash still matches after the size or mtime changed. Its outputs are missing if none
+    exist, or if any of the outputs recorded after its last conversion is gone.
+
+    Returns:
+        (status, new_entry) where status is 'new', 'changed', 'options', 'missing-output'
+        or 'unchanged', and new_entry is the entry to record after a successful conversion
+    """
+    stat = os.stat(dicom_file)
+    new_entry = {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'options': manifest_options(options),
+    }
+    if entry is None:
+        if use_hash:
+            new_entry['sha256'] = file_content_hash(dicom_file)
+        return 'new', new_entry
+
+    same_stat = entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns
+    if use_hash:
+        if same_stat and 'sha256' in entry:
+            new_entry['sha256'] = entry['sha256']
+        else:
+            new_entry['sha256'] = file_content_hash(dicom_file)
+        unchanged = new_entry['sha256'] == entry['sha256'] if 'sha256' in entry else same_stat
+    else:
+        unchanged = same_stat
+        if same_stat and 'sha256' in entry:
+            new_entry['sha256'] = entry['sha256']
+
+    if not unchanged:
+        return 'changed', new_entry
+    if entry.get('options') != new_entry['options']:
+        return 'options', new_entry
+    outputs = output_paths(Path(output_dir) / Path(dicom_file).stem)
+    if not outputs or not set(entry.get('outputs', [])) <= {path.name for path in outputs}:
+        return 'missing-output', new_entry
+    return 'unchanged', new_entry
+
+
+class ConversionManifest:
+    """
+    Incremental conversion state for one run: filters out up-to-date files as they are
+    discovered, records conversion results and saves the manifest.
+    """
+
+    def __init__(self, output_dir, options, use_hash=False, input_root=None):
+        self.output_dir = Path(output_dir)
+        self.options = options
+        self.use_hash = use_hash
+        self.input_root = input_root
+        self.entries = load_manifest(output_dir)
+        self.status_counts = {}
+        self.removed = []
+        self._seen = set()
+        self._updates = {}
+
+    def filter(self, dicom_files):
+        """Yield the files that need converting, skipping up-to-date ones."""
+        for dicom_file in dicom_files:
+            key = str(Path(dicom_file).resolve())
+            self._seen.add(key)
+            file_output_dir = get_output_dir(self.output_dir, dicom_file, self.input_root)
+            status, self._updates[key] = check_manifest(
+                dicom_file, self.entries.get(key), self.options, file_output_dir, self.use_hash
+            )
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+            if status == 'unchanged':
+                # Refresh size/mtime so a touched but identical file is not hashed again
+                self._updates[key]['outputs'] = self.entries[key].get('outputs', [])
+                self.entries[key] = self._updates.pop(key)
+            else:
+                yield dicom_file
+
+    def record(self, dicom_file, success):
+        """Record the result of converting a file returned by filter()."""
+        key = str(Path(dicom_file).resolve())
+        update = self._updates.pop(key, None)
+        if success and update is not None:
+            output_base = get_output_dir(self.output_dir, dicom_file, self.input_root) / Path(dicom_file).stem
+            update['outputs'] = [path.name for path in output_paths(output_base)]
+            self.entries[key] = update
+        else:
+            self.entries.pop(key, None)
+
+    def drop_removed(self, input_path):
+        """Drop entries of sources under input_path that no longer exist (call after filter())."""
+        input_root = str(Path(input_path).resolve())
+        self.removed = [key for key in self.entries
+                        if key not in self._seen
+                        and (key == input_root or key.startswith(input_root + os.sep))
+                        and not os.path.exists(key)]
+        for key in self.removed:
+            del self.entries[key]
+        return self.removed
+
+    @property
+    def skipped_count(self):
+        return self.status_counts.get('unchanged', 0)
+
+    def summary(self):
+        counts = self.status_counts
+        return (f"Incremental: {counts.get('unchanged', 0)} up to date, "
+                f"{counts.get('new', 0)} new, {counts.get('changed', 0)} changed, "
+                f"{counts.get('options', 0) + counts.get('missing-output', 0)} to redo "
+                f"(options changed or outputs missing), {len(self.removed)} removed")
+
+    def save(self):
+        save_manifest(self.output_dir, self.entries)
+
+
+def pixel_data_hash(dicom_path):
+    """
+    Return the SHA-256 hex digest of the stored (still encoded) Pixel Data value of a
+    file, read in blocks without decoding, or None if it has no pixel data.
+    Encapsulated pixel data of undefined length is hashed to the end of the file.
+    """
+    ds = pydicom.dcmread(dicom_path, defer_size=1024)
+    elem = ds.get_item('PixelData', keep_deferred=True)
+    if elem is None:
+        return None
+    if elem.value is not None:
+        return hashlib.sha256(ds.PixelData).hexdigest()
+    digest = hashlib.sha256()
+    remaining = None if elem.length == 0xFFFFFFFF else elem.length
+    with open(dicom_path, 'rb') as f:
+        f.seek(elem.value_tell)
+        while remaining is None or remaining > 0:
+            block = f.read(1024 * 1024 if remaining is None else min(1024 * 1024, remaining))
+            if not block:
+                break
+            digest.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return digest.hexdigest()
+
+
+def link_outputs(source_base, target_base):
+    """
+    Hard-link the outputs of source_base to the same names under target_base.
+    Outputs are copied where hard links are not possible (e.g. across file systems).
+
+    Returns:
+        Number of files linked or copied
+    """
+    count = 0
+    Path(target_base).parent.mkdir(parents=True, exist_ok=True)
+    for path in output_paths(source_base):
+        target = Path(str(target_base) + str(path)[len(str(source_base)):])
+        pairs = [(path, target)]
+        if path.is_dir():
+            target.mkdir(parents=True, exist_ok=True)
+            pairs = [(child, target / child.name) for child in sorted(path.iterdir()) if child.is_file()]
+        for source_file, target_file in pairs:
+            if target_file.exists():
+                if os.path.samefile(source_file, target_file):
+                    continue
+                target_file.unlink()
+            try:
+                os.link(source_file, target_file)
+            except OSError:
+                shutil.copy2(source_file, target_file)
+            count += 1
+    return count
+
+
+def unlink_shared_outputs(output_base):
+    """
+    Remove the outputs of a file that are hard links (see link_outputs), so that
+    converting it again writes new files instead of through the links into the
+    outputs of other copies.
+    """
+    for path in output_paths(output_base):
+        files = [child for child in path.iterdir() if child.is_file()] if path.is_dir() else [path]
+        for output_file in files:
+            if os.stat(output_file).st_nlink > 1:
+                output_file.unlink()
+
+
+class DedupIndex:
+    """
+    Index of converted instances by SOPInstanceUID, persisted in the output directory,
+    that filters out copies of an instance as files are discovered.
+
+    The first file of an instance is converted. Later copies, in the same run or any
+    later one, are duplicates: they are skipped, or with action='link' their outputs
+    are hard-linked to the first copy's. With use_pixel_hash, a copy is only a
+    duplicate if its stored pixel data is identical as well (see pixel_data_hash);
+    a copy with different pixel data replaces the indexed instance and is converted.
+    If a first copy fails to convert, the next copy found in the same run is converted
+    in its place (see take_promoted), and the outputs are only linked after a success.
+    """
+
+    def __init__(self, output_dir, action='skip', use_pixel_hash=False, input_root=None):
+        self.output_dir = Path(output_dir)
+        self.action = action
+        self.use_pixel_hash = use_pixel_hash
+        self.input_root = input_root
+        self.index_path = self.output_dir / DEDUP_INDEX_NAME
+        self.entries = {}
+        if self.index_path.exists():
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f).get('instances', {})
+        self.duplicates = []  # (duplicate, first copy) paths
+        self._converting = {}  # source path -> SOPInstanceUID, for files filter() yielded
+        # Source path of a file being converted -> its duplicates, linked (with 'link')
+        # once it is converted, or converted in its place if it fails
+        self._waiting = {}
+        self._promoted = []  # duplicates to convert after their first copy failed
+
+    def _output_base(self, dicom_file):
+        return get_output_dir(self.output_dir, dicom_file, self.input_root) / Path(dicom_file).stem
+
+    def _pixel_hash(self, entry):
+        """Pixel hash of an entry, computed from its source if it is not known yet."""
+        if 'pixel_sha256' not in entry and os.path.exists(entry['source']):
+            entry['pixel_sha256'] = pixel_data_hash(entry['source'])
+        return entry.get('pixel_sha256')
+
+    def filter(self, dicom_files):
+        """Yield the files that need converting, skipping (or linking) duplicates."""
+        for dicom_file in dicom_files:
+            source = str(Path(dicom_file).resolve())
+            try:
+                uid = getattr(read_dicom_header(dicom_file), 'SOPInstanceUID', None)
+            except Exception:
+                uid = None  # Unreadable headers are reported by the conversion
+            if not uid:
+                yield dicom_file
+                continue
+            uid = str(uid)
+            entry = self.entries.get(uid)
+            new_entry = {'source': source,
+                         'output': str(self._output_base(dicom_file).relative_to(self.output_dir))}
+
+            if entry is not None and entry['source'] != source:
+                try:
+                    if self.use_pixel_hash:
+                        new_entry['pixel_sha256'] = pixel_data_hash(dicom_file)
+                    same_pixels = not self.use_pixel_hash or self._pixel_hash(entry) == new_entry['pixel_sha256']
+                except Exception as e:
+                    # Without both hashes the copies cannot be compared: convert this one
+                    print(f"  Warning: cannot compare pixel data of {dicom_file} with {entry['source']}: {e}")
+                    new_entry.pop('pixel_sha256', None)
+                    same_pixels = False
+                converting = entry['source'] in self._converting
+                if same_pixels and (converting or output_paths(self.output_dir / entry['output'])):
+                    self.duplicates.append((str(dicom_file), entry['source']))
+                    if converting:
+                        self._waiting.setdefault(entry['source'], []).append(dicom_file)
+                    elif self.action == 'link':
+                        link_outputs(self.output_dir / entry['output'], self._output_base(dicom_file))
+                    continue
+
+            self.entries[uid] = new_entry
+            self._converting[source] = uid
+            unlink_shared_outputs(self._output_base(dicom_file))
+            yield dicom_file
+
+    def record(self, dicom_file, success):
+        """
+        Record the result of converting a file returned by filter() or take_promoted().
+
+        Its waiting duplicates are linked to its outputs if it was converted. If it
+        failed, the first of them is promoted: it replaces the file in the index and
+        is returned by the next take_promoted(), and the others wait for it instead.
+        """
+        source = str(Path(dicom_file).resolve())
+        uid = self._converting.pop(source, None)
+        waiting = self._waiting.pop(source, [])
+        if uid is None:
+            return
+        if success:
+            if self.action == 'link':
+                for duplicate in waiting:
+                    link_outputs(self._output_base(dicom_file), self._output_base(duplicate))
+            return
+
+        if self.entries.get(uid, {}).get('source') == source:
+            del self.entries[uid]
+        if not waiting:
+            return
+        promoted, waiting = waiting[0], waiting[1:]
+        promoted_source = str(Path(promoted).resolve())
+        self.duplicates = [(duplicate, promoted_source if first == source else first)
+                           for duplicate, first in self.duplicates if duplicate != str(promoted)]
+        if uid not in self.entries:
+            self.entries[uid] = {'source': promoted_source,
+                                 'output': str(self._output_base(promoted).relative_to(self.output_dir))}
+        self._converting[promoted_source] = uid
+        if waiting:
+            self._waiting[promoted_source] = waiting
+        unlink_shared_outputs(self._output_base(promoted))
+        self._promoted.append(promoted)
+
+    def take_promoted(self):
+        """Return the duplicates promoted since the last call, to be converted and passed to record()."""
+        promoted, self._promoted = self._promoted, []
+        return promoted
+
+    def summary(self):
+        verb = 'linked to the first copy' if self.action == 'link' else 'skipped'
+        return (f"Deduplication: {len(self.duplicates)} duplicate instance(s) {verb}, "
+                f"{len(self.entries)} instances indexed")
+
+    def save(self):
+        """Atomically write the index to the output directory."""
+        write_json_atomic(self.index_path, {'version': 1, 'instances': self.entries}, indent=1, sort_keys=True)
+
+
+def is_dicom_file(path):
+    """
+    Check whether a file looks like DICOM by reading its first 132 bytes: a 128-byte
+    preamble followed by the 'DICM' magic. Files without them are not accepted, as
+    conversion reads files with pydicom.dcmread, which rejects them as well.
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(132)
+    except OSError:
+        return False
+
+    return len(header) == 132 and header[128:] == b'DICM'
+
+
+def iter_dicomdir_files(dicomdir_path):
+    """Yield the existing files referenced by the directory records of a DICOMDIR."""
+    ds = pydicom.dcmread(dicomdir_path, stop_before_pixels=True)
+    base_dir = Path(dicomdir_path).parent
+    for record in getattr(ds, 'DirectoryRecordSequence', []):
+        file_id = record.get('ReferencedFileID')
+        if not file_id:
+            continue
+        parts = [file_id] if isinstance(file_id, str) else list(file_id)
+        file_path = base_dir.joinpath(*parts)
+        if file_path.is_file():
+            yield file_path
+
+
+def discover_dicom_files(input_path, recursive=False, use_dicomdir=False):
+    """
+    Find DICOM files under input_path.
+
+    Directories are scanned with os.scandir in sorted order and each candidate is
+    checked with is_dicom_file, so non-DICOM files are never parsed. Files are
+    yielded as they are found, so conversion can start before a large tree has
+    been fully walked.
+
+    Args:
+        input_path: DICOM file or directory
+        recursive: If True, also scan sub-directories (symlinked directories are not followed)
+        use_dicomdir: If True and input_path contains a DICOMDIR, yield the files it
+            references instead of scanning
+    """
+    input_path = Path(input_path)
+    if input_path.is_file():
+        yield input_path
+        return
+
+    dicomdir_path = input_path / 'DICOMDIR'
+    if use_dicomdir and dicomdir_path.is_file():
+        yield from iter_dicomdir_files(dicomdir_path)
+        return
+
+    for entry in scan_directory(input_path, recursive):
+        if is_dicom_file(entry.path):
+            yield Path(entry.path)
+
+
+def scan_directory(input_dir, recursive=False):
+    """
+    Yield the os.DirEntry of each candidate file below input_dir in sorted order,
+    skipping hidden entries and DICOMDIR files (symlinked directories are not followed).
+    """
+    directories = [Path(input_dir)]
+    while directories:
+        directory = directories.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"  Warning: cannot scan {directory}: {e}")
+            continue
+
+        subdirectories = []
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(Path(entry.path))
+            elif entry.is_file() and entry.name != 'DICOMDIR':
+                yield entry
+
+        if recursive:
+            directories.extend(reversed(subdirectories))
+
+
+def slice_sort_key(ds):
+    """
+    Sort key for a slice within a series: position along the slice normal if
+    ImagePositionPatient/ImageOrientationPatient are present, else InstanceNumber.
+    """
+    instance_number = int(getattr(ds, 'InstanceNumber', 0) or 0)
+    position = getattr(ds, 'ImagePositionPatient', None)
+    orientation = getattr(ds, 'ImageOrientationPatient', None)
+    if position is not None and orientation is not None and len(orientation) == 6:
+        normal = np.cross([float(v) for v in orientation[:3]], [float(v) for v in orientation[3:]])
+        return (0, float(np.dot(normal, [float(v) for v in position])), instance_number)
+    return (1, instance_number, 0)
+
+
+def group_series(dicom_files, metadata_records=None, record_all_tags=False):
+    """
+    Read the headers of dicom_files and group single-frame images into series.
+
+    Images are grouped by StudyInstanceUID, SeriesInstanceUID and image size, and
+    sorted with slice_sort_key. Headers are read without pixel data.
+
+    Args:
+        metadata_records: Optional list that a metadata record of every file is appended to
+        record_all_tags: If True, metadata records include every element
+
+    Returns:
+        (series, other_files): series is a dict mapping (study_uid, series_uid, rows, cols)
+        to a sorted list of (path, header) tuples; other_files lists multi-frame and
+        unreadable files, which are converted one by one
+    """
+    series = {}
+    other_files = []
+    for dicom_file in dicom_files:
+        try:
+            ds = read_dicom_header(dicom_file)
+        except Exception:
+            other_files.append(dicom_file)
+            continue
+        if metadata_records is not None:
+            metadata_records.append(metadata_record(ds, dicom_file, record_all_tags))
+
+        if int(getattr(ds, 'NumberOfFrames', 1) or 1) > 1 or not hasattr(ds, 'Rows'):
+            other_files.append(dicom_file)
+            continue
+
+        key = (str(getattr(ds, 'StudyInstanceUID', '')), str(getattr(ds, 'SeriesInstanceUID', '')),
+               int(ds.Rows), int(ds.Columns))
+        series.setdefault(key, []).append((dicom_file, ds))
+
+    for slices in series.values():
+        slices.sort(key=lambda item: (slice_sort_key(item[1]), str(item[0])))
+    return series, other_files
+
+
+def series_output_names(series, output_dirs=None):
+    """
+    Return the output name (without extension) of each group from group_series.
+
+    Groups are named series_<SeriesInstanceUID>. When several groups would write to
+    the same name in the same directory, e.g. a series split by image size, the name
+    gets _<rows>x<cols> appended, and groups that still collide are numbered.
+
+    Args:
+        series: Dict of groups as returned by group_series
+        output_dirs: Optional dict mapping group keys to their output directories
+
+    Returns:
+        Dict mapping group keys to output names
+    """
+    output_dirs = output_dirs or {}
+
+    def base_name(key):
+        return f"series_{key[1] or Path(series[key][0][0]).stem}"
+
+    counts = Counter((output_dirs.get(key), base_name(key)) for key in series)
+    names = {}
+    used = set()
+    for key in series:
+        output_dir = output_dirs.get(key)
+        name = base_name(key)
+        if counts[(output_dir, name)] > 1:
+            name += f"_{key[2]}x{key[3]}"
+        candidate, number = name, 2
+        while (output_dir, candidate) in used:
+            candidate = f"{name}_{number}"
+            number += 1
+        used.add((output_dir, candidate))
+        names[key] = candidate
+    return names
+
+
+def export_series_npy(slices, output_base):
+    """
+    Write the rescaled slices of a series into one contiguous memory-mapped .npy
+    (slices, rows, cols) with a JSON sidecar listing the slice positions.
+    Each slice is decoded straight into its place in the memmap.
+    """
+    first_path, first_ds = slices[0]
+    output_npy = f"{output_base}.npy"
+    rescales = {(getattr(ds, 'RescaleSlope', None), getattr(ds, 'RescaleIntercept', None)) for _, ds in slices}
+
+    volume = None
+    for i, (dicom_path, header) in enumerate(slices):
+        pixel_array = pydicom.dcmread(dicom_path).pixel_array
+        if volume is None:
+            # Slices with different rescale parameters are stored as float32
+            dtype = rescaled_dtype(first_ds, pixel_array.dtype) if len(rescales) == 1 else np.float32
+            volume = np.lib.format.open_memmap(output_npy, mode='w+', dtype=dtype,
+                                               shape=(len(slices),) + pixel_array.shape)
+        rescale_into(volume[i], pixel_array, header)
+    shape = volume.shape
+    dtype = volume.dtype
+    volume.flush()
+    del volume
+
+    positions = [_metadata_value(getattr(ds, 'ImagePositionPatient', None)) for _, ds in slices]
+    write_npy_sidecar(output_npy, first_ds, shape, first_path, slice_positions=positions)
+    print(f"  Series volume saved to: {output_npy} ({'x'.join(str(n) for n in shape)}, {dtype})")
+
+
+def convert_series(slices, output_dir, series_format='tiff', fps=10, write_txt=True,
+                   video_encoder='opencv', video_codec=None, output_name=None):
+    """
+    Convert a sorted series of single-frame images to one stacked output.
+
+    All slices are decoded into one preallocated volume. A single window is used for
+    the whole series: the window (or VOI LUT) of the first slice if present, otherwise
+    the full range of the rescaled volume, so slices are directly comparable.
+
+    Args:
+        slices: Sorted list of (path, header) tuples from group_series
+        output_dir: Directory to save output files
+        series_format: 'tiff' for a multi-page TIFF, 'mp4' for a cine video,
+            'npy' for the raw rescaled volume (see export_series_npy)
+        fps: Frames per second for video output
+        write_txt: If True, write the metadata text file of the first slice
+        video_encoder: Video backend for the 'mp4' format, a key of VIDEO_ENCODERS
+        video_codec: Codec for the video backend, None for its default
+        output_name: Output file name without extension (see series_output_names),
+            default series_<SeriesInstanceUID>
+
+    Returns:
+        True if successful, False otherwise
+    """
+    first_path, first_ds = slices[0]
+    series_uid = str(getattr(first_ds, 'SeriesInstanceUID', '')) or Path(first_path).stem
+    output_base = Path(output_dir) / (output_name or f"series_{series_uid}")
+
+    try:
+        if write_txt:
+            output_txt = f"{output_base}.txt"
+            extract_metadata(first_ds, output_txt)
+            print(f"  Metadata saved to: {output_txt}")
+
+        if series_format == 'npy':
+            export_series_npy(slices, output_base)
+            return True
+
+        # Slices share the stored values' rescale unless their headers differ
+        def rescale_of(ds):
+            if hasattr(ds, 'RescaleSlope') and hasattr(ds, 'RescaleIntercept'):
+                return float(ds.RescaleSlope), float(ds.RescaleIntercept)
+            return None
+        shared_rescale = all(rescale_of(ds) == rescale_of(first_ds) for _, ds in slices)
+
+        volume = None
+        for i, (dicom_path, _) in enumerate(slices):
+            pixel_array = pydicom.dcmread(dicom_path).pixel_array
+            if volume is None:
+                dtype = pixel_array.dtype if shared_rescale else np.float32
+                volume = np.empty((len(slices),) + pixel_array.shape, dtype=dtype)
+            if shared_rescale:
+                volume[i] = pixel_array
+            else:
+                slope, intercept = rescale_of(slices[i][1]) or (1.0, 0.0)
+                volume[i] = pixel_array * slope + intercept
+
+        slope, intercept = rescale_of(first_ds) if shared_rescale and rescale_of(first_ds) else (None, None)
+        window_center, window_width = get_window(first_ds)
+        voi_lut = get_voi_lut(first_ds) if window_center is None else None
+
+        if (window_center is None or window_width is None) and voi_lut is None:
+            # One window over the full range of the whole series
+            pixel_min = float(volume.min())
+            pixel_max = float(volume.max())
+            if slope is not None:
+                pixel_min, pixel_max = sorted((pixel_min * slope + intercept, pixel_max * slope + intercept))
+            window_width = max(pixel_max - pixel_min, 1.0)
+            window_center = pixel_min + window_width / 2
+
+        frames = normalize_pixel_stack(
+            volume, window_center, window_width, slope=slope, intercept=intercept,
+            invert=getattr(first_ds, 'PhotometricInterpretation', None) == "MONOCHROME1",
+            voi_lut=voi_lut
+        )
+        del volume
+
+        if series_format == 'mp4':
+            height, width = frames.shape[1:3]
+            with open_video_encoder(video_encoder, output_base, fps, width, height, video_codec) as video:
+                for frame in frames:
+                    video.write(frame)
+            print(f"  Series video saved to: {video.path} ({len(frames)} slices, {fps} fps)")
+        else:
+            output_tiff = f"{output_base}.tif"
+            pages = [Image.fromarray(frame, mode='L') for frame in frames]
+            pages[0].save(output_tiff, save_all=True, append_images=pages[1:])
+            print(f"  Series stack saved to: {output_tiff} ({len(pages)} slices)")
+
+        return True
+
+    except Exception as e:
+        print(f"  Error processing series {series_uid}: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def _convert_chunk(chunk, output_dir, options, input_root=None):
+    """
+    Worker entry point: convert a chunk of files in a pool process.
+    Console output of each file is captured so the parent can print it in one piece,
+    and metadata records are returned to the parent if export is enabled, together
+    with the profile record of each file.
     """
-    if window_center is not None and window_width is not None:
-        # Apply window/level adjustment
-        lower = window_center - window_width / 2
-        upper = window_center + window_width / 2
-        pixel_array = np.clip(pixel_array, lower, upper)
-        pixel_array = ((pixel_array - lower) / (upper - lower) * 255.0).astype(np.uint8)
-    else:
-        # Auto-scale to full range
-        pixel_array = pixel_array.astype(np.float64)
-        pixel_min = pixel_array.min()
-        pixel_max = pixel_array.max()
+    converter = Converter(**options)
+    results = []
+    for index, dicom_file in chunk:
+        log = io.StringIO()
+        records = [] if options.get('metadata_records') is not None else None
+        profile = FileProfile(dicom_file)
+        file_output_dir = get_output_dir(output_dir, dicom_file, input_root)
+        with redirect_stdout(log), redirect_stderr(log):
+            file_output_dir.mkdir(parents=True, exist_ok=True)
+            success = converter.convert_file(dicom_file, file_output_dir, profile=profile, metadata_records=records)
+        results.append((index, dicom_file, success, log.getvalue(), records, profile.record(success)))
+    return results
 
-        if pixel_max > pixel_min:
-            pixel_array = ((pixel_array - pixel_min) / (pixel_max - pixel_min) * 255.0)
 
-        pixel_array = pixel_array.astype(np.uint8)
+def convert_parallel(dicom_files, output_dir, options, workers, chunk_size=1, max_pending=None,
+                     input_root=None):
+    """
+    Convert DICOM files on a process pool.
 
-    return pixel_array
+    Files are submitted in chunks of chunk_size, with at most max_pending chunks
+    (default: 2 per worker) worth of files submitted but not yet reported, so memory
+    stays bounded even for very large batches.
 
+    dicom_files may be any iterable, e.g. the discover_dicom_files generator; it is
+    consumed only as fast as work is submitted. With input_root, sub-directories
+    below it are mirrored in output_dir (see get_output_dir).
 
-def extract_metadata(ds, output_txt_path):
-    """
-    Extract DICOM metadata and save to text file.
+    Metadata records are collected in the workers if options['metadata_records']
+    is a list (its contents are ignored) and returned with each result.
+
+    Yields:
+        (index, dicom_file, success, log, records, profile_record) tuples in input order
     """
-    with open(output_txt_path, 'w', encoding='utf-8') as f:
-        f.write("=" * 80 + "\n")
-        f.write("DICOM Metadata\n")
-        f.write("=" * 80 + "\n\n")
-
-        # Extract key patient and study information
-        important_tags = [
-            'PatientName', 'PatientID', 'PatientBirthDate', 'PatientSex',
-            'StudyDate', 'StudyTime', 'StudyDescription', 'SeriesDescription',
-            'Modality', 'InstitutionName', 'Manufacturer', 'ManufacturerModelName',
-            'ImageComments', 'StudyComments', 'SeriesNumber', 'InstanceNumber',
-            'ImageType', 'PhotometricInterpretation', 'SamplesPerPixel',
-            'Rows', 'Columns', 'BitsAllocated', 'BitsStored',
-            'WindowCenter', 'WindowWidth', 'RescaleIntercept', 'RescaleSlope'
-        ]
+    if max_pending is None:
+        max_pending = workers * 2
 
-        f.write("Key Information:\n")
-        f.write("-" * 80 + "\n")
-        for tag in important_tags:
-            if hasattr(ds, tag):
-                value = getattr(ds, tag)
-                f.write(f"{tag}: {value}\n")
+    numbered = enumerate(dicom_files, 1)
+    pending = set()
+    finished = {}  # index -> result tuple, waiting for earlier files
+    submitted = 0
+    next_index = 1
 
-        f.write("\n" + "=" * 80 + "\n")
-        f.write("Complete DICOM Header:\n")
-        f.write("=" * 80 + "\n\n")
-        f.write(str(ds))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        exhausted = False
+        while True:
+            # Keep the in-flight queue topped up
+            while not exhausted and submitted - (next_index - 1) < max_pending * chunk_size:
+                chunk = list(itertools.islice(numbered, chunk_size))
+                if not chunk:
+                    exhausted = True
+                    break
+                pending.add(executor.submit(_convert_chunk, chunk, output_dir, options, input_root))
+                submitted += len(chunk)
+
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for result in future.result():
+                    finished[result[0]] = result
 
+            # Report finished files in order
+            while next_index in finished:
+                yield finished.pop(next_index)
+                next_index += 1
 
-def convert_dicom_to_image(dicom_path, output_dir, preserve_precision=True, export_mp4=True, fps=10):
+
+def prefetch_dataset(dicom_path, options):
     """
-    Convert a DICOM file to PNG image(s), GIF animation, and/or MP4 video.
+    Reader-thread stage of convert_pipelined: read what convert_dicom_to_image needs first.
 
-    Args:
-        dicom_path: Path to DICOM file
-        output_dir: Directory to save output files
-        preserve_precision: If True, use 16-bit PNG for high precision data
-        export_mp4: If True, export multi-frame sequences as MP4 video
-        fps: Frames per second for video output
+    Streamed, metadata-only, memory-mapped, partial (frames/crop) and memory-budgeted
+    conversions only need the header; other conversions read the whole file including
+    its (still encoded) pixel data.
 
     Returns:
-        True if successful, False otherwise
+        (dataset, wall seconds, CPU seconds, bytes read)
     """
-    try:
-        # Read DICOM file
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    if (options.get('metadata_only') or options.get('stream_frames') or options.get('use_memmap')
+            or options.get('max_memory') is not None
+            or options.get('frames') is not None or options.get('crop') is not None):
+        ds = read_dicom_header(dicom_path)
+        bytes_read = 0
+    else:
         ds = pydicom.dcmread(dicom_path)
+        bytes_read = os.path.getsize(dicom_path)
+    return ds, time.perf_counter() - wall_start, time.thread_time() - cpu_start, bytes_read
 
-        # Get base filename without extension
-        base_name = Path(dicom_path).stem
-        output_base = Path(output_dir) / base_name
 
-        # Extract metadata
-        output_txt = f"{output_base}.txt"
-        extract_metadata(ds, output_txt)
-        print(f"  Metadata saved to: {output_txt}")
-
-        # Check if DICOM has pixel data
-        if not hasattr(ds, 'pixel_array'):
-            print(f"  Warning: No pixel data found in {dicom_path}")
-            return False
-
-        # Get pixel array
-        pixel_array = ds.pixel_array
-
-        # Get window center and width if available
-        window_center = getattr(ds, 'WindowCenter', None)
-        window_width = getattr(ds, 'WindowWidth', None)
-
-        # Handle multiple window values (take first)
-        if isinstance(window_center, (list, pydicom.multival.MultiValue)):
-            window_center = float(window_center[0])
-        elif window_center is not None:
-            window_center = float(window_center)
-
-        if isinstance(window_width, (list, pydicom.multival.MultiValue)):
-            window_width = float(window_width[0])
-        elif window_width is not None:
-            window_width = float(window_width)
-
-        # Apply rescale slope and intercept if present
-        if hasattr(ds, 'RescaleSlope') and hasattr(ds, 'RescaleIntercept'):
-            pixel_array = pixel_array * float(ds.RescaleSlope) + float(ds.RescaleIntercept)
-
-        # Check if multi-frame (animation)
-        if len(pixel_array.shape) > 2 and pixel_array.shape[0] > 1:
-            # Multi-frame image - save as GIF and MP4
-            frames_pil = []
-            frames_np = []
-
-            for i in range(pixel_array.shape[0]):
-                frame = pixel_array[i]
-                normalized_frame = normalize_pixel_array(frame, window_center, window_width)
-
-                # Handle photometric interpretation
-                if hasattr(ds, 'PhotometricInterpretation'):
-                    if ds.PhotometricInterpretation == "MONOCHROME1":
-                        # Invert for MONOCHROME1
-                        normalized_frame = 255 - normalized_frame
-
-                frames_pil.append(Image.fromarray(normalized_frame, mode='L'))
-                frames_np.append(normalized_frame)
-
-            # Save as animated GIF with optimization
-            output_gif = f"{output_base}.gif"
-            frames_pil[0].save(
-                output_gif,
-                save_all=True,
-                append_images=frames_pil[1:],
-                duration=int(1000 / fps),  # Convert fps to duration in ms
-                loop=0,
-                optimize=True,  # Enable optimization to reduce file size
-                disposal=2  # Clear frame before next frame (reduces size for medical images)
-            )
-            print(f"  GIF animation saved to: {output_gif} ({len(frames_pil)} frames, optimized)")
+def _write_output_file(path, data):
+    """Writer-thread stage of convert_pipelined: write one output file with save_output, timed."""
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    size = save_output(path, data)
+    return time.perf_counter() - wall_start, time.thread_time() - cpu_start, size
 
-            # Save as MP4 video
-            if export_mp4:
-                output_mp4 = f"{output_base}.mp4"
-                height, width = frames_np[0].shape
 
-                # Define codec and create VideoWriter object
-                fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-                out = cv2.VideoWriter(output_mp4, fourcc, fps, (width, height), isColor=False)
+class OutputWriter:
+    """
+    Hand the encoded outputs of one file to a pool of writer threads.
+
+    Passed to convert_dicom_to_image as output_writer, so encoding the next file
+    overlaps writing this one. wait() blocks until all files are written and
+    raises the first write error.
+    """
+
+    def __init__(self, executor):
+        self._executor = executor
+        self._futures = []
+
+    def write(self, path, data):
+        """Queue data to be written to path; returns its size in bytes."""
+        self._futures.append(self._executor.submit(_write_output_file, path, data))
+        return len(data.encode('utf-8')) if isinstance(data, str) else len(data)
+
+    def done(self):
+        return all(future.done() for future in self._futures)
+
+    def wait(self, profile=None):
+        """Wait for all writes; their times and sizes are added to profile as the 'write' stage."""
+        for future in self._futures:
+            wall_s, cpu_s, size = future.result()
+            if profile is not None:
+                profile.add('write', wall_s, cpu_s, bytes_in=size, bytes_out=size)
+
+
+def convert_pipelined(dicom_files, output_dir, options, readers=2, writers=2, prefetch=None, max_pending=None,
+                      input_root=None):
+    """
+    Convert DICOM files with reading, conversion and writing overlapped.
+
+    Reader threads prefetch the next files (see prefetch_dataset) while the calling
+    thread decodes, normalizes and encodes the current one, and writer threads write
+    its outputs (see OutputWriter). At most `prefetch` files (default: 2 per reader)
+    are read ahead and at most `max_pending` files (default: 2 per writer) wait for
+    their writes, so memory stays flat however many files there are.
+
+    dicom_files may be any iterable and is consumed only as fast as files are read.
+    With input_root, sub-directories below it are mirrored in output_dir.
+
+    Yields:
+        (index, dicom_file, success, log, records, profile_record) tuples in input
+        order, as convert_parallel; a file only counts as successful once its outputs
+        are written
+    """
+    if prefetch is None:
+        prefetch = readers * 2
+    if max_pending is None:
+        max_pending = writers * 2
+
+    converter = Converter(**options)
+    numbered = enumerate(dicom_files, 1)
+    reads = deque()    # (index, dicom_file, future) being read ahead
+    pending = deque()  # converted files waiting for their writes
+
+    def finish(index, dicom_file, success, log, records, profile, output_writer):
+        try:
+            output_writer.wait(profile)
+        except Exception as e:
+            log += f"  Error writing outputs of {dicom_file}: {str(e)}\n"
+            success = False
+        return index, dicom_file, success, log, records, profile.record(success)
+
+    with ThreadPoolExecutor(max_workers=readers) as read_pool, \
+            ThreadPoolExecutor(max_workers=writers) as write_pool:
+        while True:
+            # Keep the read-ahead queue topped up
+            while len(reads) < prefetch:
+                item = next(numbered, None)
+                if item is None:
+                    break
+                index, dicom_file = item
+                reads.append((index, dicom_file, read_pool.submit(prefetch_dataset, dicom_file, options)))
+            if not reads:
+                break
 
-                for frame in frames_np:
-                    out.write(frame)
+            index, dicom_file, future = reads.popleft()
+            profile = FileProfile(dicom_file)
+            log = io.StringIO()
+            records = [] if options.get('metadata_records') is not None else None
+            output_writer = OutputWriter(write_pool)
+            try:
+                ds, wall_s, cpu_s, bytes_read = future.result()
+                profile.add('read', wall_s, cpu_s, bytes_in=bytes_read)
+            except Exception:
+                # Let convert_dicom_to_image read the file again and report the error
+                ds = None
 
-                out.release()
-                print(f"  MP4 video saved to: {output_mp4} ({len(frames_np)} frames, {fps} fps)")
+            file_output_dir = get_output_dir(output_dir, dicom_file, input_root)
+            with redirect_stdout(log), redirect_stderr(log):
+                file_output_dir.mkdir(parents=True, exist_ok=True)
+                success = converter.convert_file(dicom_file, file_output_dir, profile=profile, ds=ds,
+                                                 output_writer=output_writer, metadata_records=records)
+            del ds
+            pending.append((index, dicom_file, success, log.getvalue(), records, profile, output_writer))
 
+            # Report files whose outputs are written; block when too many are waiting
+            while pending and (len(pending) > max_pending or pending[0][-1].done()):
+                yield finish(*pending.popleft())
+
+        while pending:
+            yield finish(*pending.popleft())
+
+
+class FolderWatcher:
+    """
+    Poll a directory for DICOM files that have finished arriving.
+
+    A file is ready once its size is unchanged since the previous poll and it was
+    last modified at least settle_s seconds ago, so files still being copied are
+    left alone. Each file is reported once per version: it is reported again only
+    if its size or modification time changes later. Files that are not DICOM are
+    remembered and not read again until they change.
+    """
+
+    def __init__(self, input_dir, recursive=False, settle_s=2.0):
+        self.input_dir = Path(input_dir)
+        self.recursive = recursive
+        self.settle_s = settle_s
+        self._pending = {}  # path -> (size, mtime_ns) seen at the previous poll
+        self._done = {}     # path -> (size, mtime_ns) already reported or ignored
+
+    def poll(self):
+        """Scan the directory once and return the newly ready DICOM files, in sorted order."""
+        now = time.time()
+        ready = []
+        present = set()
+        for entry in scan_directory(self.input_dir, self.recursive):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            path = entry.path
+            signature = (stat.st_size, stat.st_mtime_ns)
+            present.add(path)
+            if self._done.get(path) == signature:
+                continue
+            if self._pending.get(path) != signature or now - stat.st_mtime < self.settle_s:
+                self._pending[path] = signature
+                continue
+            del self._pending[path]
+            self._done[path] = signature
+            if is_dicom_file(path):
+                ready.append(Path(path))
+
+        # Forget files that were removed
+        for table in (self._pending, self._done):
+            for path in [path for path in table if path not in present]:
+                del table[path]
+        return ready
+
+    @property
+    def arriving_count(self):
+        """Number of files seen but not yet settled."""
+        return len(self._pending)
+
+
+class WatchStats:
+    """Throughput and queue depth of watch mode, printed and optionally saved as JSON."""
+
+    def __init__(self, window_s=60.0):
+        self.window_s = window_s
+        self.started = time.time()
+        self.converted = 0
+        self.failed = 0
+        self.queued = 0
+        self.in_progress = 0
+        self.arriving = 0
+        self._finished = deque()  # completion times within the last window_s seconds
+
+    def record(self, success):
+        if success:
+            self.converted += 1
         else:
-            # Single frame image
-            if len(pixel_array.shape) > 2:
-                pixel_array = pixel_array[0]
-
-            # Normalize pixel array
-            normalized_array = normalize_pixel_array(pixel_array, window_center, window_width)
-
-            # Handle photometric interpretation
-            if hasattr(ds, 'PhotometricInterpretation'):
-                if ds.PhotometricInterpretation == "MONOCHROME1":
-                    # Invert for MONOCHROME1
-                    normalized_array = 255 - normalized_array
-
-            # Create PIL Image
-            if hasattr(ds, 'SamplesPerPixel') and ds.SamplesPerPixel == 3:
-                # Color image
-                if len(normalized_array.shape) == 2:
-                    img = Image.fromarray(normalized_array, mode='L')
-                else:
-                    img = Image.fromarray(normalized_array, mode='RGB')
-            else:
-                # Grayscale image
-                img = Image.fromarray(normalized_array, mode='L')
+            self.failed += 1
+        now = time.time()
+        self._finished.append(now)
+        while self._finished and self._finished[0] < now - self.window_s:
+            self._finished.popleft()
 
-            # Save as PNG (supports high bit depth if needed)
-            output_png = f"{output_base}.png"
+    def snapshot(self):
+        now = time.time()
+        while self._finished and self._finished[0] < now - self.window_s:
+            self._finished.popleft()
+        uptime = now - self.started
+        return {
+            'time': now,
+            'uptime_s': uptime,
+            'converted': self.converted,
+            'failed': self.failed,
+            'queued': self.queued,
+            'in_progress': self.in_progress,
+            'arriving': self.arriving,
+            'files_per_s': len(self._finished) / min(self.window_s, max(uptime, 1e-9)),
+            'files_per_s_total': (self.converted + self.failed) / max(uptime, 1e-9),
+        }
 
-            # For high precision data, optionally save as 16-bit PNG
-            if preserve_precision and pixel_array.dtype in [np.int16, np.uint16, np.int32, np.uint32]:
-                # Save original pixel range as 16-bit
-                pixel_16bit = pixel_array.astype(np.float64)
-                pixel_min = pixel_16bit.min()
-                pixel_max = pixel_16bit.max()
+    def format(self):
+        stats = self.snapshot()
+        return (f"[watch] {stats['converted']} converted, {stats['failed']} failed, "
+                f"{stats['queued']} queued, {stats['in_progress']} in progress, "
+                f"{stats['arriving']} arriving | {stats['files_per_s']:.2f} files/s "
+                f"(last {self.window_s:.0f} s), {stats['files_per_s_total']:.2f} files/s overall")
 
-                if pixel_max > pixel_min:
-                    pixel_16bit = ((pixel_16bit - pixel_min) / (pixel_max - pixel_min) * 65535.0)
+    def save(self, path):
+        """Atomically replace path with the current snapshot as JSON."""
+        write_json_atomic(path, self.snapshot(), indent=1)
 
-                pixel_16bit = pixel_16bit.astype(np.uint16)
 
-                if hasattr(ds, 'PhotometricInterpretation') and ds.PhotometricInterpretation == "MONOCHROME1":
-                    pixel_16bit = 65535 - pixel_16bit
+def _init_watch_worker():
+    """Leave Ctrl+C and SIGTERM to the watching process, which shuts the pool down."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
 
-                img_16bit = Image.fromarray(pixel_16bit, mode='I;16')
-                img_16bit.save(output_png)
-                print(f"  Image saved to: {output_png} (16-bit precision)")
-            else:
-                img.save(output_png)
-                print(f"  Image saved to: {output_png}")
 
-        return True
+def required_modules(options):
+    """Names of the lazily imported modules (see LazyModule) that a conversion with options uses."""
+    modules = ['numpy', 'pydicom']
+    if not options.get('metadata_only') and options.get('export_images', True):
+        modules += ['PIL.Image', 'PIL.GifImagePlugin']
+        if options.get('export_mp4', True) and options.get('video_encoder', 'opencv') == 'opencv':
+            modules.append('cv2')
+    return modules
 
-    except InvalidDicomError:
-        print(f"  Error: {dicom_path} is not a valid DICOM file")
-        return False
-    except Exception as e:
-        print(f"  Error processing {dicom_path}: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return False
+
+def _warm_up(modules):
+    """Pool warm-up task: import the modules conversions will need, so the first file is not slower."""
+    for module_name in modules:
+        importlib.import_module(module_name)
+    return os.getpid()
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def watch_folder(input_dir, output_dir, options, workers=1, recursive=False, poll_interval=1.0, settle_s=2.0,
+                 stats_interval=10.0, stats_path=None, file_filter=None, checkpoint=None):
+    """
+    Watch a directory and convert DICOM files as they finish arriving, until interrupted.
+
+    Files are converted by a pool of `workers` processes started up front, so the
+    imports and codec setup are paid once instead of once per batch. At most two files
+    per worker are submitted at a time; the rest wait in a queue. The throughput and
+    queue depth (see WatchStats) are printed every stats_interval seconds and, with
+    stats_path, saved to a JSON file. On the same timer, checkpoint is called if files
+    arrived or finished since its last call, so state such as the incremental manifest
+    survives the process being killed.
+
+    Args:
+        input_dir: Directory to watch (see FolderWatcher)
+        output_dir, options: As for convert_parallel
+        recursive: If True, also watch sub-directories (mirrored in output_dir)
+        poll_interval: Seconds between directory scans
+        settle_s: Seconds a file must be left unmodified before it is converted
+        file_filter: Optional function filtering each batch of ready files,
+            e.g. ConversionManifest.filter
+        checkpoint: Optional function saving the caller's state, called after the
+            results yielded so far have been consumed
+
+    Yields:
+        (index, dicom_file, success, log, records, profile_record) tuples in
+        completion order, as convert_parallel
+    """
+    watcher = FolderWatcher(input_dir, recursive, settle_s)
+    stats = WatchStats()
+    input_root = Path(input_dir) if recursive else None
+    waiting = deque()
+    running = set()
+    counter = itertools.count(1)
+    next_poll = 0.0
+    next_stats = time.monotonic() + stats_interval
+    changed = False
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_watch_worker) as executor:
+        list(executor.map(_warm_up, [required_modules(options)] * workers))
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= next_poll:
+                    ready = watcher.poll()
+                    waiting.extend(file_filter(ready) if file_filter is not None else ready)
+                    changed = changed or bool(ready)
+                    next_poll = now + poll_interval
+
+                while waiting and len(running) < workers * 2:
+                    dicom_file = waiting.popleft()
+                    running.add(executor.submit(_convert_chunk, [(next(counter), dicom_file)], output_dir, options,
+                                                input_root))
+
+                stats.queued, stats.in_progress, stats.arriving = len(waiting), len(running), watcher.arriving_count
+                if now >= next_stats:
+                    print(stats.format(), flush=True)
+                    if stats_path:
+                        stats.save(stats_path)
+                    if checkpoint is not None and changed:
+                        checkpoint()
+                        changed = False
+                    next_stats = now + stats_interval
+
+                if running:
+                    finished, running = wait(running, timeout=max(0.0, next_poll - time.monotonic()),
+                                             return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        for result in future.result():
+                            stats.record(result[2])
+                            changed = True
+                            yield result
+                else:
+                    time.sleep(max(0.0, next_poll - time.monotonic()))
+        finally:
+            stats.queued, stats.in_progress = len(waiting), len(running)
+            print(stats.format(), flush=True)
+            if stats_path:
+                stats.save(stats_path)
+
+
+def convert_series_mode(args, dicom_files, output_dir, options, input_root=None):
+    """Run the --series mode of main(): group files by series and convert each stack."""
+    metadata_records = [] if args.metadata_export else None
+    series, other_files = group_series(dicom_files, metadata_records, args.all_tags)
+    total = len(series) + len(other_files)
+    if not total:
+        print("No DICOM files found")
+        sys.exit(1)
+
+    print(f"Found {len(series)} series ({sum(len(s) for s in series.values())} images) "
+          f"and {len(other_files)} other files")
+    print(f"Output directory: {output_dir}")
+    print(f"Series format: {args.series_format}")
+    print("=" * 80)
+
+    success_count = 0
+    output_dirs = {key: get_output_dir(output_dir, slices[0][0], input_root) for key, slices in series.items()}
+    output_names = series_output_names(series, output_dirs)
+    for i, (key, slices) in enumerate(series.items(), 1):
+        _, series_uid, rows, cols = key
+        print(f"\n[{i}/{total}] Series: {series_uid} ({len(slices)} slices, {rows}x{cols})")
+        output_dirs[key].mkdir(parents=True, exist_ok=True)
+        if convert_series(slices, output_dirs[key], args.series_format, options['fps'], options['write_txt'],
+                          options['video_encoder'], options['video_codec'], output_names[key]):
+            success_count += 1
+
+    for i, dicom_file in enumerate(other_files, len(series) + 1):
+        name = dicom_file.relative_to(input_root) if input_root is not None else dicom_file.name
+        print(f"\n[{i}/{total}] Processing: {name}")
+        file_output_dir = get_output_dir(output_dir, dicom_file, input_root)
+        file_output_dir.mkdir(parents=True, exist_ok=True)
+        if convert_dicom_to_image(dicom_file, file_output_dir, **dict(options, metadata_records=None)):
+            success_count += 1
+
+    if metadata_records is not None:
+        with MetadataExportWriter(args.metadata_export, all_tags=args.all_tags) as writer:
+            for record in metadata_records:
+                writer.write(record)
+
+    print("\n" + "=" * 80)
+    print(f"Conversion complete: {success_count}/{total} series and files processed successfully")
+    if metadata_records is not None:
+        print(f"Metadata exported to: {args.metadata_export} ({len(metadata_records)} records)")
+    print(f"Output saved to: {output_dir}")
 
 
 def main():
@@ -256,6 +3673,58 @@ def main():
         action='store_true',
         help='Force 8-bit output (default is 16-bit for high precision data)'
     )
+    parser.add_argument(
+        '--png-compression',
+        type=int,
+        choices=range(10),
+        metavar='0-9',
+        help='PNG zlib compression level, 0 = fastest/largest, 9 = slowest/smallest (default: 6)'
+    )
+    parser.add_argument(
+        '--image-format',
+        choices=['png', 'tiff'],
+        default='png',
+        help='Single-frame image format: png, or tiff for fast uncompressed output (default: png)'
+    )
+    parser.add_argument(
+        '--frames',
+        type=parse_frame_ranges,
+        metavar='RANGES',
+        help='Only read, decode and convert these frames of multi-frame files, '
+             '0-based with inclusive ranges, e.g. 0,5,100-150'
+    )
+    parser.add_argument(
+        '--crop',
+        type=parse_crop,
+        metavar='X,Y,W,H',
+        help='Only convert this region of each image, in pixels from the top left corner'
+    )
+    parser.add_argument(
+        '--memmap',
+        action='store_true',
+        help='Memory-map uncompressed pixel data instead of reading it into memory'
+    )
+    parser.add_argument(
+        '--decode-workers',
+        type=int,
+        default=1,
+        metavar='N',
+        help='Decode the frames of compressed multi-frame files on N threads or processes '
+             '(default: 1, 0 = one per CPU core)'
+    )
+    parser.add_argument(
+        '--decode-backend',
+        choices=DECODE_BACKENDS,
+        default='thread',
+        help='How --decode-workers run: thread, or process for codecs that hold the GIL (default: thread)'
+    )
+    parser.add_argument(
+        '--max-memory',
+        type=parse_memory_size,
+        metavar='SIZE',
+        help='Memory budget for the whole run, e.g. 2G or 512M (at least 64M): each file is converted in '
+             'full, memmap, chunked or streaming mode to fit, and fewer workers are used if needed'
+    )
     parser.add_argument(
         '--no-mp4',
         action='store_true',
@@ -267,6 +3736,191 @@ def main():
         default=10,
         help='Frames per second for GIF and MP4 output (default: 10)'
     )
+    parser.add_argument(
+        '--video-encoder',
+        choices=list(VIDEO_ENCODERS),
+        default='opencv',
+        help='Video backend: opencv = cv2.VideoWriter, ffmpeg = pipe to a local ffmpeg binary, '
+             'frames = PNG image sequence (default: opencv)'
+    )
+    parser.add_argument(
+        '--video-codec',
+        help='Codec for the video backend: an OpenCV fourcc (default: mp4v) '
+             'or an ffmpeg encoder (default: libx264)'
+    )
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='Decode and encode multi-frame files one frame at a time to limit memory use'
+    )
+    parser.add_argument(
+        '--gif-profile',
+        choices=['small', 'fast'],
+        default='small',
+        help='GIF encoding: small = PIL size optimization, fast = one shared palette, '
+             'no per-frame optimization (default: small)'
+    )
+    parser.add_argument(
+        '--gif-delta',
+        action='store_true',
+        help='With --gif-profile fast or --stream, only encode the changed rectangle of each GIF frame'
+    )
+    parser.add_argument(
+        '--thumbnail',
+        type=int,
+        metavar='SIZE',
+        help='Also write <name>_thumb.png with its longest edge at most SIZE pixels'
+    )
+    parser.add_argument(
+        '--pyramid',
+        type=int,
+        default=0,
+        metavar='LEVELS',
+        help='Also write LEVELS downsampled images <name>_L1.png (1/2), <name>_L2.png (1/4), ...'
+    )
+    parser.add_argument(
+        '--contact-sheet',
+        action='store_true',
+        help='Build multi-frame previews from a mosaic of up to 16 frames instead of the middle frame'
+    )
+    parser.add_argument(
+        '--metadata-only',
+        action='store_true',
+        help='Only write metadata text files, without reading pixel data'
+    )
+    parser.add_argument(
+        '--metadata-export',
+        metavar='PATH',
+        help='Also write metadata of all files to one JSON Lines (.jsonl) or CSV (.csv) file'
+    )
+    parser.add_argument(
+        '--all-tags',
+        action='store_true',
+        help='Include every DICOM element in --metadata-export (JSON Lines only)'
+    )
+    parser.add_argument(
+        '--no-txt',
+        action='store_true',
+        help='Do not write per-file metadata text files'
+    )
+    parser.add_argument(
+        '-r', '--recursive',
+        action='store_true',
+        help='Also convert DICOM files in sub-directories (output mirrors the folder structure)'
+    )
+    parser.add_argument(
+        '--dicomdir',
+        action='store_true',
+        help='If the input directory has a DICOMDIR, convert the files it references'
+    )
+    parser.add_argument(
+        '--npy',
+        action='store_true',
+        help='Also write rescaled pixel data in its native dtype to memory-mapped .npy files'
+    )
+    parser.add_argument(
+        '--npy-only',
+        action='store_true',
+        help='Write .npy files (and metadata) only, without PNG/GIF/MP4'
+    )
+    parser.add_argument(
+        '--series',
+        action='store_true',
+        help='Group single-frame images by series and convert each series to one stack'
+    )
+    parser.add_argument(
+        '--series-format',
+        choices=['tiff', 'mp4', 'npy'],
+        default='tiff',
+        help='Stacked output format for --series (default: tiff)'
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Skip files whose outputs are up to date, using a manifest in the output directory'
+    )
+    parser.add_argument(
+        '--hash',
+        action='store_true',
+        help='With --incremental, also compare SHA-256 content hashes of changed files'
+    )
+    parser.add_argument(
+        '--dedup',
+        choices=['skip', 'link'],
+        help='Convert each SOPInstanceUID once, also across runs: skip later copies, '
+             'or hard-link their outputs to the first copy\'s'
+    )
+    parser.add_argument(
+        '--dedup-pixels',
+        action='store_true',
+        help='With --dedup, copies are only duplicates if their stored pixel data is identical (SHA-256)'
+    )
+    parser.add_argument(
+        '--profile',
+        metavar='PATH',
+        help='Write per-file stage timings and bytes to a JSON Lines (.jsonl) or CSV (.csv) trace, '
+             'plus an aggregated <name>.summary.json'
+    )
+    parser.add_argument(
+        '-j', '--workers',
+        type=int,
+        default=1,
+        help='Number of worker processes (default: 1, 0 = one per CPU core)'
+    )
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=None,
+        help='Files per task submitted to each worker (default: automatic)'
+    )
+    parser.add_argument(
+        '--pipeline',
+        action='store_true',
+        help='Overlap reading, conversion and writing with reader and writer threads'
+    )
+    parser.add_argument(
+        '--readers',
+        type=int,
+        default=2,
+        help='Reader threads prefetching files for --pipeline (default: 2)'
+    )
+    parser.add_argument(
+        '--writers',
+        type=int,
+        default=2,
+        help='Writer threads writing outputs for --pipeline (default: 2)'
+    )
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='Keep running and convert new files as they arrive in the input directory'
+    )
+    parser.add_argument(
+        '--poll-interval',
+        type=float,
+        default=1.0,
+        metavar='SECONDS',
+        help='Seconds between scans of the watched directory (default: 1.0)'
+    )
+    parser.add_argument(
+        '--settle',
+        type=float,
+        default=2.0,
+        metavar='SECONDS',
+        help='Seconds a file must be left unmodified before --watch converts it (default: 2.0)'
+    )
+    parser.add_argument(
+        '--stats-interval',
+        type=float,
+        default=10.0,
+        metavar='SECONDS',
+        help='Seconds between --watch throughput/queue statistics lines (default: 10)'
+    )
+    parser.add_argument(
+        '--stats-file',
+        metavar='PATH',
+        help='With --watch, also keep the latest statistics in this JSON file'
+    )
 
     args = parser.parse_args()
 
@@ -275,47 +3929,302 @@ def main():
     preserve_precision = not args.__dict__['8bit']
     export_mp4 = not args.no_mp4
     fps = args.fps
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    decode_workers = args.decode_workers if args.decode_workers > 0 else (os.cpu_count() or 1)
+
+    if args.all_tags and not args.metadata_export:
+        parser.error("--all-tags requires --metadata-export")
+    if args.all_tags and args.metadata_export.lower().endswith('.csv'):
+        parser.error("--all-tags is only supported for JSON Lines export")
+    if args.thumbnail is not None and args.thumbnail < 1:
+        parser.error("--thumbnail must be at least 1")
+    if args.pyramid < 0:
+        parser.error("--pyramid must not be negative")
+    if args.contact_sheet and not (args.thumbnail or args.pyramid):
+        parser.error("--contact-sheet requires --thumbnail or --pyramid")
+    if args.gif_delta and not (args.gif_profile == 'fast' or args.stream):
+        parser.error("--gif-delta requires --gif-profile fast or --stream")
+    if args.video_encoder == 'ffmpeg' and shutil.which('ffmpeg') is None:
+        parser.error("--video-encoder ffmpeg requires an ffmpeg binary on PATH")
+    if args.chunk_size is not None and args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+    if args.pipeline and workers > 1:
+        parser.error("--pipeline cannot be combined with --workers")
+    if args.readers < 1 or args.writers < 1:
+        parser.error("--readers and --writers must be at least 1")
+    if args.hash and not args.incremental:
+        parser.error("--hash requires --incremental")
+    if args.dedup_pixels and not args.dedup:
+        parser.error("--dedup-pixels requires --dedup")
+    if args.series and (args.incremental or args.dedup or args.metadata_only or args.profile):
+        parser.error("--series cannot be combined with --incremental, --dedup, --metadata-only or --profile")
+    if args.series and (workers > 1 or args.pipeline or args.npy or args.npy_only):
+        parser.error("--series cannot be combined with --workers, --pipeline, --npy or --npy-only "
+                     "(use --series-format npy for .npy volumes)")
+    if (args.frames is not None or args.crop is not None) and (args.series or args.metadata_only):
+        parser.error("--frames and --crop cannot be combined with --series or --metadata-only")
+    if args.watch and (args.series or args.pipeline or args.dicomdir):
+        parser.error("--watch cannot be combined with --series, --pipeline or --dicomdir")
+    if args.watch and not input_path.is_dir():
+        parser.error("--watch requires an input directory")
+    if args.poll_interval <= 0 or args.stats_interval <= 0 or args.settle < 0:
+        parser.error("--poll-interval and --stats-interval must be positive and --settle not negative")
+    if args.stats_file and not args.watch:
+        parser.error("--stats-file requires --watch")
+    if args.max_memory is not None and args.series:
+        parser.error("--max-memory cannot be combined with --series")
+    if args.max_memory is not None and args.max_memory < MIN_WORKER_MEMORY:
+        parser.error(f"--max-memory must be at least {MIN_WORKER_MEMORY // 1024 ** 2} MB, "
+                     f"the smallest budget a file is converted with")
+
+    requested_workers = workers
+    file_memory = None
+    if args.max_memory is not None:
+        workers, file_memory = plan_workers(args.max_memory, workers)
 
     # Create output directory
     output_dir.mkdir(exist_ok=True)
 
-    # Collect DICOM files
-    dicom_files = []
-    if input_path.is_file():
-        dicom_files = [input_path]
-    elif input_path.is_dir():
-        # Find all DICOM files (skip DICOMDIR and non-DICOM files)
-        skip_extensions = {'.exe', '.dll', '.inf', '.txt', '.md', '.py', '.DS_Store', '.db'}
-        for file_path in sorted(input_path.iterdir()):
-            if file_path.is_file() and file_path.name != 'DICOMDIR':
-                # Skip known non-DICOM files
-                if any(file_path.name.endswith(ext) for ext in skip_extensions) or file_path.name.startswith('.'):
-                    continue
-                dicom_files.append(file_path)
-    else:
+    if not input_path.exists():
         print(f"Error: {input_path} does not exist")
         sys.exit(1)
 
-    if not dicom_files:
-        print("No DICOM files found")
-        sys.exit(1)
+    options = {
+        'preserve_precision': preserve_precision,
+        'image_format': args.image_format,
+        'png_compression': args.png_compression,
+        'export_mp4': export_mp4,
+        'fps': fps,
+        'stream_frames': args.stream,
+        'gif_profile': args.gif_profile,
+        'gif_delta': args.gif_delta,
+        'thumbnail_size': args.thumbnail,
+        'pyramid_levels': args.pyramid,
+        'contact_sheet': args.contact_sheet,
+        'frames': args.frames,
+        'crop': args.crop,
+        'use_memmap': args.memmap,
+        'max_memory': file_memory,
+        'decode_workers': decode_workers,
+        'decode_backend': args.decode_backend,
+        'video_encoder': args.video_encoder,
+        'video_codec': args.video_codec,
+        'metadata_only': args.metadata_only,
+        'write_txt': not args.no_txt,
+        'metadata_records': [] if args.metadata_export else None,
+        'record_all_tags': args.all_tags,
+        'export_npy': args.npy or args.npy_only,
+        'export_images': not args.npy_only,
+    }
+
+    # Mirror sub-directories in the output when files can come from several folders
+    input_root = input_path if input_path.is_dir() and (args.recursive or args.dicomdir) else None
+
+    # Collect DICOM files. Recursive scans are streamed into the converter,
+    # so conversion starts while the tree is still being walked.
+    dicom_files = discover_dicom_files(input_path, recursive=args.recursive, use_dicomdir=args.dicomdir)
+
+    if args.series:
+        convert_series_mode(args, dicom_files, output_dir, options, input_root)
+        return
+
+    manifest = None
+    if args.incremental:
+        manifest = ConversionManifest(output_dir, options, use_hash=args.hash, input_root=input_root)
+        if not args.watch:
+            dicom_files = manifest.filter(dicom_files)
+    dedup = None
+    if args.dedup:
+        # After the manifest, so only files that need converting are checked
+        dedup = DedupIndex(output_dir, args.dedup, args.dedup_pixels, input_root)
+        if not args.watch:
+            dicom_files = dedup.filter(dicom_files)
+
+    def watch_filter(ready):
+        for file_filter in [index.filter for index in (manifest, dedup) if index is not None]:
+            ready = file_filter(ready)
+        if dedup is not None:
+            ready = itertools.chain(ready, dedup.take_promoted())
+        return ready
+
+    if args.watch:
+        total = None
+        print(f"Watching {input_path}{' recursively' if args.recursive else ''} "
+              f"(scan every {args.poll_interval:g} s, files settle after {args.settle:g} s, Ctrl+C to stop)")
+    elif args.recursive:
+        total = None
+        print(f"Scanning {input_path} recursively")
+    else:
+        dicom_files = list(dicom_files)
+        total = len(dicom_files)
+        total_found = (total + (manifest.skipped_count if manifest is not None else 0)
+                       + (len(dedup.duplicates) if dedup is not None else 0))
+        if not total_found:
+            print("No DICOM files found")
+            sys.exit(1)
+        print(f"Found {total_found} DICOM files")
+        if manifest is not None:
+            manifest.drop_removed(input_path)
+            print(manifest.summary())
+            for key in manifest.removed:
+                print(f"  Removed source: {key}")
+        if dedup is not None:
+            print(dedup.summary())
 
-    print(f"Found {len(dicom_files)} DICOM files")
     print(f"Output directory: {output_dir}")
-    print(f"Precision mode: {'16-bit' if preserve_precision else '8-bit'}")
-    print(f"Video format: {'GIF + MP4' if export_mp4 else 'GIF only'}")
-    print(f"Frame rate: {fps} fps")
+    if args.metadata_only:
+        print("Mode: metadata only (pixel data is not read)")
+    elif args.npy_only:
+        print("Mode: raw .npy volumes only")
+    else:
+        print(f"Precision mode: {'16-bit' if preserve_precision else '8-bit'}")
+        if args.image_format == 'tiff':
+            print("Image format: uncompressed TIFF")
+        elif args.png_compression is not None:
+            print(f"PNG compression level: {args.png_compression}")
+        print(f"Video format: {'GIF + MP4' if export_mp4 else 'GIF only'}")
+        if export_mp4:
+            print(f"Video encoder: {args.video_encoder}{f' ({args.video_codec})' if args.video_codec else ''}")
+        gif_mode = 'streamed' if args.stream else args.gif_profile
+        print(f"GIF profile: {gif_mode}{' (changed rectangles)' if args.gif_delta else ''}")
+        print(f"Frame rate: {fps} fps")
+        if args.thumbnail or args.pyramid:
+            previews = ([f"{args.thumbnail}px thumbnail"] if args.thumbnail else []) + \
+                ([f"{args.pyramid}-level pyramid"] if args.pyramid else [])
+            print(f"Previews: {', '.join(previews)}{' (contact sheet)' if args.contact_sheet else ''}")
+        if args.npy:
+            print("Raw volumes: .npy")
+    if args.frames is not None:
+        print(f"Frames: {len(args.frames)} selected ({args.frames[0]} to {args.frames[-1]})")
+    if args.crop is not None:
+        print("Crop: {2}x{3} at ({0}, {1})".format(*args.crop))
+    if args.memmap:
+        print("Pixel data: memory-mapped when uncompressed")
+    if decode_workers > 1:
+        print(f"Frame decoding: {decode_workers} {'processes' if args.decode_backend == 'process' else 'threads'}")
+    if args.dedup:
+        print(f"Duplicates: by SOPInstanceUID{' and pixel data' if args.dedup_pixels else ''}, "
+              f"{'hard-linked' if args.dedup == 'link' else 'skipped'}")
+    if args.max_memory is not None:
+        print(f"Memory budget: {args.max_memory / 1024 ** 2:.0f} MB, {file_memory / 1024 ** 2:.0f} MB per file")
+    if workers > 1 or workers < requested_workers:
+        print(f"Workers: {workers}" + (f" (reduced from {requested_workers} to fit the memory budget)"
+                                       if workers < requested_workers else ""))
+    if args.pipeline:
+        print(f"Pipeline: {args.readers} reader threads, {args.writers} writer threads")
     print("=" * 80)
 
+    if args.metadata_export:
+        metadata_writer = MetadataExportWriter(args.metadata_export, all_tags=args.all_tags)
+    else:
+        metadata_writer = nullcontext()
+    profile_writer = ProfileTraceWriter(args.profile) if args.profile else nullcontext()
+
+    def print_progress(i, dicom_file):
+        name = dicom_file.relative_to(input_root) if input_root is not None else dicom_file.name
+        print(f"\n[{i}/{total}] Processing: {name}" if total is not None else f"\n[{i}] Processing: {name}")
+
+    def record_result(dicom_file, success, records, profile_record):
+        for record in records or []:
+            metadata_writer.write(record)
+        if args.profile:
+            profile_writer.write(profile_record)
+        if manifest is not None:
+            manifest.record(dicom_file, success)
+        if dedup is not None:
+            dedup.record(dicom_file, success)
+
+    def save_state():
+        if manifest is not None:
+            manifest.save()
+        if dedup is not None:
+            dedup.save()
+
     # Process each file
+    converter = Converter(**options)
+    processed_count = 0
     success_count = 0
-    for i, dicom_file in enumerate(dicom_files, 1):
-        print(f"\n[{i}/{len(dicom_files)}] Processing: {dicom_file.name}")
-        if convert_dicom_to_image(dicom_file, output_dir, preserve_precision, export_mp4, fps):
-            success_count += 1
+    results = None
+    if args.watch:
+        # Stop cleanly (as for Ctrl+C) when a service manager terminates the process
+        signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    try:
+        with metadata_writer, profile_writer:
+            while dicom_files is not None:
+                if workers > 1 or args.pipeline or args.watch:
+                    if args.watch:
+                        results = watch_folder(input_path, output_dir, options, workers, args.recursive,
+                                               args.poll_interval, args.settle, args.stats_interval, args.stats_file,
+                                               watch_filter if manifest is not None or dedup is not None else None,
+                                               save_state)
+                    elif args.pipeline:
+                        results = convert_pipelined(dicom_files, output_dir, options, args.readers, args.writers,
+                                                    input_root=input_root)
+                    else:
+                        chunk_size = args.chunk_size or (max(1, min(16, total // (workers * 4))) if total else 1)
+                        results = convert_parallel(dicom_files, output_dir, options, workers, chunk_size,
+                                                   input_root=input_root)
+                    for i, dicom_file, success, log, records, profile_record in results:
+                        print_progress(i, dicom_file)
+                        print(log, end='', flush=True)
+                        processed_count += 1
+                        if success:
+                            success_count += 1
+                        record_result(dicom_file, success, records, profile_record)
+                else:
+                    for i, dicom_file in enumerate(dicom_files, 1):
+                        print_progress(i, dicom_file)
+                        records = [] if args.metadata_export else None
+                        profile = FileProfile(dicom_file)
+                        file_output_dir = get_output_dir(output_dir, dicom_file, input_root)
+                        file_output_dir.mkdir(parents=True, exist_ok=True)
+                        success = converter.convert_file(dicom_file, file_output_dir, profile=profile,
+                                                         metadata_records=records)
+                        processed_count += 1
+                        if success:
+                            success_count += 1
+                        record_result(dicom_file, success, records, profile.record(success))
+
+                # Duplicates that were skipped while their first copy was converting
+                # are converted in its place if it failed
+                dicom_files = dedup.take_promoted() if dedup is not None and not args.watch else None
+                if dicom_files:
+                    total = len(dicom_files)
+                    print(f"\nConverting {total} duplicate(s) in place of first copies that failed")
+                else:
+                    dicom_files = None
+    except KeyboardInterrupt:
+        if not args.watch:
+            raise
+        results.close()
+        print("\nStopped watching")
+    finally:
+        if manifest is not None and args.recursive:
+            manifest.drop_removed(input_path)
+        save_state()
+
+    if (total is None and processed_count == 0 and not (manifest and manifest.skipped_count)
+            and not (dedup and dedup.duplicates) and not args.watch):
+        print("No DICOM files found")
+        sys.exit(1)
 
     print("\n" + "=" * 80)
-    print(f"Conversion complete: {success_count}/{len(dicom_files)} files processed successfully")
+    print(f"Conversion complete: {success_count}/{processed_count} files processed successfully")
+    if manifest is not None:
+        if args.recursive:
+            print(manifest.summary())
+            for key in manifest.removed:
+                print(f"  Removed source: {key}")
+        print(f"Skipped {manifest.skipped_count} up-to-date files")
+    if dedup is not None:
+        print(dedup.summary())
+        for duplicate, first in dedup.duplicates:
+            print(f"  Duplicate: {duplicate} (same instance as {first})")
+    if args.metadata_export:
+        print(f"Metadata exported to: {args.metadata_export} ({metadata_writer.count} records)")
+    if args.profile:
+        print(profile_writer.format_summary())
+        print(f"Profile trace saved to: {args.profile} (summary: {profile_writer.summary_path})")
     print(f"Output saved to: {output_dir}")
 
 
@@ -0,0 +1,772 @@
+"""Regression tests for dicom_converter.py, run with `python -m pytest`."""
+
+import argparse
+import csv
+import io
+import json
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pydicom
+import pytest
+from PIL import Image
+
+import benchmark_converter
+import dicom_converter
+from create_sample_dicom import create_synthetic_dicom, synthetic_frames
+
+SCRIPT = Path(dicom_converter.__file__)
+
+
+def run_converter(*args):
+    """Run the converter command line and return its stdout."""
+    result = subprocess.run([sys.executable, str(SCRIPT), *map(str, args)],
+                            capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+def test_output_paths_ignore_other_sources_with_dotted_names(tmp_path):
+    for name in ('a.png', 'a.txt', 'a_thumb.png', 'a_L1.png', 'a_L2.png', 'a.x.png', 'a.x.txt', 'a_L1.x.png'):
+        (tmp_path / name).write_bytes(b'')
+
+    names = [path.name for path in dicom_converter.output_paths(tmp_path / 'a')]
+
+    assert names == ['a.png', 'a.txt', 'a_L1.png', 'a_L2.png', 'a_thumb.png']
+
+
+def test_dedup_link_does_not_link_outputs_of_dotted_names(tmp_path):
+    input_dir = tmp_path / 'dg'
+    output_dir = tmp_path / 'out'
+    input_dir.mkdir()
+    create_synthetic_dicom(input_dir / 'a.dcm', rows=32, cols=32, seed=1, verbose=False)
+    create_synthetic_dicom(input_dir / 'a.x.dcm', rows=48, cols=48, seed=2, verbose=False)
+    shutil.copy(input_dir / 'a.dcm', input_dir / 'b.dcm')
+
+    for _ in range(2):
+        run_converter(input_dir, '-o', output_dir, '--dedup', 'link')
+
+    names = sorted(path.name for path in output_dir.iterdir() if not path.name.startswith('.'))
+    assert names == ['a.png', 'a.txt', 'a.x.png', 'a.x.txt', 'b.png', 'b.txt']
+    assert (output_dir / 'b.png').samefile(output_dir / 'a.png')
+    assert not (output_dir / 'a.x.png').samefile(output_dir / 'a.png')
+
+
+def test_manifest_regenerates_output_when_only_dotted_name_exists(tmp_path):
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    dicom_file = tmp_path / 'a.dcm'
+    create_synthetic_dicom(dicom_file, rows=32, cols=32, verbose=False)
+    options = {'preserve_precision': True}
+    _, entry = dicom_converter.check_manifest(dicom_file, None, options, output_dir)
+
+    (output_dir / 'a.x.png').write_bytes(b'')
+    assert dicom_converter.check_manifest(dicom_file, entry, options, output_dir)[0] == 'missing-output'
+
+    (output_dir / 'a.png').write_bytes(b'')
+    assert dicom_converter.check_manifest(dicom_file, entry, options, output_dir)[0] == 'unchanged'
+
+
+def test_manifest_regenerates_deleted_recorded_output(tmp_path):
+    input_dir = tmp_path / 'in'
+    output_dir = tmp_path / 'out'
+    input_dir.mkdir()
+    create_synthetic_dicom(input_dir / 'a.dcm', rows=32, cols=32, verbose=False)
+    run_converter(input_dir, '-o', output_dir, '--incremental')
+
+    (output_dir / 'a.png').unlink()
+    output = run_converter(input_dir, '-o', output_dir, '--incremental')
+
+    assert '1 to redo' in output
+    assert (output_dir / 'a.png').exists()
+
+
+def test_discovery_skips_files_without_preamble(tmp_path):
+    create_synthetic_dicom(tmp_path / 'a.dcm', rows=32, cols=32, verbose=False)
+    # Same data set without the preamble and 'DICM' magic, which dcmread rejects
+    (tmp_path / 'raw.dcm').write_bytes((tmp_path / 'a.dcm').read_bytes()[132:])
+
+    found = [Path(path).name for path in dicom_converter.discover_dicom_files(tmp_path)]
+
+    assert found == ['a.dcm']
+
+
+def test_series_groups_of_different_sizes_get_separate_outputs(tmp_path):
+    input_dir = tmp_path / 'in'
+    output_dir = tmp_path / 'out'
+    input_dir.mkdir()
+    # Both files belong to the same series, with different image sizes
+    create_synthetic_dicom(input_dir / 'small.dcm', rows=32, cols=32, verbose=False)
+    create_synthetic_dicom(input_dir / 'large.dcm', rows=48, cols=40, verbose=False)
+
+    output = run_converter(input_dir, '-o', output_dir, '--series')
+
+    assert '2/2' in output
+    stacks = sorted(path.name for path in output_dir.glob('*.tif'))
+    assert len(stacks) == 2
+    assert stacks[0].endswith('_32x32.tif') and stacks[1].endswith('_48x40.tif')
+
+
+def test_synthetic_frames_with_odd_sizes(tmp_path):
+    assert synthetic_frames(63, 31, num_frames=2).shape == (2, 63, 31)
+
+    create_synthetic_dicom(tmp_path / 'odd.dcm', rows=63, cols=31, verbose=False)
+    assert pydicom.dcmread(tmp_path / 'odd.dcm').pixel_array.shape == (63, 31)
+
+
+def test_frame_ranges_reject_open_ended_ranges():
+    assert dicom_converter.parse_frame_ranges('0,5,3-4') == [0, 3, 4, 5]
+    for text in ('5-', '-5', '3-1'):
+        with pytest.raises(argparse.ArgumentTypeError):
+            dicom_converter.parse_frame_ranges(text)
+
+
+def test_memory_options_do_not_change_outputs_or_manifest(tmp_path):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    create_synthetic_dicom(input_dir / 'cine.dcm', rows=32, cols=32, num_frames=4, verbose=False)
+    run_converter(input_dir, '-o', tmp_path / 'full')
+    run_converter(input_dir, '-o', tmp_path / 'mapped', '--incremental', '--memmap')
+
+    # The metadata text lists Pixel Data although the pixel data was not read
+    assert (tmp_path / 'full' / 'cine.txt').read_text() == (tmp_path / 'mapped' / 'cine.txt').read_text()
+    output = run_converter(input_dir, '-o', tmp_path / 'mapped', '--incremental', '--max-memory', '64M')
+    assert '1 up to date' in output
+
+
+def test_sequential_memory_budget_is_not_reduced_by_worker_base():
+    assert dicom_converter.plan_workers(80 * 1024 ** 2, 1) == (1, 80 * 1024 ** 2)
+    workers, file_memory = dicom_converter.plan_workers(4 * 1024 ** 3, 4)
+    assert workers == 4 and file_memory == (4 * 1024 ** 3 - 4 * dicom_converter.WORKER_BASE_MEMORY) // 4
+
+
+def test_dedup_converts_next_copy_when_first_copy_fails(tmp_path):
+    input_dir = tmp_path / 'in'
+    output_dir = tmp_path / 'out'
+    input_dir.mkdir()
+    create_synthetic_dicom(input_dir / 'a.dcm', rows=64, cols=64, verbose=False)
+    for name in ('b.dcm', 'c.dcm'):
+        shutil.copy(input_dir / 'a.dcm', input_dir / name)
+    # Truncate the pixel data of the first copy; its header stays readable
+    data = (input_dir / 'a.dcm').read_bytes()
+    (input_dir / 'a.dcm').write_bytes(data[:-4000])
+
+    run_converter(input_dir, '-o', output_dir, '--dedup', 'link')
+
+    assert not (output_dir / 'a.png').exists()
+    assert (output_dir / 'b.png').exists()
+    assert (output_dir / 'c.png').samefile(output_dir / 'b.png')
+
+
+def test_dedup_pixel_hash_failure_converts_the_file(tmp_path, monkeypatch, capsys):
+    create_synthetic_dicom(tmp_path / 'a.dcm', rows=32, cols=32, verbose=False)
+    shutil.copy(tmp_path / 'a.dcm', tmp_path / 'b.dcm')
+
+    def failing_hash(dicom_path):
+        raise OSError('unreadable')
+    monkeypatch.setattr(dicom_converter, 'pixel_data_hash', failing_hash)
+    dedup = dicom_converter.DedupIndex(tmp_path / 'out', use_pixel_hash=True)
+
+    converted = [Path(path).name for path in dedup.filter([tmp_path / 'a.dcm', tmp_path / 'b.dcm'])]
+
+    assert converted == ['a.dcm', 'b.dcm']
+    assert 'cannot compare pixel data of' in capsys.readouterr().out
+    assert dedup.duplicates == []
+
+
+@pytest.mark.parametrize('backend', dicom_converter.DECODE_BACKENDS)
+def test_decode_pixels_without_offset_table_matches_pixel_array(tmp_path, backend):
+    from pydicom.encaps import encapsulate, generate_frames
+    create_synthetic_dicom(tmp_path / 'rle.dcm', rows=32, cols=32, num_frames=6, transfer_syntax='rle',
+                           verbose=False)
+    ds = pydicom.dcmread(tmp_path / 'rle.dcm')
+    expected = ds.pixel_array
+    ds.PixelData = encapsulate(list(generate_frames(ds.PixelData, number_of_frames=6)), has_bot=False)
+
+    assert np.array_equal(dicom_converter.decode_pixels(ds, 2, backend), expected)
+
+
+@pytest.mark.parametrize('option', [['-j', '2'], ['--pipeline'], ['--npy'], ['--npy-only']])
+def test_series_rejects_options_it_would_ignore(tmp_path, option):
+    result = subprocess.run([sys.executable, str(SCRIPT), str(tmp_path), '--series', *option],
+                            capture_output=True, text=True)
+
+    assert result.returncode == 2
+    assert '--series cannot be combined with' in result.stderr
+
+
+@pytest.mark.parametrize('chunk_size', ['0', '-1'])
+def test_chunk_size_must_be_positive(tmp_path, chunk_size):
+    result = subprocess.run([sys.executable, str(SCRIPT), str(tmp_path), '-j', '2', '--chunk-size', chunk_size],
+                            capture_output=True, text=True)
+
+    assert result.returncode == 2
+    assert '--chunk-size must be at least 1' in result.stderr
+
+
+class BrokenVideoEncoder:
+    """Video encoder whose writes and close both fail."""
+
+    label = 'Broken video'
+
+    def __init__(self, output_base, fps, width, height, codec=None):
+        self.path = f"{output_base}.broken"
+
+    def write(self, frame):
+        raise RuntimeError('encoder write failed')
+
+    def close(self):
+        raise RuntimeError('encoder close failed')
+
+
+@pytest.mark.parametrize('stream_frames', [False, True])
+def test_video_close_error_does_not_replace_conversion_error(tmp_path, monkeypatch, capsys, stream_frames):
+    monkeypatch.setitem(dicom_converter.VIDEO_ENCODERS, 'broken', BrokenVideoEncoder)
+    create_synthetic_dicom(tmp_path / 'cine.dcm', rows=32, cols=32, num_frames=4, verbose=False)
+
+    assert not dicom_converter.convert_dicom_to_image(tmp_path / 'cine.dcm', tmp_path, video_encoder='broken',
+                                                      stream_frames=stream_frames)
+
+    output = capsys.readouterr().out
+    assert 'Error processing' in output and 'encoder write failed' in output
+    assert 'Warning: closing the Broken video output failed: encoder close failed' in output
+
+
+@pytest.mark.parametrize('options, converter_options', [
+    ([], {}),
+    (['--gif-profile', 'fast', '--thumbnail', '16', '--contact-sheet'],
+     {'gif_profile': 'fast', 'thumbnail_size': 16, 'contact_sheet': True}),
+])
+def test_command_line_files_match_converter_results(tmp_path, options, converter_options):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    create_synthetic_dicom(input_dir / 'slice.dcm', rows=40, cols=36, verbose=False)
+    create_synthetic_dicom(input_dir / 'cine.dcm', rows=32, cols=30, num_frames=20, verbose=False)
+    run_converter(input_dir, '-o', tmp_path / 'out', '--no-mp4', *options)
+
+    converter = dicom_converter.Converter(**converter_options)
+    slice_result = converter.convert(input_dir / 'slice.dcm', outputs=('image', 'previews'))
+    cine_result = converter.convert(input_dir / 'cine.dcm', outputs=('gif', 'previews'))
+
+    assert (tmp_path / 'out' / 'slice.png').read_bytes() == slice_result.image
+    assert (tmp_path / 'out' / 'cine.gif').read_bytes() == cine_result.gif
+    if converter_options:
+        assert (tmp_path / 'out' / 'slice_thumb.png').read_bytes() == slice_result.previews['thumb']
+        assert (tmp_path / 'out' / 'cine_thumb.png').read_bytes() == cine_result.previews['thumb']
+
+
+def test_parallel_workers_match_serial_outputs(tmp_path):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    for seed in range(4):
+        create_synthetic_dicom(input_dir / f"s{seed}.dcm", rows=32, cols=32, seed=seed, verbose=False)
+    create_synthetic_dicom(input_dir / 'cine.dcm', rows=32, cols=32, num_frames=4, verbose=False)
+
+    run_converter(input_dir, '-o', tmp_path / 'serial', '--no-mp4')
+    output = run_converter(input_dir, '-o', tmp_path / 'parallel', '--no-mp4', '-j', '2', '--chunk-size', '2')
+
+    assert '5/5' in output
+    serial = sorted(path.name for path in (tmp_path / 'serial').iterdir())
+    assert serial == sorted(path.name for path in (tmp_path / 'parallel').iterdir())
+    for name in serial:
+        assert (tmp_path / 'serial' / name).read_bytes() == (tmp_path / 'parallel' / name).read_bytes()
+
+
+@pytest.mark.parametrize('bits, gif_delta', [(16, False), (16, True), (8, False)])
+def test_stream_gif_matches_full_load_gif(tmp_path, bits, gif_delta):
+    create_synthetic_dicom(tmp_path / 'cine.dcm', rows=32, cols=30, bits=bits, num_frames=20, verbose=False)
+    for mode, stream_frames in (('full', False), ('stream', True)):
+        (tmp_path / mode).mkdir()
+        assert dicom_converter.convert_dicom_to_image(tmp_path / 'cine.dcm', tmp_path / mode, export_mp4=False,
+                                                      gif_profile='fast', gif_delta=gif_delta,
+                                                      stream_frames=stream_frames)
+
+    # Streaming always writes the shared-palette GIF of --gif-profile fast
+    assert (tmp_path / 'stream' / 'cine.gif').read_bytes() == (tmp_path / 'full' / 'cine.gif').read_bytes()
+    with Image.open(tmp_path / 'stream' / 'cine.gif') as gif:
+        assert gif.n_frames == 20
+
+
+def normalize_frames(stack, window_center=None, window_width=None, slope=None, intercept=None, invert=False):
+    """Reference: rescale and normalize each frame with normalize_pixel_array."""
+    output = []
+    for frame in stack:
+        if slope is not None:
+            frame = frame * float(slope) + float(intercept)
+        frame = dicom_converter.normalize_pixel_array(frame, window_center, window_width)
+        output.append(255 - frame if invert else frame)
+    return np.stack(output)
+
+
+@pytest.mark.parametrize('dtype, low, high', [
+    (np.uint8, 0, 256),         # per-frame tables over all byte values
+    (np.int16, -500, 1500),     # per-frame tables over the stored range
+    (np.int32, -70000, 70000),  # float path, tables would be too large
+    (np.float32, -1.5, 2.5),
+])
+@pytest.mark.parametrize('window', [(None, None), (300.0, 800.0)])
+@pytest.mark.parametrize('rescale', [(None, None), (2, -10)])
+@pytest.mark.parametrize('invert', [False, True])
+def test_normalize_pixel_stack_matches_per_frame_normalization(dtype, low, high, window, rescale, invert):
+    rng = np.random.default_rng(0)
+    stack = rng.uniform(low, high, size=(5, 24, 20)).astype(dtype)
+    stack[2] = 7  # constant frames are left unscaled
+
+    expected = normalize_frames(stack, *window, *rescale, invert)
+
+    assert np.array_equal(dicom_converter.normalize_pixel_stack(stack, *window, *rescale, invert,
+                                                                chunk_bytes=3 * 24 * 20 * 8), expected)
+
+
+@pytest.mark.parametrize('dtype', ['|u1', '|i1', '<u2', '<i2'])
+@pytest.mark.parametrize('window', [(None, None), (40.0, 400.0)])
+@pytest.mark.parametrize('rescale', [(None, None), (1.5, -1024.0)])
+@pytest.mark.parametrize('invert', [False, True])
+def test_window_lut_matches_float_windowing(dtype, window, rescale, invert):
+    # Every stored value of the dtype, so the whole table is checked
+    stored = np.arange(2 ** (8 * np.dtype(dtype).itemsize), dtype=f'u{np.dtype(dtype).itemsize}').view(dtype)
+    values = stored * rescale[0] + rescale[1] if rescale[0] is not None else stored
+    value_range = None if window[0] is not None else (float(values.min()), float(values.max()))
+
+    lut = dicom_converter.build_window_lut(dtype, *rescale, *window, value_range=value_range, invert=invert)
+
+    expected = dicom_converter.normalize_pixel_array(values, *window)
+    assert np.array_equal(dicom_converter.apply_window_lut(stored, lut), 255 - expected if invert else expected)
+
+
+@pytest.mark.parametrize('bits', [8, 16])
+@pytest.mark.parametrize('photometric', ['MONOCHROME2', 'MONOCHROME1'])
+def test_single_frame_lut_display_matches_float_display(tmp_path, bits, photometric):
+    create_synthetic_dicom(tmp_path / 'a.dcm', rows=40, cols=36, bits=bits, signed=bits == 16, verbose=False)
+    ds = pydicom.dcmread(tmp_path / 'a.dcm')
+    ds.PhotometricInterpretation = photometric
+    pixel_array = ds.pixel_array
+
+    display = dicom_converter.single_frame_display(ds, pixel_array, preserve_precision=False)
+
+    # Float input takes the rescale, window and normalize path without tables
+    expected = dicom_converter.single_frame_display(ds, pixel_array.astype(np.float64), preserve_precision=False)
+    assert display.dtype == np.uint8
+    assert np.array_equal(display, expected)
+
+
+def test_metadata_only_writes_the_same_text_without_reading_pixels(tmp_path):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    create_synthetic_dicom(input_dir / 'slice.dcm', rows=64, cols=64, verbose=False)
+    create_synthetic_dicom(input_dir / 'rle.dcm', rows=32, cols=32, num_frames=3, transfer_syntax='rle',
+                           verbose=False)
+    run_converter(input_dir, '-o', tmp_path / 'full', '--no-mp4')
+    # The pixel data is no longer complete, but its element header still is
+    data = (input_dir / 'slice.dcm').read_bytes()
+    (input_dir / 'slice.dcm').write_bytes(data[:-4000])
+
+    run_converter(input_dir, '-o', tmp_path / 'meta', '--metadata-only')
+
+    assert sorted(path.name for path in (tmp_path / 'meta').iterdir()) == ['rle.txt', 'slice.txt']
+    for name in ('rle.txt', 'slice.txt'):
+        assert (tmp_path / 'meta' / name).read_text() == (tmp_path / 'full' / name).read_text()
+
+
+def test_metadata_export_json_lines_and_csv(tmp_path):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    create_synthetic_dicom(input_dir / 'a.dcm', rows=40, cols=36, verbose=False)
+    create_synthetic_dicom(input_dir / 'b.dcm', rows=24, cols=24, bits=8, num_frames=3, verbose=False)
+
+    output = run_converter(input_dir, '-o', tmp_path / 'out', '--metadata-only', '--no-txt',
+                           '--metadata-export', tmp_path / 'meta.jsonl')
+    run_converter(input_dir, '-o', tmp_path / 'out', '--metadata-only', '--no-txt',
+                  '--metadata-export', tmp_path / 'meta.csv')
+    run_converter(input_dir, '-o', tmp_path / 'out', '--metadata-only', '--no-txt',
+                  '--metadata-export', tmp_path / 'all.jsonl', '--all-tags')
+
+    assert '(2 records)' in output
+    assert not list((tmp_path / 'out').glob('*.txt'))
+    records = [json.loads(line) for line in (tmp_path / 'meta.jsonl').read_text().splitlines()]
+    assert [Path(record['path']).name for record in records] == ['a.dcm', 'b.dcm']
+    assert records[0]['Rows'] == 40 and records[0]['Columns'] == 36 and records[0]['RescaleIntercept'] == -1024.0
+    assert records[1]['BitsAllocated'] == 8 and records[1]['ImageType'] == ['DERIVED', 'SECONDARY']
+    assert 'RescaleSlope' not in records[1]
+
+    with open(tmp_path / 'meta.csv', newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == ['path'] + dicom_converter.IMPORTANT_TAGS
+    assert [row['path'] for row in rows] == [record['path'] for record in records]
+    assert rows[0]['Rows'] == '40' and rows[0]['ImageType'] == 'DERIVED\\SECONDARY'
+    assert rows[1]['RescaleSlope'] == ''
+
+    all_tags = [json.loads(line) for line in (tmp_path / 'all.jsonl').read_text().splitlines()]
+    assert all_tags[1]['NumberOfFrames'] == 3
+    assert all_tags[1]['SOPInstanceUID'] == pydicom.dcmread(input_dir / 'b.dcm').SOPInstanceUID
+    assert 'PixelData' not in all_tags[1]
+
+
+@pytest.mark.parametrize('options', [['--npy'], ['--npy-only'], ['--npy', '--memmap']])
+def test_npy_round_trip(tmp_path, options):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    create_synthetic_dicom(input_dir / 'ct.dcm', rows=40, cols=36, signed=True, verbose=False)
+    create_synthetic_dicom(input_dir / 'cine.dcm', rows=32, cols=30, bits=8, num_frames=5, verbose=False)
+
+    run_converter(input_dir, '-o', tmp_path / 'out', '--no-mp4', *options)
+
+    for name in ('ct', 'cine'):
+        ds = pydicom.dcmread(input_dir / f"{name}.dcm")
+        expected = ds.pixel_array
+        if 'RescaleSlope' in ds:
+            expected = expected * int(ds.RescaleSlope) + int(ds.RescaleIntercept)
+        volume = np.load(tmp_path / 'out' / f"{name}.npy", mmap_mode='r')
+        assert volume.dtype == dicom_converter.rescaled_dtype(ds, ds.pixel_array.dtype)
+        assert np.array_equal(volume, expected)
+        sidecar = json.loads((tmp_path / 'out' / f"{name}.json").read_text())
+        assert sidecar['shape'] == list(expected.shape)
+        assert sidecar['rescale_applied'] == ('RescaleSlope' in ds)
+    assert (tmp_path / 'out' / 'ct.png').exists() != ('--npy-only' in options)
+
+
+def test_suite_case_reports_converter_stage_times(tmp_path):
+    create_synthetic_dicom(tmp_path / 'slice.dcm', rows=32, cols=32, verbose=False)
+    create_synthetic_dicom(tmp_path / 'cine.dcm', rows=32, cols=32, num_frames=4, verbose=False)
+
+    result = benchmark_converter.run_suite_case([tmp_path / 'slice.dcm', tmp_path / 'cine.dcm'], fps=10)
+
+    assert result['succeeded'] == 2
+    assert list(result['stages_s']) == dicom_converter.PROFILE_STAGES
+    for stage in ('read', 'decode', 'normalize', 'encode_png', 'encode_gif', 'metadata', 'write'):
+        assert result['stages_s'][stage] > 0
+    assert result['stages_s']['npy'] == 0
+
+
+def test_profile_trace_and_summary(tmp_path):
+    input_dir = tmp_path / 'in'
+    output_dir = tmp_path / 'out'
+    input_dir.mkdir()
+    create_synthetic_dicom(input_dir / 'a.dcm', rows=40, cols=36, verbose=False)
+    create_synthetic_dicom(input_dir / 'b.dcm', rows=32, cols=30, num_frames=4, verbose=False)
+    create_synthetic_dicom(input_dir / 'c.dcm', rows=64, cols=64, verbose=False)
+    data = (input_dir / 'c.dcm').read_bytes()
+    (input_dir / 'c.dcm').write_bytes(data[:-4000])
+
+    output = run_converter(input_dir, '-o', output_dir, '--no-mp4', '--profile', tmp_path / 'trace.jsonl')
+    run_converter(input_dir, '-o', output_dir, '--no-mp4', '--profile', tmp_path / 'rows.csv')
+
+    assert 'Profile: 3 files' in output
+    records = {Path(record['path']).name: record
+               for record in map(json.loads, (tmp_path / 'trace.jsonl').read_text().splitlines())}
+    assert {name: record['success'] for name, record in records.items()} == {'a.dcm': True, 'b.dcm': True,
+                                                                              'c.dcm': False}
+    a, b = records['a.dcm']['stages'], records['b.dcm']['stages']
+    assert a['decode']['bytes_out'] == 40 * 36 * 2 and b['decode']['bytes_out'] == 4 * 32 * 30 * 2
+    assert a['encode_png']['bytes_out'] == (output_dir / 'a.png').stat().st_size
+    assert b['encode_gif']['bytes_out'] == (output_dir / 'b.gif').stat().st_size
+    assert a['write']['bytes_out'] == (output_dir / 'a.png').stat().st_size
+    assert a['metadata']['bytes_out'] == (output_dir / 'a.txt').stat().st_size
+    assert 'encode_gif' not in a and 'encode_png' not in b
+
+    summary = json.loads((tmp_path / 'trace.summary.json').read_text())
+    assert summary['files'] == 3 and summary['failed'] == 1
+    assert list(summary['stages']) == [stage for stage in dicom_converter.PROFILE_STAGES if stage in summary['stages']]
+    for stage, totals in summary['stages'].items():
+        assert totals['calls'] == sum(record['stages'].get(stage, {}).get('calls', 0) for record in records.values())
+        assert totals['bytes_out'] == sum(record['stages'].get(stage, {}).get('bytes_out', 0)
+                                          for record in records.values())
+
+    with open(tmp_path / 'rows.csv', newline='', encoding='utf-8') as f:
+        rows = {Path(row['path']).name: row for row in csv.DictReader(f)}
+    assert rows['a.dcm']['success'] == 'True' and rows['c.dcm']['success'] == 'False'
+    assert int(rows['a.dcm']['decode_bytes_out']) == 40 * 36 * 2
+    assert rows['a.dcm']['encode_gif_wall_s'] == ''
+    assert json.loads((tmp_path / 'rows.summary.json').read_text())['files'] == 3
+
+
+@pytest.mark.parametrize('delta', [False, True])
+def test_fast_gif_frames_decode_to_display_frames(delta):
+    rng = np.random.default_rng(0)
+    frames = np.repeat(rng.integers(0, 256, size=(1, 24, 20), dtype=np.uint8), 5, axis=0)
+    for i in range(1, 5):
+        frames[i, 4 + i:10 + i, 3:9] = 40 * i  # moving square over a static background
+    frames[3] = frames[2]  # unchanged frame
+
+    data = dicom_converter.encode_gif(frames, fps=10, gif_profile='fast', gif_delta=delta)
+
+    with Image.open(io.BytesIO(data)) as gif:
+        assert gif.n_frames == 5
+        for i in range(5):
+            gif.seek(i)
+            assert gif.info['duration'] == 100
+            assert np.array_equal(np.asarray(gif.convert('L')), frames[i])
+
+
+@pytest.mark.parametrize('stream_frames', [False, True])
+def test_frames_video_encoder_writes_display_frames(tmp_path, stream_frames):
+    create_synthetic_dicom(tmp_path / 'cine.dcm', rows=32, cols=30, num_frames=20, verbose=False)
+
+    assert dicom_converter.convert_dicom_to_image(tmp_path / 'cine.dcm', tmp_path, video_encoder='frames',
+                                                  stream_frames=stream_frames)
+
+    display = dicom_converter.Converter().display(tmp_path / 'cine.dcm')
+    paths = sorted((tmp_path / 'cine_frames').iterdir())
+    assert [path.name for path in paths] == [f"frame_{i:05d}.png" for i in range(20)]
+    for path, frame in zip(paths, display):
+        with Image.open(path) as image:
+            assert np.array_equal(np.asarray(image), frame)
+
+
+@pytest.mark.parametrize('encoder', ['opencv', pytest.param('ffmpeg', marks=pytest.mark.skipif(
+    shutil.which('ffmpeg') is None, reason='ffmpeg is not installed'))])
+def test_video_encoders_write_every_frame(tmp_path, encoder):
+    cv2 = pytest.importorskip('cv2')
+    create_synthetic_dicom(tmp_path / 'cine.dcm', rows=32, cols=30, num_frames=12, verbose=False)
+
+    assert dicom_converter.convert_dicom_to_image(tmp_path / 'cine.dcm', tmp_path, video_encoder=encoder)
+
+    capture = cv2.VideoCapture(str(tmp_path / 'cine.mp4'))
+    try:
+        assert int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) == 12
+        assert int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)) == 30 and int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)) == 32
+    finally:
+        capture.release()
+
+
+def test_pipeline_outputs_match_serial_outputs(tmp_path):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    for seed in range(3):
+        create_synthetic_dicom(input_dir / f"s{seed}.dcm", rows=40, cols=36, seed=seed, verbose=False)
+    create_synthetic_dicom(input_dir / 'cine.dcm', rows=32, cols=30, num_frames=6, verbose=False)
+    options = ['--no-mp4', '--npy', '--thumbnail', '16']
+
+    run_converter(input_dir, '-o', tmp_path / 'serial', *options, '--metadata-export', tmp_path / 'serial.jsonl')
+    output = run_converter(input_dir, '-o', tmp_path / 'pipelined', *options, '--pipeline', '--readers', '3',
+                           '--writers', '2', '--metadata-export', tmp_path / 'pipelined.jsonl')
+
+    assert '4/4' in output
+    serial = sorted(path.name for path in (tmp_path / 'serial').iterdir())
+    assert serial == sorted(path.name for path in (tmp_path / 'pipelined').iterdir())
+    for name in serial:
+        assert (tmp_path / 'serial' / name).read_bytes() == (tmp_path / 'pipelined' / name).read_bytes()
+    assert (tmp_path / 'serial.jsonl').read_text() == (tmp_path / 'pipelined.jsonl').read_text()
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16])
+@pytest.mark.parametrize('image_format, png_compression', [('png', 0), ('png', 1), ('png', None), ('png', 9),
+                                                           ('tiff', None)])
+def test_encoded_images_decode_to_the_display_image(dtype, image_format, png_compression):
+    rng = np.random.default_rng(0)
+    display = rng.integers(0, np.iinfo(dtype).max, size=(33, 47), endpoint=True, dtype=dtype)
+
+    data = dicom_converter.encode_image(display, image_format, png_compression)
+
+    with Image.open(io.BytesIO(data)) as image:
+        assert image.format == image_format.upper()
+        assert np.array_equal(np.asarray(image), display)
+
+
+def test_png_compression_level_sets_the_size(tmp_path):
+    create_synthetic_dicom(tmp_path / 'a.dcm', rows=128, cols=128, verbose=False)
+    sizes = {}
+    for level in ('0', '9'):
+        run_converter(tmp_path / 'a.dcm', '-o', tmp_path / level, '--png-compression', level)
+        sizes[level] = (tmp_path / level / 'a.png').stat().st_size
+
+    assert sizes['0'] > 128 * 128 > sizes['9']  # level 0 stores the 8-bit rows uncompressed
+    with Image.open(tmp_path / '0' / 'a.png') as fast, Image.open(tmp_path / '9' / 'a.png') as small:
+        assert np.array_equal(np.asarray(fast), np.asarray(small))
+
+
+@pytest.mark.parametrize('source_type', ['bytes', 'file', 'dataset'])
+@pytest.mark.parametrize('converter_options', [{}, {'frames': [1, 3], 'crop': (4, 2, 16, 20)}])
+def test_converter_accepts_paths_bytes_file_objects_and_datasets(tmp_path, source_type, converter_options):
+    create_synthetic_dicom(tmp_path / 'cine.dcm', rows=32, cols=30, num_frames=5, verbose=False)
+    converter = dicom_converter.Converter(**converter_options)
+    outputs = ('metadata', 'pixels', 'display', 'image', 'gif', 'previews')
+    expected = converter.convert(tmp_path / 'cine.dcm', outputs)
+
+    if source_type == 'bytes':
+        source = (tmp_path / 'cine.dcm').read_bytes()
+    elif source_type == 'file':
+        source = open(tmp_path / 'cine.dcm', 'rb')
+    else:
+        source = pydicom.dcmread(tmp_path / 'cine.dcm')
+    try:
+        result = converter.convert(source, outputs)
+    finally:
+        if source_type == 'file':
+            source.close()
+
+    assert result.source is None and expected.source == str(tmp_path / 'cine.dcm')
+    assert result.metadata == dict(expected.metadata, path=None)
+    for name in ('pixels', 'display'):
+        assert np.array_equal(getattr(result, name), getattr(expected, name))
+    assert result.image == expected.image and result.gif == expected.gif
+    assert result.previews == expected.previews
+    assert expected.display.shape == ((2, 20, 16) if converter_options else (5, 32, 30))
+
+
+def test_converter_methods_match_convert(tmp_path):
+    create_synthetic_dicom(tmp_path / 'slice.dcm', rows=40, cols=36, verbose=False)
+    converter = dicom_converter.Converter()
+    result = converter.convert(tmp_path / 'slice.dcm', ('metadata', 'pixels', 'display', 'image', 'gif'))
+
+    assert converter.metadata(tmp_path / 'slice.dcm') == result.metadata
+    assert np.array_equal(converter.pixels(tmp_path / 'slice.dcm'), result.pixels)
+    assert np.array_equal(converter.display(tmp_path / 'slice.dcm'), result.display)
+    assert converter.to_image(tmp_path / 'slice.dcm') == result.image
+    assert result.gif is None
+    with pytest.raises(ValueError, match='multi-frame'):
+        converter.to_gif(tmp_path / 'slice.dcm')
+    with pytest.raises(ValueError, match='Unknown outputs'):
+        converter.convert(tmp_path / 'slice.dcm', ('png',))
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16])
+def test_downsample_area_averages_blocks(dtype):
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, np.iinfo(dtype).max, size=(9, 7), endpoint=True, dtype=dtype)
+
+    small = dicom_converter.downsample_area(image, 3)
+
+    padded = np.pad(image, [(0, 0), (0, 2)], mode='edge').astype(np.float64)
+    expected = np.floor(padded.reshape(3, 3, 3, 3).mean(axis=(1, 3)) + 0.5)
+    assert small.dtype == dtype and small.shape == (3, 3)
+    assert np.array_equal(small, expected)
+
+
+def test_thumbnail_and_pyramid_outputs(tmp_path):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    create_synthetic_dicom(input_dir / 'slice.dcm', rows=100, cols=60, verbose=False)
+    create_synthetic_dicom(input_dir / 'cine.dcm', rows=32, cols=30, num_frames=20, verbose=False)
+
+    output = run_converter(input_dir, '-o', tmp_path / 'out', '--no-mp4', '--thumbnail', '32', '--pyramid', '2')
+    run_converter(input_dir, '-o', tmp_path / 'sheet', '--no-mp4', '--thumbnail', '64', '--contact-sheet')
+
+    assert 'Previews saved to:' in output
+    sizes = {}
+    for path in (tmp_path / 'out').glob('*_*.png'):
+        with Image.open(path) as image:
+            sizes[path.name] = image.size
+    assert sizes == {'slice_thumb.png': (15, 25), 'slice_L1.png': (30, 50), 'slice_L2.png': (15, 25),
+                     'cine_thumb.png': (30, 32), 'cine_L1.png': (15, 16), 'cine_L2.png': (8, 8)}
+
+    # Middle frame without --contact-sheet, a 4 x 4 mosaic of 16 frames with it
+    display = dicom_converter.Converter().display(input_dir / 'cine.dcm')
+    with Image.open(tmp_path / 'out' / 'cine_L1.png') as image:
+        assert np.array_equal(np.asarray(image), dicom_converter.downsample_area(display[10], 2))
+    sheet = dicom_converter.contact_sheet_image(display[dicom_converter.preview_frame_indices(20, True)])
+    assert sheet.shape == (4 * 32, 4 * 30)
+    with Image.open(tmp_path / 'sheet' / 'cine_thumb.png') as image:
+        assert np.array_equal(np.asarray(image), dicom_converter.downsample_area(sheet, 2))
+
+
+def test_folder_watcher_reports_settled_dicom_files_once_per_version(tmp_path):
+    watcher = dicom_converter.FolderWatcher(tmp_path, settle_s=0)
+    create_synthetic_dicom(tmp_path / 'a.dcm', rows=32, cols=32, verbose=False)
+    (tmp_path / 'notes.txt').write_text('not DICOM')
+
+    # A file is ready once its size and modification time are unchanged for a poll
+    assert watcher.poll() == []
+    assert watcher.arriving_count == 2
+    assert watcher.poll() == [tmp_path / 'a.dcm']
+    assert watcher.poll() == [] and watcher.arriving_count == 0
+
+    create_synthetic_dicom(tmp_path / 'a.dcm', rows=48, cols=48, verbose=False)
+    create_synthetic_dicom(tmp_path / 'b.dcm', rows=32, cols=32, verbose=False)
+    assert watcher.poll() == []
+    assert watcher.poll() == [tmp_path / 'a.dcm', tmp_path / 'b.dcm']
+
+    watcher = dicom_converter.FolderWatcher(tmp_path, settle_s=3600)
+    watcher.poll()
+    assert watcher.poll() == [] and watcher.arriving_count == 3
+
+
+def test_watch_folder_converts_arriving_files(tmp_path):
+    input_dir = tmp_path / 'in'
+    output_dir = tmp_path / 'out'
+    input_dir.mkdir()
+    output_dir.mkdir()
+    create_synthetic_dicom(input_dir / 'a.dcm', rows=32, cols=32, verbose=False)
+    watch = dicom_converter.watch_folder(input_dir, output_dir, {'export_mp4': False}, poll_interval=0.05,
+                                         settle_s=0, stats_path=tmp_path / 'stats.json')
+
+    results = [next(watch)]
+    create_synthetic_dicom(input_dir / 'b.dcm', rows=32, cols=32, num_frames=3, verbose=False)
+    results.append(next(watch))
+    watch.close()
+
+    assert [(Path(dicom_file).name, success) for _, dicom_file, success, *_ in results] == [('a.dcm', True),
+                                                                                          ('b.dcm', True)]
+    assert (output_dir / 'a.png').exists() and (output_dir / 'b.gif').exists()
+    assert json.loads((tmp_path / 'stats.json').read_text())['converted'] == 2
+
+
+def test_heavy_modules_are_imported_only_when_needed(tmp_path):
+    create_synthetic_dicom(tmp_path / 'cine.dcm', rows=32, cols=32, num_frames=3, verbose=False)
+    output_dir = tmp_path / 'out'
+
+    assert benchmark_converter.startup_run(['--help'])[1] == []
+    assert 'cv2' not in benchmark_converter.startup_run([tmp_path, '-o', output_dir, '--no-mp4'])[1]
+    assert 'cv2' in benchmark_converter.startup_run([tmp_path, '-o', output_dir])[1]
+    assert (output_dir / 'cine.mp4').exists()
+    imported = subprocess.run([sys.executable, '-c', 'import sys, dicom_converter; print(*sys.modules)'],
+                              cwd=SCRIPT.parent, capture_output=True, text=True, check=True).stdout.split()
+    assert not set(benchmark_converter.HEAVY_MODULES) & set(imported)
+
+
+@pytest.mark.parametrize('transfer_syntax, use_memmap', [('explicit', False), ('explicit', True), ('rle', False)])
+@pytest.mark.parametrize('frames, crop', [([0, 3, 4], None), (None, (5, 3, 12, 9)), ([6, 2], (20, 25, 40, 40))])
+def test_partial_decoding_matches_slice_of_full_array(tmp_path, transfer_syntax, use_memmap, frames, crop):
+    create_synthetic_dicom(tmp_path / 'cine.dcm', rows=32, cols=30, num_frames=8, transfer_syntax=transfer_syntax,
+                           verbose=False)
+    selection = (frames if frames is not None else slice(None),)
+    if crop is not None:
+        x, y, width, height = crop
+        selection += (slice(y, y + height), slice(x, x + width))
+
+    ds = dicom_converter.read_dicom_header(tmp_path / 'cine.dcm')
+    pixels = dicom_converter.select_pixels(tmp_path / 'cine.dcm', ds, frames, crop, use_memmap)
+
+    assert np.array_equal(pixels, pydicom.dcmread(tmp_path / 'cine.dcm').pixel_array[selection])
+    display = dicom_converter.Converter(frames=frames, crop=crop, use_memmap=use_memmap).display(tmp_path / 'cine.dcm')
+    assert np.array_equal(display, dicom_converter.Converter().display(tmp_path / 'cine.dcm')[selection])
+
+
+def test_frames_and_crop_options_write_the_selected_region(tmp_path):
+    create_synthetic_dicom(tmp_path / 'cine.dcm', rows=32, cols=30, num_frames=8, verbose=False)
+    run_converter(tmp_path / 'cine.dcm', '-o', tmp_path / 'full', '--no-mp4', '--npy')
+
+    output = run_converter(tmp_path / 'cine.dcm', '-o', tmp_path / 'part', '--no-mp4', '--npy',
+                           '--frames', '1,4-5,20', '--crop', '2,3,10,8')
+
+    assert '1 selected frame(s) beyond frame 7 ignored' in output
+    full = np.load(tmp_path / 'full' / 'cine.npy')
+    assert np.array_equal(np.load(tmp_path / 'part' / 'cine.npy'), full[[1, 4, 5], 3:11, 2:12])
+    with Image.open(tmp_path / 'part' / 'cine.gif') as gif:
+        assert gif.n_frames == 3 and gif.size == (10, 8)
+
+
+@pytest.mark.parametrize('transfer_syntax', ['implicit', 'explicit'])
+@pytest.mark.parametrize('bits, signed, num_frames', [(8, False, 1), (16, True, 1), (16, False, 4)])
+def test_memmap_pixels_match_pixel_array(tmp_path, transfer_syntax, bits, signed, num_frames):
+    create_synthetic_dicom(tmp_path / 'a.dcm', rows=33, cols=30, bits=bits, signed=signed, num_frames=num_frames,
+                           transfer_syntax=transfer_syntax, verbose=False)
+
+    ds, pixels = dicom_converter.memmap_pixels(tmp_path / 'a.dcm')
+
+    assert isinstance(pixels, np.memmap) and not pixels.flags.writeable
+    assert 'PixelData' not in ds and len(ds.pixel_data_stub.value) == pixels.nbytes + pixels.nbytes % 2
+    expected = pydicom.dcmread(tmp_path / 'a.dcm').pixel_array
+    assert pixels.dtype == expected.dtype and np.array_equal(pixels, expected)
+
+
+def test_memmap_pixels_rejects_compressed_and_truncated_data(tmp_path):
+    create_synthetic_dicom(tmp_path / 'rle.dcm', rows=32, cols=32, transfer_syntax='rle', verbose=False)
+    create_synthetic_dicom(tmp_path / 'short.dcm', rows=32, cols=32, verbose=False)
+    data = (tmp_path / 'short.dcm').read_bytes()
+    (tmp_path / 'short.dcm').write_bytes(data[:-100])
+
+    assert dicom_converter.memmap_pixels(tmp_path / 'rle.dcm') is None
+    assert dicom_converter.memmap_pixels(tmp_path / 'short.dcm') is None